@@ -0,0 +1,130 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from fpga_config import ConfigError
+
+
+class AsyncVeriStandFPGA(object):
+    """
+    asyncio front end for a VeriStandFPGA.
+
+    Every blocking nifpga call of a device runs on that device's own single thread executor, so the event loop is
+    never blocked and several devices can be serviced from one event loop without waiting on each other. Calls to
+    one device run in the order they were awaited.
+
+    A cancelled read or write cannot interrupt the nifpga call already running on the device thread. That call
+    still completes, so a cancelled read still updates the channel table, and the next call waits for it to finish.
+    """
+
+    def __init__(self, fpga, executor=None):
+        """
+        :param fpga: the VeriStandFPGA to drive
+        :param executor: executor to run the blocking calls on. By default a single worker thread owned by this
+            object is created. Sharing one executor between devices brings back the stalls this class avoids.
+        """
+        self.fpga = fpga
+        self._owns_executor = executor is None
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='VeriStandFPGA')
+        self._executor = executor
+
+    async def _run(self, function, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, function, *args)
+
+    async def init_fpga(self, device, loop_rate, session=None, read_fifo_depth=None, write_fifo_depth=None):
+        """
+        Initialise the device on its thread, see VeriStandFPGA.init_fpga for the arguments.
+        """
+        await self._run(self.fpga.init_fpga, device, loop_rate, session, read_fifo_depth, write_fifo_depth)
+
+    async def start_fpga_main_loop(self):
+        await self._run(self.fpga.start_fpga_main_loop)
+
+    async def stop_fpga(self):
+        await self._run(self.fpga.stop_fpga)
+
+    def set_channel(self, channel_name, value):
+        self.fpga.set_channel(channel_name, value)
+
+    def get_channel(self, channel_name):
+        return self.fpga.get_channel(channel_name)
+
+    async def read(self, timeout):
+        """
+        Read one iteration from the DMA_Read FIFO into the channel table, like VeriStandFPGA.vs_read_fifo.
+        """
+        await self._run(self.fpga.vs_read_fifo, timeout)
+
+    async def write(self, timeout):
+        """
+        Write the channel table to the DMA_Write FIFO, like VeriStandFPGA.vs_write_fifo.
+        """
+        await self._run(self.fpga.vs_write_fifo, timeout)
+
+    async def iterations(self, timeout, max_pending=16):
+        """
+        Asynchronously iterate over the decoded read iterations of the device.
+        A background task keeps reading frames ahead of the consumer, at most max_pending of them. When the
+        consumer falls behind that task stops reading and the backlog is left in the DMA_Read FIFO, where the
+        FPGA reports it through 'Is Late?' and the FIFO occupancy. Leaving the loop stops the background task.
+        Frames are read as by read, so each one updates the channel table, the recorder, the shared table, the
+        backlog and the metrics when it is read, ahead of the consumer. Each iteration is yielded as its own
+        dictionary, decoded from its frame.
+        The frames read ahead and not yet consumed when the loop is left, at most max_pending plus the one being
+        read, are taken out of the FIFO but never yielded. They are still recorded and were unpacked into the
+        channel table.
+        :param timeout: timeout in ms of each FIFO read. A FIFO timeout is raised to the consumer.
+        :param max_pending: largest number of frames read ahead of the consumer
+        :return: async iterator of dictionaries with the read channel names as keys
+        """
+        fpga = self.fpga
+        if fpga.read_fifo_object is None:
+            raise ConfigError('Session not initialized. Please first call the'
+                              ' init_fpga method before reading')
+        if fpga.fifo_reader is not None:
+            raise ConfigError('DMA_READ is being drained by the streaming reader')
+        if fpga.fifo_decoder is not None:
+            raise ConfigError('DMA_READ is being drained by the decode executor')
+        queue = asyncio.Queue(maxsize=max_pending)
+        producer = asyncio.ensure_future(self._produce_frames(queue, timeout))
+        try:
+            while True:
+                frame = await queue.get()
+                if isinstance(frame, BaseException):
+                    raise frame
+                real_values = {}
+                for i, u64 in enumerate(frame):
+                    this_packet = fpga.read_packet_list[i]
+                    this_packet._unpack_into(u64, real_values, this_packet._names)
+                yield real_values
+        finally:
+            producer.cancel()
+            try:
+                await producer
+            except asyncio.CancelledError:
+                pass
+
+    async def _produce_frames(self, queue, timeout):
+        while True:
+            try:
+                read_tup = await self._run(self.fpga._read_frame, timeout)
+            except asyncio.CancelledError:
+                raise
+            except BaseException as error:
+                await queue.put(error)
+                return
+            await queue.put(read_tup.data)
+
+    async def close(self):
+        """
+        Shut down the executor if this object created it. The FPGA session is left as it is.
+        """
+        if self._owns_executor:
+            await asyncio.get_running_loop().run_in_executor(None, self._executor.shutdown)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exception_type, exception_val, trace):
+        await self.close()
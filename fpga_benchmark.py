@@ -0,0 +1,612 @@
+"""
+Benchmarks of the host side of the VeriStand FPGA API. They run against stand-in sessions, so no NI target or
+nifpga driver is needed.
+
+    python fpga_benchmark.py                          run every benchmark
+    python fpga_benchmark.py codec iteration          run some of them, see BENCHMARKS
+    python fpga_benchmark.py --save baseline.json     also save the results
+    python fpga_benchmark.py --compare baseline.json  fail if any result is slower than the saved one
+
+Every result is recorded in results under a stable name, as a time in seconds or a number of bytes, so that lower is
+always better. Comparing against a saved run exits with status 1 when a result grew by more than the tolerance.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from array import array
+from collections import namedtuple, OrderedDict
+
+import fpga_config
+from fpga_group import FPGAGroup
+from fpga_metrics import Instrumentation
+from fpga_simulator import SimulatedRegister, SimulatedSession, write_synthetic_config
+
+
+results = OrderedDict()
+
+
+def record(name, value):
+    """
+    Keep a benchmark result, in seconds or bytes, lower being better.
+    """
+    results[name] = value
+
+
+class StaticFIFO(object):
+    """
+    FIFO that hands back the same frame immediately on every read and discards writes, so that a benchmark only
+    measures the cost of the API itself.
+    """
+    ReadValues = namedtuple('ReadValues', ['data', 'elements_remaining'])
+
+    def __init__(self, frame):
+        self.frame = frame
+
+    def read(self, number_of_elements, timeout_ms=0):
+        return self.ReadValues(data=list(self.frame[:number_of_elements]), elements_remaining=0)
+
+    def read_into(self, buffer, timeout_ms=0):
+        buffer[:] = self.frame
+        return 0
+
+    def write(self, data, timeout_ms=0):
+        return 0
+
+    def write_from(self, buffer, timeout_ms=0):
+        return 0
+
+
+class StaticSession(object):
+    """
+    Session of StaticFIFOs and the template registers, to pass to VeriStandFPGA.init_fpga.
+    """
+
+    def __init__(self, config):
+        frame = array('Q', [0x0123456789ABCDEF] * config.read_packets)
+        frame[0] = 0
+        self.fifos = {'DMA_READ': StaticFIFO(frame), 'DMA_WRITE': StaticFIFO(None)}
+        self.registers = {name: SimulatedRegister(name, False) for name in
+                          ('Loop Rate (usec)', 'Start', 'Write to  RTSI', 'Use External Timing', 'Generate IRQ')}
+        self.fpga_vi_state = 'Running'
+
+    def download(self):
+        pass
+
+    def run(self):
+        pass
+
+    def reset(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def static_fpga(read_packets, write_packets, folder):
+    """
+    :return: a VeriStandFPGA for a synthetic configuration, initialised on a StaticSession
+    """
+    config_path = os.path.join(folder, 'synthetic_{}_{}.fpgaconfig'.format(read_packets, write_packets))
+    write_synthetic_config(config_path, read_packets, write_packets)
+    fpga = fpga_config.VeriStandFPGA(config_path)
+    fpga.init_fpga(None, 1000, session=StaticSession(fpga))
+    return fpga
+
+
+def allocation_profile(step, iterations=2000, warmup=200):
+    """
+    Trace the memory allocated by repeated calls of step.
+    :return: (bytes retained per iteration, largest number of bytes live at once during one iteration)
+    """
+    for _ in range(warmup):
+        step()
+    tracemalloc.start()
+    try:
+        start, _ = tracemalloc.get_traced_memory()
+        peak_in_iteration = 0
+        for _ in range(iterations):
+            before, _ = tracemalloc.get_traced_memory()
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            step()
+            _, peak = tracemalloc.get_traced_memory()
+            peak_in_iteration = max(peak_in_iteration, peak - before)
+        end, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return (end - start) / float(iterations), peak_in_iteration
+
+
+def bench_allocations(folder, read_packets=64, write_packets=64):
+    """
+    Compare the memory allocated per read/write iteration by the list based and the buffered FIFO paths.
+    Neither path retains memory per iteration. The buffered path creates no lists, so the peak within an iteration
+    is only the short-lived int and float objects of the decode, a few hundred bytes, which are still allocated.
+    """
+    fpga = static_fpga(read_packets, write_packets, folder)
+
+    def list_step():
+        fpga.vs_read_fifo(timeout=0)
+        fpga.vs_write_fifo(timeout=0)
+
+    def buffered_step():
+        fpga.vs_read_fifo_buffered(timeout=0)
+        fpga.vs_write_fifo_buffered(timeout=0)
+
+    print('Allocations per iteration, {} read and {} write packets'.format(read_packets, write_packets))
+    for name, step in (('vs_read_fifo + vs_write_fifo', list_step),
+                       ('buffered read + write', buffered_step)):
+        retained, peak = allocation_profile(step)
+        record('allocations.{}.retained_bytes'.format('buffered' if step is buffered_step else 'list'), retained)
+        print('  {:<32} retained {:8.2f} B/iteration, peak live {:6d} B'.format(name, retained, peak))
+
+
+def best_time(step, repeats=5):
+    """
+    :return: the shortest of repeats timed calls of step, in seconds
+    """
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        step()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_startup(folder, sizes=(16, 256, 2048)):
+    """
+    Compare the time taken to create a VeriStandFPGA from a synthetic configuration when the XML is parsed, when
+    the layout comes from the disk cache, as in a new process, and when it was already loaded by this process.
+    Also times importing fpga_config in a fresh interpreter, which does not import nifpga.
+    """
+    cache_dir = os.path.join(folder, 'layout_cache')
+    print('Startup time of VeriStandFPGA(config) in ms')
+    print('  {:>8} {:>10} {:>12} {:>10}'.format('packets', 'parse', 'disk cache', 'in memory'))
+    # VeriStandFPGA.__del__ reports every configuration it closes
+    with contextlib.redirect_stdout(io.StringIO()):
+        for packets in sizes:
+            config_path = os.path.join(folder, 'startup_{}.fpgaconfig'.format(packets))
+            write_synthetic_config(config_path, packets, packets)
+            shutil.rmtree(cache_dir, ignore_errors=True)
+            parse = best_time(lambda: fpga_config.VeriStandFPGA(config_path, use_cache=False))
+            fpga_config.VeriStandFPGA(config_path, cache_dir=cache_dir)
+
+            def from_disk():
+                fpga_config._layout_memo.clear()
+                fpga_config.VeriStandFPGA(config_path, cache_dir=cache_dir)
+
+            disk = best_time(from_disk)
+            fpga_config.VeriStandFPGA(config_path, cache_dir=cache_dir)
+            memory = best_time(lambda: fpga_config.VeriStandFPGA(config_path, cache_dir=cache_dir))
+            record('startup.parse.{}'.format(packets), parse)
+            record('startup.disk_cache.{}'.format(packets), disk)
+            record('startup.in_memory.{}'.format(packets), memory)
+            sys.__stdout__.write('  {:>8} {:>10.2f} {:>12.2f} {:>10.2f}\n'.format(packets, parse * 1e3, disk * 1e3,
+                                                                                    memory * 1e3))
+    script = 'import sys, time; start = time.perf_counter(); import fpga_config; ' \
+             'print(time.perf_counter() - start, "nifpga" in sys.modules)'
+    output = subprocess.check_output([sys.executable, '-c', script],
+                                     cwd=os.path.dirname(os.path.abspath(fpga_config.__file__)))
+    import_time, nifpga_imported = output.decode().split()
+    print('  import fpga_config {:.2f} ms, nifpga imported: {}'.format(float(import_time) * 1e3, nifpga_imported))
+
+
+def bench_write_encoding(folder, write_packets=512, iterations=2000):
+    """
+    Time vs_write_fifo as the number of channels changed between writes grows. Only the write packets holding a
+    changed channel are packed again, so the cost follows the changes rather than the number of packets.
+    """
+    fpga = static_fpga(2, write_packets, folder)
+    handles = [this_packet._handles[0] for this_packet in fpga.write_packet_list]
+    print('vs_write_fifo with {} write packets, in us per write'.format(write_packets))
+    for changed in (0, 1, 16, write_packets):
+        changed_handles = handles[:changed]
+
+        def step():
+            for handle in changed_handles:
+                fpga.set_channel_by_handle(handle, fpga.channel_values[handle] == 0)
+            fpga.vs_write_fifo(timeout=0)
+
+        step()
+        elapsed = best_time(lambda: [step() for _ in range(iterations)], repeats=3)
+        record('write_encoding.changed_{}'.format(changed), elapsed / iterations)
+        print('  {:>4} changed packets {:10.2f}'.format(changed, elapsed / iterations * 1e6))
+
+
+def bench_stimulus(folder, write_packets=64, iterations=5000):
+    """
+    Compare playing a stimulus that changes every write channel on every iteration through set_channels and
+    vs_write_fifo with encoding it in one pass with encode_write_frames, and playing the frames with start_stimulus.
+    """
+    if fpga_config.np is None:
+        print('stimulus benchmark skipped, it needs numpy')
+        return
+    np = fpga_config.np
+    fpga = static_fpga(2, write_packets, folder)
+    names = [name for this_packet in fpga.write_packet_list for name in this_packet._names]
+    phase = np.linspace(0, 2 * np.pi, iterations)
+    stimulus = dict((name, 50 + 40 * np.sin(phase + i)) for i, name in enumerate(names))
+    rows = [dict((name, float(column[iteration])) for name, column in stimulus.items())
+            for iteration in range(iterations)]
+
+    def per_iteration():
+        for row in rows:
+            fpga.set_channels(row)
+            fpga.vs_write_fifo(timeout=0)
+
+    def play():
+        writer = fpga.start_stimulus(fpga.encode_write_frames(stimulus), chunk_frames=1024)
+        writer.join()
+        fpga.stop_stimulus()
+
+    print('Stimulus of {} iterations over {} write packets, in us per iteration'.format(iterations, write_packets))
+    for name, label, step in (('per_iteration', 'set_channels + vs_write_fifo', per_iteration),
+                              ('encode', 'encode_write_frames', lambda: fpga.encode_write_frames(stimulus)),
+                              ('encode_and_play', 'encode and start_stimulus', play)):
+        elapsed = best_time(step, repeats=3) / iterations
+        record('stimulus.{}'.format(name), elapsed)
+        print('  {:<30} {:10.2f}'.format(label, elapsed * 1e6))
+
+
+def bench_subscriptions(folder, read_packets=256, iterations=2000):
+    """
+    Time vs_read_fifo decoding every read channel, and with a few channels subscribed so that only they are
+    decoded and the rest of the frame is left raw.
+    """
+    fpga = static_fpga(read_packets, 2, folder)
+    names = [name for this_packet in fpga.read_packet_list[1:] for name in this_packet._names]
+    print('vs_read_fifo with {} read packets, in us per read'.format(read_packets))
+    for subscribed in (None, 64, 4):
+        fpga.unsubscribe()
+        if subscribed:
+            fpga.subscribe(names[::len(names) // subscribed][:subscribed])
+
+        def step():
+            for _ in range(iterations):
+                fpga.vs_read_fifo(timeout=0)
+
+        label = 'every channel' if subscribed is None else '{} subscribed'.format(subscribed)
+        elapsed = best_time(step, repeats=3) / iterations
+        record('subscriptions.{}'.format('all' if subscribed is None else subscribed), elapsed)
+        print('  {:<16} {:10.2f}'.format(label, elapsed * 1e6))
+
+
+def bench_pipeline(samples=100000, batch=1000):
+    """
+    Compare a low pass, decimate and block min/max/mean pipeline over one channel run per sample in Python with the
+    vectorized fpga_pipeline stages fed in batches.
+    """
+    if fpga_config.np is None:
+        print('pipeline benchmark skipped, it needs numpy')
+        return
+    from fpga_pipeline import Pipeline, IIRFilter, Decimate, BlockReduce
+    np = fpga_config.np
+    signal = np.sin(np.arange(samples) / 50.0) + np.random.default_rng(0).standard_normal(samples) * 0.1
+    low_pass = IIRFilter.low_pass(50, 10000, ['AI0'])
+    b, a = low_pass.b, low_pass.a
+
+    def per_sample():
+        z1 = z2 = 0.0
+        count = 0
+        low = high = total = 0.0
+        outputs = []
+        for n, x in enumerate(signal.tolist()):
+            y = b[0] * x + z1
+            z1 = b[1] * x - a[1] * y + z2
+            z2 = b[2] * x - a[2] * y
+            if n % 10:
+                continue
+            if not count:
+                low = high = total = y
+            else:
+                low = min(low, y)
+                high = max(high, y)
+                total += y
+            count += 1
+            if count == 100:
+                outputs.append((low, high, total / count))
+                count = 0
+        return outputs
+
+    def vectorized():
+        pipeline = Pipeline([IIRFilter.low_pass(50, 10000, ['AI0']), Decimate(10), BlockReduce(100)])
+        for start in range(0, samples, batch):
+            pipeline.feed({'AI0': signal[start:start + batch]})
+        return pipeline.result()
+
+    print('Low pass, decimate by 10 and min/max/mean of 100 over {} samples, in us per sample'.format(samples))
+    per_sample_time = best_time(per_sample, repeats=3) / samples
+    pipeline_time = best_time(vectorized, repeats=3) / samples
+    record('pipeline.per_sample_python', per_sample_time)
+    record('pipeline.vectorized', pipeline_time)
+    print('  per sample in Python       {:10.3f}'.format(per_sample_time * 1e6))
+    print('  Pipeline, batches of {:<5} {:10.3f}'.format(batch, pipeline_time * 1e6))
+
+
+def bench_metrics(folder, read_packets=16, write_packets=16, iterations=20000):
+    """
+    Time a read/write iteration with metrics disabled and enabled, to show what the instrumentation costs.
+    """
+    fpga = static_fpga(read_packets, write_packets, folder)
+    handle = fpga.write_packet_list[0]._handles[0]
+
+    def step():
+        fpga.vs_read_fifo(timeout=0)
+        fpga.set_channel_by_handle(handle, not fpga.channel_values[handle])
+        fpga.vs_write_fifo(timeout=0)
+
+    print('Read/write iteration, {} read and {} write packets, in us'.format(read_packets, write_packets))
+    for name, key, sample_every in (('metrics disabled', 'disabled', None),
+                                    ('metrics enabled', 'enabled', 1),
+                                    ('sampling 1 in 16', 'sampled_16', 16)):
+        if sample_every is None:
+            fpga.disable_metrics()
+        else:
+            fpga.enable_metrics(sample_every=sample_every)
+        elapsed = best_time(lambda: [step() for _ in range(iterations)], repeats=3)
+        record('metrics.{}'.format(key), elapsed / iterations)
+        print('  {:<20} {:8.2f}'.format(name, elapsed / iterations * 1e6))
+    fpga.disable_metrics()
+
+    # The difference between whole iterations is within the noise of most machines, so also time the calls the
+    # read and write paths make into the instrumentation on their own
+    print('Instrumentation calls of one iteration alone, in us')
+    for name, key, sample_every in (('every iteration', 'calls', 1), ('sampling 1 in 16', 'calls_sampled_16', 16)):
+        metrics = Instrumentation(sample_every=sample_every)
+
+        def instrumented():
+            for _ in range(iterations):
+                started = metrics.clock()
+                transferred = metrics.clock()
+                metrics.read_done(started, transferred, metrics.clock(), False)
+                metrics.backlog(0)
+                started = metrics.clock()
+                packed = metrics.clock()
+                metrics.write_done(started, packed, metrics.clock())
+
+        elapsed = best_time(instrumented, repeats=5)
+        record('metrics.{}'.format(key), elapsed / iterations)
+        print('  {:<20} {:8.2f}'.format(name, elapsed / iterations * 1e6))
+
+
+def bench_group(folder, device_counts=(1, 2, 4, 8), iterations=200, call_latency=0.0005):
+    """
+    Compare the aggregate read/write iterations per second of devices driven one after the other from one loop and
+    driven as an FPGAGroup, on simulated sessions whose FIFO calls take call_latency seconds in the driver.
+    """
+    config_path = os.path.join(folder, 'group.fpgaconfig')
+    write_synthetic_config(config_path, 8, 8)
+    print('Aggregate iterations per second, FIFO calls taking {:.1f} ms'.format(call_latency * 1e3))
+    print('  {:>7} {:>10} {:>10}'.format('devices', 'serial', 'FPGAGroup'))
+    with contextlib.redirect_stdout(io.StringIO()):
+        for count in device_counts:
+            group = FPGAGroup(('device{}'.format(i), fpga_config.VeriStandFPGA(config_path)) for i in range(count))
+            frame = [0] + [0x0000100000001000] * 7
+            sessions = dict((namespace, SimulatedSession(fpga, rate_hz=20000, frame_source=lambda iteration: frame,
+                                                         call_latency=call_latency))
+                            for namespace, fpga in group.devices.items())
+            group.init_fpga({}, 1000, sessions=sessions)
+            group.start_fpga_main_loop()
+            start = time.perf_counter()
+            for _ in range(iterations):
+                for fpga in group.devices.values():
+                    fpga.vs_read_fifo(timeout=1000)
+                    fpga.vs_write_fifo(timeout=1000)
+            serial = time.perf_counter() - start
+            start = time.perf_counter()
+            for _ in range(iterations):
+                group.vs_read_write_fifo(timeout=1000)
+            grouped = time.perf_counter() - start
+            group.stop_fpga()
+            group.close()
+            record('group.serial.{}'.format(count), serial / (count * iterations))
+            record('group.grouped.{}'.format(count), grouped / (count * iterations))
+            sys.__stdout__.write('  {:>7} {:>10.0f} {:>10.0f}\n'.format(count, count * iterations / serial,
+                                                                        count * iterations / grouped))
+
+
+def bench_codec(folder, iterations=20000):
+    """
+    Time decoding and encoding a single packet of each data type, with the scalar codec used per iteration and with
+    the vectorized codec used for batches, recordings and stimuli.
+    """
+    config_path = os.path.join(folder, 'codec.fpgaconfig')
+    write_synthetic_config(config_path, 5, 4)
+    with contextlib.redirect_stdout(io.StringIO()):
+        fpga = fpga_config.VeriStandFPGA(config_path)
+    # Packet p of the synthetic configuration has layout p % 4
+    kinds = (('I16', 3), ('Boolean', 0), ('FXPI32', 1), ('PWM', 2))
+    word = 0x0123456789ABCDEF
+    values = fpga.channel_values
+    print('Codec per packet, in us: scalar unpack and pack, vectorized unpack and pack per frame')
+    for kind, write_index in kinds:
+        read_packet = fpga.read_packet_list[write_index + 1]
+        write_packet = fpga.write_packet_list[write_index]
+        read_handles = read_packet._handles
+        write_handles = write_packet._handles
+        for handle in write_handles:
+            values[handle] = 1.5
+        unpack = best_time(lambda: [read_packet._unpack_into(word, values, read_handles)
+                                    for _ in range(iterations)], repeats=3) / iterations
+        pack = best_time(lambda: [write_packet._pack_from(values, write_handles)
+                                  for _ in range(iterations)], repeats=3) / iterations
+        record('codec.unpack.{}'.format(kind), unpack)
+        record('codec.pack.{}'.format(kind), pack)
+        line = '  {:<8} {:8.3f} {:8.3f}'.format(kind, unpack * 1e6, pack * 1e6)
+        if fpga_config.np is not None:
+            np = fpga_config.np
+            words = np.full(iterations, word, dtype=np.uint64)
+            columns = [np.full(iterations, 1.5) for _ in write_handles]
+            unpack_array = best_time(lambda: read_packet._unpack_array(words), repeats=3) / iterations
+            pack_array = best_time(lambda: write_packet._pack_array(columns, iterations), repeats=3) / iterations
+            record('codec.unpack_array.{}'.format(kind), unpack_array)
+            record('codec.pack_array.{}'.format(kind), pack_array)
+            line += ' {:8.3f} {:8.3f}'.format(unpack_array * 1e6, pack_array * 1e6)
+        print(line)
+
+
+def bench_iteration(folder, sizes=(8, 64, 512), iterations=2000, simulated_iterations=2000):
+    """
+    Time a full iteration, reading a frame, setting one channel and writing a frame, as the number of packets in
+    each direction grows. The list based and buffered paths run against a StaticSession, which measures the API
+    alone, and the list based path also runs against a SimulatedSession generating frames from the layout, which
+    adds the cost of the simulated FIFOs.
+    """
+    print('Read/write iteration as packets scale, in us per iteration')
+    print('  {:>7} {:>10} {:>10} {:>10}'.format('packets', 'list', 'buffered', 'simulated'))
+    with contextlib.redirect_stdout(io.StringIO()):
+        for packets in sizes:
+            fpga = static_fpga(packets, packets, folder)
+            handle = fpga.write_packet_list[0]._handles[0]
+
+            def step():
+                for _ in range(iterations):
+                    fpga.vs_read_fifo(timeout=0)
+                    fpga.set_channel_by_handle(handle, not fpga.channel_values[handle])
+                    fpga.vs_write_fifo(timeout=0)
+
+            def buffered_step():
+                for _ in range(iterations):
+                    fpga.vs_read_fifo_buffered(timeout=0)
+                    fpga.set_channel_by_handle(handle, not fpga.channel_values[handle])
+                    fpga.vs_write_fifo_buffered(timeout=0)
+
+            listed = best_time(step, repeats=3) / iterations
+            buffered = None
+            if fpga_config.np is not None:
+                buffered = best_time(buffered_step, repeats=3) / iterations
+
+            config_path = os.path.join(folder, 'synthetic_{}_{}.fpgaconfig'.format(packets, packets))
+            simulated_fpga = fpga_config.VeriStandFPGA(config_path)
+            # Run the simulated FPGA far faster than the host can keep up, so that a frame is always waiting
+            session = SimulatedSession(simulated_fpga, rate_hz=10 ** 6, fifo_depth=packets * 1000)
+            simulated_fpga.init_fpga(None, 1000, session=session)
+            simulated_fpga.start_fpga_main_loop()
+            start = time.perf_counter()
+            for _ in range(simulated_iterations):
+                simulated_fpga.vs_read_fifo(timeout=1000)
+                simulated_fpga.set_channel_by_handle(handle, not simulated_fpga.channel_values[handle])
+                simulated_fpga.vs_write_fifo(timeout=1000)
+            simulated = (time.perf_counter() - start) / simulated_iterations
+            simulated_fpga.stop_fpga()
+
+            record('iteration.list.{}'.format(packets), listed)
+            if buffered is not None:
+                record('iteration.buffered.{}'.format(packets), buffered)
+            record('iteration.simulated.{}'.format(packets), simulated)
+            sys.__stdout__.write('  {:>7} {:>10.2f} {:>10} {:>10.2f}\n'.format(
+                packets, listed * 1e6, '-' if buffered is None else '{:.2f}'.format(buffered * 1e6),
+                simulated * 1e6))
+
+
+def bench_decode_pool(folder, read_packets=256, iterations=20000, worker_counts=(1, 2, 4), chunk_frames=2048):
+    """
+    Compare decoding a block of frames in this process with decode_read_frames against decoding it across a pool
+    of worker processes with fpga_decode.DecodeExecutor, at several worker counts. The pool only gains on a machine
+    with CPUs to spare for the workers.
+    """
+    if fpga_config.np is None:
+        print('Decode pool skipped, numpy is not installed')
+        return
+    from fpga_decode import DecodeExecutor
+    np = fpga_config.np
+    config_path = os.path.join(folder, 'decode_pool.fpgaconfig')
+    write_synthetic_config(config_path, read_packets, 4)
+    with contextlib.redirect_stdout(io.StringIO()):
+        fpga = fpga_config.VeriStandFPGA(config_path)
+    frames = np.random.default_rng(0).integers(0, 2 ** 63, size=(iterations, fpga.read_packets), dtype=np.uint64)
+    single = best_time(lambda: fpga.decode_read_frames(frames), repeats=3) / iterations
+    record('decode_pool.single_process', single)
+    print('Decoding {} frames of {} read packets on {} CPUs, in us per frame'.format(iterations, fpga.read_packets,
+                                                                                     os.cpu_count()))
+    print('  {:<16} {:8.2f}'.format('single process', single * 1e6))
+    for workers in worker_counts:
+        with DecodeExecutor(fpga.layout(), workers=workers, chunk_frames=chunk_frames) as executor:
+            # The first block also starts the worker processes
+            executor.decode(frames[:chunk_frames])
+            elapsed = best_time(lambda: executor.decode(frames), repeats=3) / iterations
+        record('decode_pool.workers_{}'.format(workers), elapsed)
+        print('  {:<16} {:8.2f}   {:.2f}x'.format('{} workers'.format(workers), elapsed * 1e6, single / elapsed))
+
+
+BENCHMARKS = OrderedDict((
+    ('startup', bench_startup),
+    ('codec', bench_codec),
+    ('iteration', bench_iteration),
+    ('allocations', bench_allocations),
+    ('write_encoding', bench_write_encoding),
+    ('stimulus', bench_stimulus),
+    ('subscriptions', bench_subscriptions),
+    ('decode_pool', bench_decode_pool),
+    ('pipeline', lambda folder: bench_pipeline()),
+    ('metrics', bench_metrics),
+    ('group', bench_group),
+))
+
+
+def compare(baseline, tolerance):
+    """
+    Compare results with those of a saved run.
+    :param baseline: dictionary of results of the earlier run
+    :param tolerance: relative growth of a result above which it counts as a regression
+    :return: names of the results that regressed
+    """
+    regressions = []
+    print('Compared with the baseline, tolerance {:.0f} %'.format(tolerance * 100))
+    for name, value in results.items():
+        if name not in baseline or not baseline[name]:
+            continue
+        change = value / baseline[name] - 1
+        regressed = change > tolerance
+        if regressed:
+            regressions.append(name)
+        print('  {:<40} {:+8.1f} %{}'.format(name, change * 100, '  REGRESSION' if regressed else ''))
+    return regressions
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of the VeriStand FPGA API, run on stand-in sessions')
+    parser.add_argument('benchmarks', nargs='*',
+                        help='benchmarks to run, all of them by default: {}'.format(', '.join(BENCHMARKS)))
+    parser.add_argument('--save', help='save the results to this JSON file')
+    parser.add_argument('--compare', help='compare the results with those saved in this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='relative slowdown counted as a regression by --compare, 0.25 by default')
+    options = parser.parse_args(arguments)
+    for name in options.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error('unknown benchmark {}, choose from {}'.format(name, ', '.join(BENCHMARKS)))
+    folder = tempfile.mkdtemp()
+    # The configurations are made up for the run, keep their layouts out of the user's cache
+    cache_dir = os.environ.get('VERISTAND_FPGA_CACHE')
+    os.environ['VERISTAND_FPGA_CACHE'] = os.path.join(folder, 'layout_cache')
+    try:
+        for name in options.benchmarks or BENCHMARKS:
+            BENCHMARKS[name](folder)
+    finally:
+        if cache_dir is None:
+            del os.environ['VERISTAND_FPGA_CACHE']
+        else:
+            os.environ['VERISTAND_FPGA_CACHE'] = cache_dir
+        shutil.rmtree(folder, ignore_errors=True)
+    if options.save:
+        with open(options.save, 'w') as results_file:
+            json.dump(results, results_file, indent=2)
+    if options.compare:
+        with open(options.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        if compare(baseline, options.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
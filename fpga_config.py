@@ -1,6 +1,54 @@
 import xml.etree.ElementTree as ET
-from nifpga import Session
 import ntpath
+import ctypes
+import hashlib
+import json
+import os
+from array import array
+from collections import OrderedDict
+from types import MappingProxyType
+try:
+    from collections.abc import Mapping, MutableMapping
+except ImportError:
+    from collections import Mapping, MutableMapping
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# Data type codes used by the compiled packet plans
+_BOOLEAN = 0
+_I16 = 1
+_FXPI32 = 2
+_PWM = 3
+_UNSUPPORTED = 4
+
+# Bump whenever the layout dictionaries produced by _parse_layout change shape, to invalidate existing cache files
+_CACHE_VERSION = 1
+_FIRST_READ_DEFINITION = {'channel_count': 1, 'name0': 'Is Late?', 'data_type0': 'Boolean'}
+# Layouts already loaded by this process, the most recently used last, keyed on absolute path and holding the
+# SHA-1 of the file contents they were parsed from
+_layout_memo = OrderedDict()
+# Most layouts kept in memory, and most cache files kept in the cache directory
+_LAYOUT_MEMO_SIZE = 32
+_CACHE_FILES = 64
+
+
+class _CachedLayout(object):
+    """
+    A layout loaded by this process, with the PacketLayouts compiled from it once a VeriStandFPGA has needed them.
+    """
+    __slots__ = ('layout', 'packet_layouts')
+
+    def __init__(self, layout):
+        self.layout = layout
+        self.packet_layouts = None
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError('numpy is required for batch and buffered FIFO access. Install it with pip install numpy')
 
 
 class VeriStandError(Exception):
@@ -20,6 +68,10 @@ class ConfigError(VeriStandError):
     def __init__(self, message):
         self.message = message
 
+    def __reduce__(self):
+        # Rebuilt from message however it was raised, so that it can come back from a worker process
+        return self.__class__, (self.message,)
+
 
 class PacketError(VeriStandError):
     """
@@ -33,6 +85,207 @@ class PacketError(VeriStandError):
         self.message = message
         self.packetID = packetID
 
+    def __reduce__(self):
+        return self.__class__, (self.message, self.packetID)
+
+
+class ChannelTable(MutableMapping):
+    """
+    Name keyed view of the channel values array of a VeriStandFPGA.
+    This keeps the old channel_value_table dictionary interface working on top of the channel handles.
+    Boolean channels are returned as bools, every other channel as a float. The handle API and channel_values hold
+    Booleans as 1.0 and 0.0.
+    """
+
+    def __init__(self, config):
+        self._handles = config.channel_handles
+        self._values = config.channel_values
+        self._boolean_handles = config._boolean_handles
+        self._dirty_packets = config._dirty_packets
+        self._write_packets_of = config._write_packets_of
+        self._pending_reads = config._pending_reads
+
+    def __getitem__(self, channel_name):
+        handle = self._handles[channel_name]
+        if self._pending_reads.frame is not None:
+            self._pending_reads.refresh(handle)
+        if handle in self._boolean_handles:
+            return bool(self._values[handle])
+        return self._values[handle]
+
+    def __setitem__(self, channel_name, value):
+        handle = self._handles[channel_name]
+        self._values[handle] = value
+        self._dirty_packets.update(self._write_packets_of[handle])
+
+    def __delitem__(self, channel_name):
+        raise TypeError('Channels cannot be removed from a VeriStandFPGA channel table')
+
+    def __iter__(self):
+        return iter(self._handles)
+
+    def __len__(self):
+        return len(self._handles)
+
+
+def load_layout(filepath, cache_dir=None, use_cache=True):
+    """
+    Parse the packet layout of an .fpgaconfig file, in the form returned by VeriStandFPGA.layout.
+    Parsed layouts are cached in memory and as JSON files in cache_dir, keyed on the path of the configuration
+    file. The file is read and hashed on every load, and a cached layout is only used while the SHA-1 of the file
+    contents is the one it was parsed from. Hashing costs far less than parsing, and unlike the modification time it
+    cannot miss an edit. Only the most recently used layouts are kept, in memory and in cache_dir.
+    :param filepath: path of the .fpgaconfig file
+    :param cache_dir: directory of the cache files. Defaults to the VERISTAND_FPGA_CACHE environment variable, or
+        ~/.cache/veristand_fpga
+    :param use_cache: False to always parse the file, without reading or writing the cache
+    :return: dictionary with the bitfile name, the read_packets and write_packets counts and the read and write
+        lists of packet definitions. It is shared between callers and must not be modified.
+    """
+    return _load_cached_layout(filepath, cache_dir, use_cache).layout
+
+
+def _load_cached_layout(filepath, cache_dir, use_cache):
+    if not use_cache:
+        with open(filepath, 'rb') as config_file:
+            return _CachedLayout(_parse_layout(config_file.read()))
+    path = os.path.abspath(filepath)
+    with open(path, 'rb') as config_file:
+        content = config_file.read()
+    digest = hashlib.sha1(content).hexdigest()
+    memo = _layout_memo.get(path)
+    if memo is not None and memo[0] == digest:
+        _layout_memo.move_to_end(path)
+        return memo[1]
+    if cache_dir is None:
+        cache_dir = os.environ.get('VERISTAND_FPGA_CACHE') or os.path.join(os.path.expanduser('~'), '.cache',
+                                                                          'veristand_fpga')
+    cache_path = os.path.join(cache_dir, hashlib.sha1(path.encode('utf-8')).hexdigest() + '.json')
+    entry = _read_cache_entry(cache_path, path)
+    if entry is not None and entry.get('sha1') == digest:
+        layout = entry['layout']
+        _touch(cache_path)
+    else:
+        layout = _parse_layout(content)
+        _write_cache_entry(cache_path, {'version': _CACHE_VERSION, 'path': path, 'sha1': digest, 'layout': layout})
+        _evict_cache_files(cache_dir)
+    cached = _CachedLayout(layout)
+    _layout_memo[path] = (digest, cached)
+    _layout_memo.move_to_end(path)
+    while len(_layout_memo) > _LAYOUT_MEMO_SIZE:
+        _layout_memo.popitem(last=False)
+    return cached
+
+
+def _read_cache_entry(cache_path, path):
+    try:
+        with open(cache_path, 'r') as cache_file:
+            entry = json.load(cache_file)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(entry, dict) or entry.get('version') != _CACHE_VERSION or entry.get('path') != path:
+        return None
+    return entry
+
+
+def _write_cache_entry(cache_path, entry):
+    """
+    Write a cache file atomically. The cache is only an optimisation, so failing to write it is not an error.
+    """
+    temp_path = '{}.{}.tmp'.format(cache_path, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(temp_path, 'w') as cache_file:
+            json.dump(entry, cache_file)
+        os.replace(temp_path, cache_path)
+    except OSError:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+
+
+def _touch(cache_path):
+    """
+    Mark a cache file as just used, for _evict_cache_files.
+    """
+    try:
+        os.utime(cache_path)
+    except OSError:
+        pass
+
+
+def _evict_cache_files(cache_dir):
+    """
+    Remove the least recently used cache files beyond the _CACHE_FILES most recent, such as those of configurations
+    in directories that are gone.
+    """
+    try:
+        names = [name for name in os.listdir(cache_dir) if name.endswith('.json')]
+        if len(names) <= _CACHE_FILES:
+            return
+        ages = []
+        for name in names:
+            cache_path = os.path.join(cache_dir, name)
+            ages.append((os.stat(cache_path).st_mtime_ns, cache_path))
+    except OSError:
+        return
+    ages.sort()
+    for _, cache_path in ages[:len(ages) - _CACHE_FILES]:
+        try:
+            os.remove(cache_path)
+        except OSError:
+            pass
+
+
+def _parse_layout(content):
+    """
+    Parse the contents of an .fpgaconfig file into a layout dictionary, see load_layout.
+    """
+    root = ET.fromstring(content)
+    layout = {'bitfile': None, 'read_packets': None, 'write_packets': None, 'read': None, 'write': None}
+    for child in root:
+        if child.tag == 'DMA_Read':
+            layout['read_packets'] = int(child[0].text)
+            layout['read'] = [_parse_packet(child[pack_index]) for pack_index in range(2, layout['read_packets'] + 1)]
+            layout['read'].insert(0, dict(_FIRST_READ_DEFINITION))
+        elif child.tag == 'DMA_Write':
+            layout['write_packets'] = int(child[0].text)
+            layout['write'] = [_parse_packet(child[pack_index]) for pack_index in range(1, layout['write_packets'] + 1)]
+        elif child.tag == 'Bitfile':
+            layout['bitfile'] = child.text
+    if layout['read_packets'] is None:
+        raise ConfigError(message='No DMA_Read tag present')
+    elif layout['write_packets'] is None:
+        raise ConfigError(message='No DMA_Write tag present')
+    if layout['read_packets'] == 0:
+        layout['read'] = []
+    return layout
+
+
+def _parse_packet(packet_tag):
+    """
+    :return: the definition dictionary of one <Packet> tag: channel count, names, data types and type parameters
+    """
+    packet_def = {}
+    packet_def['channel_count'] = packet_tag.__len__()
+    for cindex, child in enumerate(packet_tag):
+        packet_def['data_type{}'.format(cindex)] = child.tag
+        for grandchild in child:
+            if grandchild.tag == 'Name':
+                packet_def['name{}'.format(cindex)] = grandchild.text
+            elif grandchild.tag == 'Scale':
+                packet_def['Scale{}'.format(cindex)] = int(grandchild.text)
+            elif grandchild.tag == 'FXPWL':
+                packet_def['FXPWL{}'.format(cindex)] = int(grandchild.text)
+            elif grandchild.tag == 'FXPIWL':
+                packet_def['FXPIWL{}'.format(cindex)] = int(grandchild.text)
+            elif grandchild.tag == 'PWMPeriod':  # PWM period is measured in ticks of the FPGA clock
+                packet_def['PWM_period{}'.format(cindex)] = int(grandchild.text)
+            else:
+                continue
+    return packet_def
+
 
 class VeriStandFPGA(object):
     """
@@ -42,49 +295,126 @@ class VeriStandFPGA(object):
 
     """
 
-    def __init__(self, filepath):
+    def __init__(self, filepath, cache_dir=None, use_cache=True):
         """
         Create a fpga_config object. The filepath is the path to the bitfile you wish to interact with.
         This creates the fpga configuration with a number of read and write packets.
         :param filepath:
+        :param cache_dir: directory of the parsed layout cache, see load_layout
+        :param use_cache: False to parse the .fpgaconfig file without using the layout cache
         """
         self.filepath = filepath
-        self.tree = ET.parse(self.filepath)
-        self.root = self.tree.getroot()
-        self.read_packets = None
-        self.write_packets = None
+        cached = _load_cached_layout(filepath, cache_dir, use_cache)
+        if cached.packet_layouts is None:
+            cached.packet_layouts = {'read': [PacketLayout(definition) for definition in cached.layout['read']],
+                                     'write': [PacketLayout(definition) for definition in cached.layout['write']]}
+        self._layout = cached.layout
+        self._packet_layouts = cached.packet_layouts
+        self._tree = None
+        self.read_packets = self._layout['read_packets']
+        self.write_packets = self._layout['write_packets']
+        self.bitfile = self._layout['bitfile']
         self.session = None
         self.write_fifo_object = None
         self.read_fifo_object = None
-        for child in self.root:
-            if child.tag == 'DMA_Read':
-                self.read_packets = int(child[0].text)
-                self.read_fifo_tag = child
-            elif child.tag == 'DMA_Write':
-                self.write_packets = int(child[0].text)
-                self.write_fifo_tag = child
-            elif child.tag == 'Bitfile':
-                self.bitfile = child.text
+        self.frame_ring = None
+        self.fifo_reader = None
+        self.fifo_writer = None
+        self.decode_executor = None
+        self.fifo_decoder = None
+        self.recorder = None
+        self.metrics = None
+        self.shared_table = None
+        self.read_fifo_depth = None
+        self.write_fifo_depth = None
+        self.fifo_backlog = 0
+        self.max_fifo_backlog = 0
+        self.read_buffer = None
+        self.write_buffer = None
+        self._buffered_read = None
+        self._buffered_write = None
         self.folder = ntpath.split(self.filepath)
         self.full_bitpath = self.folder[0] + '\\{}'.format(self.bitfile)
-        if self.read_packets is None:
-            raise ConfigError(message='No DMA_Read tag present')
-        elif self.write_packets is None:
-            raise ConfigError(message='No DMA_Write tag present')
         self.read_packet_list = []
         self.write_packet_list = []
-        self.channel_value_table = {}
         for pack_index in range(self.read_packets):
             self.read_packet_list.append(self._create_packet('read', pack_index + 1))
-            for chan_index in range(self.read_packet_list[pack_index].definition['channel_count']):
-                self.channel_value_table[self.read_packet_list[pack_index].definition['name{}'.format(chan_index)]] = 0
         for pack_index in range(self.write_packets):
             self.write_packet_list.append(self._create_packet('write', pack_index + 1))
-            for chan_index in range(self.write_packet_list[pack_index].definition['channel_count']):
-                self.channel_value_table[self.write_packet_list[pack_index].definition['name{}'.format(chan_index)]] = 0
 
-    def init_fpga(self, device, loop_rate):
-        self.session = Session(self.full_bitpath, device, reset_if_last_session_on_exit=True)
+        # Every channel gets an integer handle into one contiguous float64 array of channel values
+        self.channel_handles = {}
+        self._boolean_handles = set()
+        for this_packet in self.read_packet_list + self.write_packet_list:
+            handles = []
+            for name, data_type in zip(this_packet._names, this_packet._data_types):
+                handle = self.channel_handles.setdefault(name, len(self.channel_handles))
+                if data_type == 'Boolean':
+                    self._boolean_handles.add(handle)
+                handles.append(handle)
+            this_packet._handles = tuple(handles)
+        self.channel_values = array('d', bytes(8 * len(self.channel_handles)))
+
+        # Packed DMA_Write words are cached, and only the packets holding channels set since the last write are
+        # packed again. _write_packets_of maps each handle to the indexes of the write packets holding that channel.
+        write_packets_of = [[] for _ in self.channel_handles]
+        for pack_index, this_packet in enumerate(self.write_packet_list):
+            for handle in this_packet._handles:
+                write_packets_of[handle].append(pack_index)
+        self._write_packets_of = [tuple(packets) for packets in write_packets_of]
+        # Write packets holding channels that are also read, so that each read changes them
+        self._read_write_packets = tuple(sorted(set(
+            pack_index for this_packet in self.read_packet_list for handle in this_packet._handles
+            for pack_index in self._write_packets_of[handle])))
+        self._write_words = array('Q', bytes(8 * self.write_packets))
+        self._dirty_packets = set(range(self.write_packets))
+        self._late_handle = self.channel_handles.get('Is Late?')
+        # Read packets decoded on every read while channels are subscribed, as (index, packet, unpack plan) with
+        # the plan cut down to the subscribed channels. None decodes every read packet in full.
+        self._subscribed = set()
+        self._eager_reads = None
+        self._pending_reads = _PendingReads(self.read_packet_list, self.channel_values, len(self.channel_handles))
+        self.channel_value_table = ChannelTable(self)
+
+    @property
+    def tree(self):
+        """
+        ElementTree of the .fpgaconfig file. Packets are built from the cached layout, so the XML is only parsed
+        when this is first used.
+        """
+        if self._tree is None:
+            self._tree = ET.parse(self.filepath)
+        return self._tree
+
+    @property
+    def root(self):
+        return self.tree.getroot()
+
+    @property
+    def read_fifo_tag(self):
+        return self.root.find('DMA_Read')
+
+    @property
+    def write_fifo_tag(self):
+        return self.root.find('DMA_Write')
+
+    def init_fpga(self, device, loop_rate, session=None, read_fifo_depth=None, write_fifo_depth=None):
+        """
+        Open a session to the FPGA, download and run the bitfile and set up the template registers.
+        :param device: name of the FPGA as it appears in NI-MAX
+        :param loop_rate: FPGA loop rate in usec
+        :param session: an already created session to use instead of opening a nifpga.Session, such as a
+            fpga_simulator.SimulatedSession
+        :param read_fifo_depth: depth of the host buffer of the DMA_Read FIFO, in loop iterations. The driver
+            default is kept when not given. A deeper buffer gives the host more time to catch up before the FPGA
+            has to drop frames.
+        :param write_fifo_depth: depth of the host buffer of the DMA_Write FIFO, in loop iterations
+        """
+        if session is None:
+            # Imported here so that configurations and recordings can be inspected without nifpga installed
+            from nifpga import Session
+            session = Session(self.full_bitpath, device, reset_if_last_session_on_exit=True)
+        self.session = session
         self.session.download()
         self.session.run()
         print(self.session.fpga_vi_state)
@@ -95,6 +425,15 @@ class VeriStandFPGA(object):
         self.fpga_rtsi = self.session.registers['Write to  RTSI']
         self.fpga_ex_timing = self.session.registers['Use External Timing']
         self.fpga_irq = self.session.registers['Generate IRQ']
+        if read_fifo_depth is not None:
+            # The driver may round the depth up, keep the depth it actually set
+            self.read_fifo_depth = self.read_fifo_object.configure(
+                read_fifo_depth * self.read_packets) // self.read_packets
+        if write_fifo_depth is not None and self.write_packets:
+            self.write_fifo_depth = self.write_fifo_object.configure(
+                write_fifo_depth * self.write_packets) // self.write_packets
+        self.fifo_backlog = 0
+        self.max_fifo_backlog = 0
 
         self.loop_timer.write(loop_rate)
         self.fpga_rtsi.write(False)
@@ -105,9 +444,38 @@ class VeriStandFPGA(object):
         self.fpga_start_control.write(True)
 
     def stop_fpga(self):
+        self.stop_streaming()
+        self.stop_decoding()
+        self.stop_stimulus()
+        self.stop_recording()
+        self.stop_sharing()
+        self._buffered_read = None
+        self._buffered_write = None
         self.session.reset()
         self.session.close()
 
+    def get_handle(self, channel_name):
+        """
+        Resolve a channel name to the integer handle used by set_channel_by_handle and get_channel_by_handle.
+        Resolve handles once, outside of the control loop.
+        """
+        try:
+            return self.channel_handles[channel_name]
+        except KeyError:
+            raise ConfigError(message='{} is not a channel in {}'.format(channel_name, self.filepath))
+
+    def set_channel_by_handle(self, handle, value):
+        self.channel_values[handle] = value
+        self._dirty_packets.update(self._write_packets_of[handle])
+
+    def get_channel_by_handle(self, handle):
+        """
+        :return: the value of a channel straight out of channel_values, always a float. Boolean channels come back
+            as 1.0 or 0.0 rather than as the bool get_channel returns, which keeps the type check out of the loop.
+        """
+        if self._pending_reads.frame is not None:
+            self._pending_reads.refresh(handle)
+        return self.channel_values[handle]
 
     def set_channel(self, channel_name, value):
         self.channel_value_table[channel_name] = value
@@ -115,31 +483,725 @@ class VeriStandFPGA(object):
     def get_channel(self, channel_name):
         return self.channel_value_table[channel_name]
 
+    def set_channels(self, channels):
+        """
+        Set many channels at once. Only the write packets holding a channel whose value changed are packed again
+        by the next write. Every name is resolved before any channel is set, so an unknown name leaves the channel
+        table as it was.
+        :param channels: either a mapping of channel names to values, or a sequence of values for every channel in
+            handle order, the same shape as channel_values
+        """
+        values = self.channel_values
+        write_packets_of = self._write_packets_of
+        dirty_packets = self._dirty_packets
+        if isinstance(channels, Mapping):
+            updates = [(self.get_handle(channel_name), value) for channel_name, value in channels.items()]
+            for handle, value in updates:
+                values[handle] = value
+                dirty_packets.update(write_packets_of[handle])
+        else:
+            if len(channels) != len(values):
+                raise ValueError('Expected {} channel values, got {}'.format(len(values), len(channels)))
+            for handle, value in enumerate(channels):
+                if values[handle] != value:
+                    values[handle] = value
+                    dirty_packets.update(write_packets_of[handle])
+
+    def mark_channels_changed(self, handles=None):
+        """
+        Make the next write pack the packets holding some channels again. Only needed after writing to
+        channel_values directly, as set_channel, set_channel_by_handle, set_channels and channel_value_table keep
+        track of changes themselves.
+        :param handles: handles of the changed channels. Every write packet is packed again by default.
+        """
+        if handles is None:
+            self._dirty_packets.update(range(self.write_packets))
+        else:
+            for handle in handles:
+                self._dirty_packets.update(self._write_packets_of[handle])
+
+    def subscribe(self, channels):
+        """
+        Decode only some read channels on each read. The other read channels are kept as the raw U64 of their
+        packet, and a packet is only decoded the first time one of its channels is asked for through get_channel,
+        get_channel_by_handle or channel_value_table after a read. 'Is Late?' and read channels that are also
+        written are always decoded.
+        While channels are subscribed, channel_values only holds the latest values of the subscribed channels.
+        :param channels: names of read channels, added to those already subscribed
+        """
+        handles = set()
+        for channel_name in channels:
+            handle = self.get_handle(channel_name)
+            if self._pending_reads.packet_of[handle] < 0:
+                raise ConfigError(message='{} is not a read channel in {}'.format(channel_name, self.filepath))
+            handles.add(handle)
+        self._pending_reads.flush()
+        self._subscribed.update(handles)
+        self._plan_reads()
+
+    def unsubscribe(self, channels=None):
+        """
+        :param channels: names of channels to stop decoding on each read. By default every subscription is dropped
+            and every read channel is decoded on each read again.
+        """
+        self._pending_reads.flush()
+        if channels is None:
+            self._subscribed.clear()
+        else:
+            self._subscribed.difference_update(self.get_handle(channel_name) for channel_name in channels)
+        self._plan_reads()
+
+    @property
+    def subscriptions(self):
+        """
+        Names of the subscribed channels. When empty, every read channel is decoded on each read.
+        """
+        names = dict((handle, name) for name, handle in self.channel_handles.items())
+        return frozenset(names[handle] for handle in self._subscribed)
+
+    def _plan_reads(self):
+        """
+        Work out which read packets and channels to decode on each read from the subscriptions.
+        """
+        pending = self._pending_reads
+        if not self._subscribed:
+            self._eager_reads = None
+            pending.frame = None
+            pending.fresh = frozenset()
+            return
+        fresh = set(self._subscribed)
+        if self._late_handle is not None:
+            fresh.add(self._late_handle)
+        for this_packet in self.read_packet_list:
+            fresh.update(handle for handle in this_packet._handles if self._write_packets_of[handle])
+        eager_reads = []
+        for pack_index, this_packet in enumerate(self.read_packet_list):
+            plan = tuple(step for step in this_packet._unpack_plan if this_packet._handles[step[0]] in fresh)
+            if plan:
+                eager_reads.append((pack_index, this_packet, plan))
+        self._eager_reads = tuple(eager_reads)
+        pending.fresh = frozenset(fresh)
+
     def vs_read_fifo(self, timeout):
+        return self._read_frame(timeout).elements_remaining
+
+    def _read_frame(self, timeout):
+        """
+        Read one frame from the DMA_Read FIFO into the channel table, feeding the recorder, the shared table, the
+        backlog tracking and the metrics, as every read of a single frame does.
+        :return: the read tuple of the FIFO, with the raw frame in data
+        """
         if self.read_fifo_object is None:
             raise ConfigError('Session not initialized. Please first call the'
                               ' VeriStandFPGA.init fpga method before reading')
         else:
-            read_tup = self.read_fifo_object.read(number_of_elements=self.read_packets, timeout_ms=timeout)
-            data = read_tup.data
-            for i, u64 in enumerate(data):
+            if self.fifo_reader is not None:
+                raise ConfigError('DMA_READ is being drained by the streaming reader. '
+                                  'Use VeriStandFPGA.read_latest or a stream cursor instead')
+            if self.fifo_decoder is not None:
+                raise ConfigError('DMA_READ is being drained by the decode executor. '
+                                  'Use VeriStandFPGA.read_decoded instead')
+            metrics = self.metrics
+            if metrics is not None:
+                started = metrics.clock()
+            try:
+                read_tup = self.read_fifo_object.read(number_of_elements=self.read_packets, timeout_ms=timeout)
+            except BaseException as error:
+                if metrics is not None:
+                    metrics.fifo_error(error)
+                raise
+            if metrics is not None:
+                transferred = metrics.clock()
+            if self.recorder is not None:
+                self.recorder.record_read(read_tup.data)
+            self.unpack_frame(read_tup.data)
+            self._note_backlog(read_tup.elements_remaining)
+            if metrics is not None:
+                metrics.read_done(started, transferred, metrics.clock(), self._is_late())
+            return read_tup
+
+    def _note_backlog(self, elements_remaining):
+        """
+        Keep track of the frames left waiting in the DMA_Read FIFO after a read.
+        """
+        backlog = elements_remaining // self.read_packets
+        self.fifo_backlog = backlog
+        if backlog > self.max_fifo_backlog:
+            self.max_fifo_backlog = backlog
+        if self.metrics is not None:
+            self.metrics.backlog(backlog)
+
+    def fifo_stats(self):
+        """
+        :return: dictionary with the frames left waiting in the DMA_Read FIFO after the last read, fifo_backlog,
+            the most seen after any read, max_fifo_backlog, the read_fifo_depth in frames if it was set by
+            init_fpga, and the fraction of it the backlog filled, occupancy, or None without a depth
+        """
+        depth = self.read_fifo_depth
+        return {'fifo_backlog': self.fifo_backlog,
+                'max_fifo_backlog': self.max_fifo_backlog,
+                'read_fifo_depth': depth,
+                'occupancy': self.fifo_backlog / depth if depth else None}
+
+    def _is_late(self):
+        return self._late_handle is not None and self.channel_values[self._late_handle] != 0
+
+    def unpack_frame(self, frame):
+        """
+        Unpack one raw DMA_Read frame into the channel table. While channels are subscribed only they are decoded,
+        and frame is kept to decode the other channels from when they are asked for.
+        :param frame: the read_packets U64s of one loop iteration
+        """
+        values = self.channel_values
+        eager_reads = self._eager_reads
+        if eager_reads is None:
+            for i, u64 in enumerate(frame):
                 this_packet = self.read_packet_list[i]
-                read_vals = this_packet._unpack(u64)
-                for key in read_vals:
-                    self.channel_value_table[key] = read_vals[key]
+                this_packet._unpack_into(u64, values, this_packet._handles)
+        else:
+            pending = self._pending_reads
+            pending.frame = frame
+            pending.generation += 1
+            for pack_index, this_packet, plan in eager_reads:
+                this_packet._unpack_into(frame[pack_index], values, this_packet._handles, plan)
+        if self._read_write_packets:
+            self._dirty_packets.update(self._read_write_packets)
+        if self.shared_table is not None:
+            self._publish_shared(frame)
+
+    def _pack_write_words(self):
+        """
+        Pack the write packets whose channels changed since the last write into the cached DMA_Write words.
+        :return: the array of DMA_Write words
+        """
+        values = self.channel_values
+        words = self._write_words
+        dirty_packets = self._dirty_packets
+        # pop rather than iterate, so that channels set from another thread meanwhile are never lost
+        while dirty_packets:
+            pack_index = dirty_packets.pop()
+            current_packet = self.write_packet_list[pack_index]
+            try:
+                words[pack_index] = current_packet._pack_from(values, current_packet._handles)
+            except BaseException:
+                # Pack it again next time, so that every write raises until its channels hold valid values
+                dirty_packets.add(pack_index)
+                raise
+        return words
 
     def vs_write_fifo(self, timeout):
         if self.write_fifo_object is None:
             raise ConfigError('Session not initialized. '
                               'Please first call the VeriStandFPGA.init_fpga method before writing')
         else:
-            write_list = []
-            for current_packet in self.write_packet_list:
-                packet_vals = []
-                for channel in current_packet:
-                    packet_vals.append(self.channel_value_table[channel['name']])
-                write_list.append(current_packet._pack(packet_vals))
-            self.write_fifo_object.write(data=write_list, timeout_ms=timeout)
+            if self.fifo_writer is not None:
+                raise ConfigError('DMA_WRITE is being fed a stimulus. Call VeriStandFPGA.stop_stimulus first')
+            metrics = self.metrics
+            if metrics is not None:
+                started = metrics.clock()
+            words = self._pack_write_words()
+            if metrics is not None:
+                packed = metrics.clock()
+            try:
+                self.write_fifo_object.write(data=words, timeout_ms=timeout)
+            except BaseException as error:
+                if metrics is not None:
+                    metrics.fifo_error(error)
+                raise
+            if self.recorder is not None:
+                self.recorder.record_write(words)
+            if self.shared_table is not None:
+                self._publish_shared()
+            if metrics is not None:
+                metrics.write_done(started, packed, metrics.clock())
+
+    def vs_read_fifo_buffered(self, timeout):
+        """
+        Counterpart of vs_read_fifo that reads into the preallocated numpy buffer read_buffer and unpacks from it,
+        so that no new list is created for each iteration. It retains no memory per iteration, although unpacking
+        still creates short-lived int and float objects.
+        :param timeout: timeout of the FIFO read in ms
+        :return: number of elements remaining in the DMA_Read FIFO
+        """
+        if self.read_fifo_object is None:
+            raise ConfigError('Session not initialized. Please first call the'
+                              ' VeriStandFPGA.init fpga method before reading')
+        if self.fifo_reader is not None:
+            raise ConfigError('DMA_READ is being drained by the streaming reader. '
+                              'Use VeriStandFPGA.read_latest or a stream cursor instead')
+        if self.fifo_decoder is not None:
+            raise ConfigError('DMA_READ is being drained by the decode executor. '
+                              'Use VeriStandFPGA.read_decoded instead')
+        if self._buffered_read is None:
+            _require_numpy()
+            self.read_buffer = np.zeros(self.read_packets, dtype=np.uint64)
+            self._buffered_read = _fifo_buffer(self.read_fifo_object, self.read_buffer)
+        metrics = self.metrics
+        if metrics is not None:
+            started = metrics.clock()
+        try:
+            elements_remaining = self._buffered_read.read(timeout)
+        except BaseException as error:
+            if metrics is not None:
+                metrics.fifo_error(error)
+            raise
+        if metrics is not None:
+            transferred = metrics.clock()
+        if self.recorder is not None:
+            self.recorder.record_read(self._buffered_read.view)
+        self.unpack_frame(self._buffered_read.view)
+        self._note_backlog(elements_remaining)
+        if metrics is not None:
+            metrics.read_done(started, transferred, metrics.clock(), self._is_late())
+        return elements_remaining
+
+    def vs_write_fifo_buffered(self, timeout):
+        """
+        Counterpart of vs_write_fifo that packs into the preallocated numpy buffer write_buffer and writes from it,
+        so that no new list is created for each iteration. It retains no memory per iteration, although packing
+        still creates short-lived int objects.
+        :param timeout: timeout of the FIFO write in ms
+        :return: number of empty elements remaining in the DMA_Write FIFO
+        """
+        if self.write_fifo_object is None:
+            raise ConfigError('Session not initialized. '
+                              'Please first call the VeriStandFPGA.init_fpga method before writing')
+        if self.fifo_writer is not None:
+            raise ConfigError('DMA_WRITE is being fed a stimulus. Call VeriStandFPGA.stop_stimulus first')
+        if self._buffered_write is None:
+            _require_numpy()
+            self.write_buffer = np.zeros(self.write_packets, dtype=np.uint64)
+            self._buffered_write = _fifo_buffer(self.write_fifo_object, self.write_buffer)
+        metrics = self.metrics
+        if metrics is not None:
+            started = metrics.clock()
+        view = self._buffered_write.view
+        view[:] = self._pack_write_words()
+        if metrics is not None:
+            packed = metrics.clock()
+        try:
+            empty_elements_remaining = self._buffered_write.write(timeout)
+        except BaseException as error:
+            if metrics is not None:
+                metrics.fifo_error(error)
+            raise
+        if self.recorder is not None:
+            self.recorder.record_write(view)
+        if self.shared_table is not None:
+            self._publish_shared()
+        if metrics is not None:
+            metrics.write_done(started, packed, metrics.clock())
+        return empty_elements_remaining
+
+    def read_fifo_batch(self, iterations, timeout):
+        """
+        Read several loop iterations from the DMA_Read FIFO at once and decode them together.
+        The channel value table is left holding the values of the last iteration read.
+        :param iterations: number of loop iterations to read
+        :param timeout: timeout of the FIFO read in ms
+        :return: dictionary of numpy arrays with channel names as keys, one element per iteration
+        """
+        if self.read_fifo_object is None:
+            raise ConfigError('Session not initialized. Please first call the'
+                              ' VeriStandFPGA.init fpga method before reading')
+        if self.fifo_reader is not None:
+            raise ConfigError('DMA_READ is being drained by the streaming reader. '
+                              'Use VeriStandFPGA.read_latest or a stream cursor instead')
+        if self.fifo_decoder is not None:
+            raise ConfigError('DMA_READ is being drained by the decode executor. '
+                              'Use VeriStandFPGA.read_decoded instead')
+        _require_numpy()
+        read_tup = self.read_fifo_object.read(number_of_elements=self.read_packets * iterations, timeout_ms=timeout)
+        self._note_backlog(read_tup.elements_remaining)
+        frames = np.asarray(read_tup.data, dtype=np.uint64).reshape(iterations, self.read_packets)
+        if self.recorder is not None:
+            self.recorder.record_read(frames.reshape(-1))
+        columns = self.decode_read_frames(frames)
+        for key in columns:
+            self.channel_values[self.channel_handles[key]] = columns[key][-1]
+        # Every channel now holds the last iteration, so nothing is left to decode from an earlier frame
+        self._pending_reads.frame = None
+        if self._read_write_packets:
+            self._dirty_packets.update(self._read_write_packets)
+        if self.shared_table is not None:
+            self._publish_shared(frames.reshape(-1))
+        return columns
+
+    def read_fifo_adaptive(self, timeout, min_iterations=1, max_iterations=256):
+        """
+        Counterpart of read_fifo_batch that sizes each read from the backlog left by the previous one. While the
+        host keeps up it reads min_iterations per call, as soon as they arrive. Once frames pile up in the FIFO it
+        reads all of them, up to max_iterations, in one call that returns without waiting, so the backlog is cleared
+        in as few calls as possible and stays bounded while the host can keep up on average.
+        :param timeout: timeout of the FIFO read in ms
+        :param min_iterations: number of iterations read per call when there is no backlog
+        :param max_iterations: largest number of iterations read per call. It should be well under the depth of
+            the DMA_Read FIFO.
+        :return: dictionary of numpy arrays with channel names as keys, one element per iteration read
+        """
+        iterations = min(max(self.fifo_backlog, min_iterations), max_iterations)
+        return self.read_fifo_batch(iterations, timeout)
+
+    def decode_read_frames(self, frames):
+        """
+        Decode a block of raw DMA_Read frames with vectorized operations.
+        :param frames: array-like of U64 values shaped (iterations, read_packets), as read from the DMA_Read FIFO
+        :return: dictionary of numpy arrays with channel names as keys, including 'Is Late?'
+        """
+        _require_numpy()
+        frames = np.asarray(frames, dtype=np.uint64)
+        if frames.ndim != 2 or frames.shape[1] != self.read_packets:
+            raise ValueError('frames must be shaped (iterations, {}), got {}'.format(self.read_packets,
+                                                                                     frames.shape))
+        columns = {}
+        for i, this_packet in enumerate(self.read_packet_list):
+            columns.update(this_packet._unpack_array(frames[:, i]))
+        return columns
+
+    def start_streaming(self, capacity=4096, chunk_frames=256, timeout=100):
+        """
+        Start a background thread that drains the DMA_Read FIFO into a preallocated ring of raw frames, so that
+        the FIFO keeps being serviced whatever the caller is doing. vs_read_fifo cannot be used while streaming,
+        use read_latest, stream_cursor or the frame_ring instead.
+        :param capacity: number of frames the ring holds
+        :param chunk_frames: largest number of frames taken from the FIFO in one read
+        :param timeout: timeout in ms of a blocking FIFO read, which bounds how long stop_streaming waits
+        :return: the FrameRing frames are published to
+        """
+        if self.read_fifo_object is None:
+            raise ConfigError('Session not initialized. Please first call the'
+                              ' VeriStandFPGA.init fpga method before streaming')
+        if self.fifo_reader is not None:
+            raise ConfigError('Streaming has already been started')
+        if self.fifo_decoder is not None:
+            raise ConfigError('DMA_READ is being drained by the decode executor. Please first call '
+                              'VeriStandFPGA.stop_decoding')
+        from fpga_stream import FrameRing, FIFOReader
+        self.frame_ring = FrameRing(capacity, self.read_packets, max_chunk=chunk_frames)
+        self.fifo_reader = FIFOReader(self.read_fifo_object, self.frame_ring, timeout)
+        self.fifo_reader.recorder = self.recorder
+        self.fifo_reader.start()
+        return self.frame_ring
+
+    def stop_streaming(self):
+        """
+        Stop the streaming reader thread, if one is running. The frame ring stays available for reading.
+        """
+        if self.fifo_reader is not None:
+            self.fifo_reader.stop()
+            self.fifo_reader = None
+
+    def stream_cursor(self):
+        """
+        :return: a FrameCursor that iterates over every frame streamed from now on
+        """
+        if self.frame_ring is None:
+            raise ConfigError('Streaming has not been started. Please first call VeriStandFPGA.start_streaming')
+        return self.frame_ring.cursor()
+
+    def read_latest(self):
+        """
+        Unpack the most recent streamed frame into the channel table.
+        :return: True if a frame was available, False if nothing has been streamed yet
+        """
+        if self.frame_ring is None:
+            raise ConfigError('Streaming has not been started. Please first call VeriStandFPGA.start_streaming')
+        if self.fifo_reader is not None and self.fifo_reader.error is not None:
+            raise self.fifo_reader.error
+        frame = self.frame_ring.latest()
+        if frame is None:
+            return False
+        self.unpack_frame(frame)
+        return True
+
+    def streaming_stats(self):
+        """
+        :return: dictionary with the streaming reader counters: frames_read, reads, timeouts, fifo_backlog and
+            max_fifo_backlog, the last two in frames still waiting in DMA_READ
+        """
+        if self.fifo_reader is None:
+            raise ConfigError('Streaming is not running')
+        return self.fifo_reader.stats()
+
+    def start_decoding(self, workers=None, chunk_frames=256, slots=None, timeout=100):
+        """
+        Start decoding DMA_Read in a pool of worker processes, for configurations with too many read packets to
+        decode at the loop rate on one core. A background thread reads chunks of frames from the FIFO straight into
+        shared memory, the workers decode them in parallel and read_decoded returns them in FIFO order.
+        vs_read_fifo and the other reads cannot be used while decoding, see fpga_decode.
+        :param workers: number of worker processes, one less than the number of CPUs by default
+        :param chunk_frames: number of frames read from the FIFO and decoded at once
+        :param slots: number of chunks read and not yet taken by read_decoded at most, twice the number of workers
+            by default. The FIFO fills while they are all in use.
+        :param timeout: timeout in ms of a chunk read, which bounds how long stop_decoding waits
+        :return: the fpga_decode.DecodeExecutor decoding the chunks
+        """
+        if self.read_fifo_object is None:
+            raise ConfigError('Session not initialized. Please first call the'
+                              ' VeriStandFPGA.init fpga method before decoding')
+        if self.fifo_reader is not None:
+            raise ConfigError('DMA_READ is being drained by the streaming reader. Please first call '
+                              'VeriStandFPGA.stop_streaming')
+        if self.fifo_decoder is not None:
+            raise ConfigError('Decoding has already been started')
+        from fpga_decode import DecodeExecutor, FIFODecoder
+        self.decode_executor = DecodeExecutor(self.layout(), workers=workers, chunk_frames=chunk_frames, slots=slots)
+        self.fifo_decoder = FIFODecoder(self.read_fifo_object, self.decode_executor, timeout)
+        self.fifo_decoder.recorder = self.recorder
+        self.fifo_decoder.start()
+        return self.decode_executor
+
+    def read_decoded(self, timeout=None):
+        """
+        Take the next chunk decoded by the worker processes, in FIFO order.
+        The channel value table is left holding the values of the last iteration of the chunk.
+        An error that stopped the decoder thread is raised once the chunks read before it have been taken.
+        :param timeout: time in ms to wait for the chunk, without limit by default
+        :return: dictionary of numpy arrays with channel names as keys, one element per iteration, as from
+            read_fifo_batch, or None on timeout
+        """
+        if self.fifo_decoder is None:
+            raise ConfigError('Decoding has not been started. Please first call VeriStandFPGA.start_decoding')
+        executor = self.decode_executor
+        chunk = executor.collect(None if timeout is None else timeout / 1000)
+        if chunk is None:
+            return None
+        slot, frames = chunk
+        try:
+            columns = executor.columns(slot, frames)
+            if self.shared_table is not None:
+                self.shared_table.publish_frames(executor.frame_buffer(slot)[:frames * self.read_packets])
+        finally:
+            executor.release(slot)
+        self._note_backlog(self.fifo_decoder.backlog * self.read_packets)
+        for key in columns:
+            self.channel_values[self.channel_handles[key]] = columns[key][-1]
+        self._pending_reads.frame = None
+        if self._read_write_packets:
+            self._dirty_packets.update(self._read_write_packets)
+        if self.shared_table is not None:
+            self._publish_shared()
+        return columns
+
+    def stop_decoding(self):
+        """
+        Stop the decoder thread and the worker processes, if decoding is running. Chunks not yet taken by
+        read_decoded are dropped.
+        """
+        if self.fifo_decoder is not None:
+            self.fifo_decoder.stop()
+            self.fifo_decoder = None
+            self.decode_executor.close()
+            self.decode_executor = None
+
+    def decoding_stats(self):
+        """
+        :return: dictionary with the decoder thread and executor counters: frames_read, reads, timeouts, stalls,
+            fifo_backlog and max_fifo_backlog, the last two in frames still waiting in DMA_READ, and workers,
+            slots, chunk_frames, chunks_decoded, frames_decoded and pending
+        """
+        if self.fifo_decoder is None:
+            raise ConfigError('Decoding is not running')
+        if self.fifo_decoder.error is not None:
+            raise self.fifo_decoder.error
+        stats = self.fifo_decoder.stats()
+        stats.update(self.decode_executor.stats())
+        return stats
+
+    def encode_write_frames(self, stimulus, channels=None):
+        """
+        Encode a whole stimulus into DMA_Write frames with vectorized operations, ready for start_stimulus.
+        Every frame packs exactly as vs_write_fifo would with the stimulus values of that iteration in the channel
+        table. Write channels missing from the stimulus keep their current value in the channel table throughout.
+        :param stimulus: one of
+            - a mapping of write channel names to 1-D arrays, one value per iteration. A numpy .npz file opened
+              with numpy.load is such a mapping.
+            - a numpy structured array with write channel names as field names
+            - a 2-D array shaped (iterations, channels), with one column per name in channels
+        :param channels: names of the columns of a 2-D stimulus array. Defaults to every write channel, in packet
+            order.
+        :return: numpy uint64 array of frames shaped (iterations, write_packets)
+        """
+        _require_numpy()
+        write_names = [name for this_packet in self.write_packet_list for name in this_packet._names]
+        if isinstance(stimulus, Mapping):
+            columns = dict((name, stimulus[name]) for name in stimulus)
+        elif isinstance(stimulus, np.ndarray) and stimulus.dtype.names is not None:
+            columns = dict((name, stimulus[name]) for name in stimulus.dtype.names)
+        else:
+            stimulus = np.asarray(stimulus, dtype=np.float64)
+            if channels is None:
+                channels = write_names
+            if stimulus.ndim != 2 or stimulus.shape[1] != len(channels):
+                raise ValueError('stimulus must be shaped (iterations, {}), got {}'.format(len(channels),
+                                                                                        stimulus.shape))
+            columns = dict((name, stimulus[:, i]) for i, name in enumerate(channels))
+        write_name_set = set(write_names)
+        iterations = None
+        for name in columns:
+            if name not in write_name_set:
+                raise ConfigError(message='{} is not a write channel in {}'.format(name, self.filepath))
+            columns[name] = np.asarray(columns[name], dtype=np.float64)
+            if columns[name].ndim != 1 or (iterations is not None and len(columns[name]) != iterations):
+                raise ValueError('Every stimulus column must be 1-D and of the same length')
+            iterations = len(columns[name])
+        if iterations is None:
+            raise ValueError('The stimulus holds no channels')
+        frames = np.empty((iterations, self.write_packets), dtype=np.uint64)
+        for i, this_packet in enumerate(self.write_packet_list):
+            packet_columns = [columns[name] if name in columns else self.channel_values[handle]
+                              for name, handle in zip(this_packet._names, this_packet._handles)]
+            frames[:, i] = this_packet._pack_array(packet_columns, iterations)
+        return frames
+
+    def start_stimulus(self, frames, chunk_frames=1024, timeout=100, repeat=False):
+        """
+        Play encoded frames to the DMA_Write FIFO from a background thread, which writes them in chunks and keeps the
+        FIFO topped up. vs_write_fifo cannot be used while a stimulus is playing.
+        :param frames: frames shaped (iterations, write_packets), as returned by encode_write_frames
+        :param chunk_frames: number of frames written at once. A chunk must fit in the DMA_Write FIFO.
+        :param timeout: timeout in ms of a chunk write, which bounds how long stop_stimulus waits
+        :param repeat: play the frames over and over until stop_stimulus is called
+        :return: the FIFOWriter playing the frames
+        """
+        if self.write_fifo_object is None:
+            raise ConfigError('Session not initialized. '
+                              'Please first call the VeriStandFPGA.init_fpga method before writing')
+        if self.fifo_writer is not None:
+            raise ConfigError('A stimulus is already playing')
+        _require_numpy()
+        frames = np.ascontiguousarray(frames, dtype=np.uint64)
+        if frames.ndim != 2 or frames.shape[1] != self.write_packets:
+            raise ValueError('frames must be shaped (iterations, {}), got {}'.format(self.write_packets,
+                                                                                     frames.shape))
+        from fpga_stream import FIFOWriter
+        self.fifo_writer = FIFOWriter(self.write_fifo_object, frames, timeout, chunk_frames, repeat=repeat)
+        self.fifo_writer.recorder = self.recorder
+        self.fifo_writer.start()
+        return self.fifo_writer
+
+    def stop_stimulus(self):
+        """
+        Stop playing a stimulus, if one is playing, and hand DMA_WRITE back to vs_write_fifo.
+        """
+        if self.fifo_writer is not None:
+            self.fifo_writer.stop()
+            self.fifo_writer = None
+
+    def stimulus_stats(self):
+        """
+        :return: dictionary with the stimulus writer counters: frames_written, total_frames, loops, writes, timeouts
+            and done
+        """
+        if self.fifo_writer is None:
+            raise ConfigError('No stimulus is playing')
+        if self.fifo_writer.error is not None:
+            raise self.fifo_writer.error
+        return self.fifo_writer.stats()
+
+    def layout(self):
+        """
+        :return: the packet layout of this configuration as plain data: a dictionary with the bitfile name, the
+            read_packets and write_packets counts and the read and write lists of packet definitions
+        """
+        return {'bitfile': self.bitfile,
+                'read_packets': self.read_packets,
+                'write_packets': self.write_packets,
+                'read': [dict(this_packet.definition) for this_packet in self.read_packet_list],
+                'write': [dict(this_packet.definition) for this_packet in self.write_packet_list]}
+
+    def enable_metrics(self, highest_ns=60 * 10 ** 9, sub_bucket_bits=7, sample_every=1):
+        """
+        Start timing the stages of every FIFO read and write into latency histograms and counting frames, timeouts
+        and late iterations, see fpga_metrics. Calling it again starts over with empty histograms.
+        :param highest_ns: largest duration the histograms tell apart, in ns
+        :param sub_bucket_bits: precision of the histograms, see fpga_metrics.LatencyHistogram
+        :param sample_every: time only one iteration in sample_every into the histograms, which cuts the cost of
+            the instrumentation on fast loops. The counters still count every iteration.
+        :return: the fpga_metrics.Instrumentation collecting the timings, also kept in metrics
+        """
+        from fpga_metrics import Instrumentation
+        self.metrics = Instrumentation(highest_ns, sub_bucket_bits, sample_every)
+        return self.metrics
+
+    def disable_metrics(self):
+        """
+        Stop timing FIFO reads and writes. With metrics disabled the read and write paths only pay for checking
+        that metrics is None.
+        """
+        self.metrics = None
+
+    def start_recording(self, filepath):
+        """
+        Record every DMA_Read and DMA_Write frame from now on, raw, to a memory-mapped file that
+        fpga_recorder.FrameRecording can decode later, without nifpga.
+        :param filepath: path of the recording file. An existing file is overwritten.
+        :return: the FrameRecorder writing the file
+        """
+        if self.recorder is not None:
+            raise ConfigError('Recording has already been started')
+        from fpga_recorder import FrameRecorder
+        self.recorder = FrameRecorder(filepath, self.layout())
+        if self.fifo_reader is not None:
+            self.fifo_reader.recorder = self.recorder
+        if self.fifo_decoder is not None:
+            self.fifo_decoder.recorder = self.recorder
+        if self.fifo_writer is not None:
+            self.fifo_writer.recorder = self.recorder
+        return self.recorder
+
+    def stop_recording(self):
+        """
+        Stop recording, if a recording is running, and close its file.
+        """
+        if self.recorder is not None:
+            recorder = self.recorder
+            self.recorder = None
+            if self.fifo_reader is not None:
+                self.fifo_reader.recorder = None
+            if self.fifo_decoder is not None:
+                self.fifo_decoder.recorder = None
+            if self.fifo_writer is not None:
+                self.fifo_writer.recorder = None
+            recorder.close()
+
+    def start_sharing(self, name=None, ring_frames=0):
+        """
+        Publish the channel table to shared memory after every read and write from now on, for other processes to
+        read with fpga_shared.SharedChannelReader. Publishing never waits on the readers.
+        Every channel is published, so while channels are subscribed the pending read packets are decoded before
+        each publish.
+        :param name: name of the shared memory block, made up by default. Readers attach with the name of the
+            returned table.
+        :param ring_frames: number of the most recent DMA_Read frames to also publish, raw, 0 for none
+        :return: the fpga_shared.SharedChannelTable being published
+        """
+        if self.shared_table is not None:
+            raise ConfigError('The channel table is already being shared')
+        from fpga_shared import SharedChannelTable
+        names = sorted(self.channel_handles, key=self.channel_handles.get)
+        self._pending_reads.flush()
+        self.shared_table = SharedChannelTable(self.channel_values, names, self._boolean_handles, self.layout(),
+                                               ring_frames=ring_frames, name=name)
+        return self.shared_table
+
+    def stop_sharing(self):
+        """
+        Stop publishing the channel table, if it is being shared, and remove its shared memory block.
+        """
+        if self.shared_table is not None:
+            shared_table = self.shared_table
+            self.shared_table = None
+            shared_table.close()
+
+    def _publish_shared(self, frames=None):
+        """
+        Publish the channel table, and the DMA_Read frames just read if any, to the shared table.
+        """
+        self._pending_reads.flush()
+        if frames is not None:
+            self.shared_table.publish_frames(frames)
+        self.shared_table.publish()
 
     def _create_packet(self, direction, index):
         """
@@ -163,6 +1225,152 @@ class VeriStandFPGA(object):
         print('{} configuration closed'.format(self.bitfile))
 
 
+class Channel(Mapping):
+    """
+    Immutable description of one channel of a packet: its name, data type, position in the packet, bit offset and
+    width in the U64, and the scaling of its data type. Parameters that do not apply to the data type are None.
+    A Channel is also a read-only mapping with the keys of the channel dictionaries Packet iteration used to
+    produce: name and data_type, plus Scale for I16 channels and FXPWL and FXPIWL for FXPI32 channels.
+    """
+    __slots__ = ('name', 'data_type', 'index', 'offset', 'width', 'scale', 'word_length', 'integer_word_length',
+                 'pwm_period', '_keys')
+    _key_attributes = {'name': 'name', 'data_type': 'data_type', 'Scale': 'scale', 'FXPWL': 'word_length',
+                       'FXPIWL': 'integer_word_length'}
+
+    def __init__(self, name, data_type, index, offset, width, scale=None, word_length=None,
+                 integer_word_length=None, pwm_period=None):
+        set_slot = super(Channel, self).__setattr__
+        set_slot('name', name)
+        set_slot('data_type', data_type)
+        set_slot('index', index)
+        set_slot('offset', offset)
+        set_slot('width', width)
+        set_slot('scale', scale)
+        set_slot('word_length', word_length)
+        set_slot('integer_word_length', integer_word_length)
+        set_slot('pwm_period', pwm_period)
+        if data_type == 'I16':
+            set_slot('_keys', ('name', 'data_type', 'Scale'))
+        elif data_type == 'FXPI32':
+            set_slot('_keys', ('name', 'data_type', 'FXPWL', 'FXPIWL'))
+        else:
+            set_slot('_keys', ('name', 'data_type'))
+
+    def __setattr__(self, attribute, value):
+        raise AttributeError('Channel objects are immutable')
+
+    def __delattr__(self, attribute):
+        raise AttributeError('Channel objects are immutable')
+
+    def __getitem__(self, key):
+        if key not in self._keys:
+            raise KeyError(key)
+        return getattr(self, self._key_attributes[key])
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __repr__(self):
+        return 'Channel({!r}, {!r}, index={}, offset={}, width={})'.format(self.name, self.data_type, self.index,
+                                                                          self.offset, self.width)
+
+
+class PacketLayout(object):
+    """
+    Immutable, compiled layout of one packet, built once from its definition dictionary and shared by every packet
+    with that definition.
+    Holds the unpack and pack plans, tuples of one tuple per channel with the shifts, masks and scaling of that
+    channel, so that unpacking and packing only do integer arithmetic per frame, and the Channels of the packet.
+    The Channels are only built the first time they are asked for, which keeps them out of the startup time.
+    """
+    __slots__ = ('definition', 'names', 'data_types', 'positions', 'unpack_plan', 'pack_plan', '_channels')
+
+    def __init__(self, definition):
+        """
+        :param definition: the flat packet definition dictionary, as produced by load_layout
+        """
+        set_slot = super(PacketLayout, self).__setattr__
+        names = []
+        data_types = []
+        unpack_plan = []
+        pack_plan = []
+        for i in range(definition['channel_count']):
+            names.append(definition['name{}'.format(i)])
+            data_type = definition['data_type{}'.format(i)]
+            data_types.append(data_type)
+            if data_type == 'Boolean':
+                unpack_plan.append((i, _BOOLEAN, i, 0x1, None))
+                pack_plan.append((i, _BOOLEAN, None, None))
+            elif data_type == 'I16':
+                scale = definition['Scale{}'.format(i)]
+                unpack_plan.append((i, _I16, i * 16, 0xFFFF, scale))
+                pack_plan.append((i, _I16, None, None))
+            elif data_type == 'FXPI32':
+                word_length = int(definition['FXPWL{}'.format(i)])
+                integer_word_length = int(definition['FXPIWL{}'.format(i)])
+                # Channel 0 sits in the upper half of the U64, channel 1 in the lower half
+                sign_bit = 1 << (word_length - 1) if word_length else 0
+                unpack_plan.append((i, _FXPI32, (1 - i) * 32, (1 << word_length) - 1,
+                                    (sign_bit, 2 ** (integer_word_length - word_length))))
+                pack_plan.append((i, _FXPI32, word_length, integer_word_length))
+            elif data_type == 'PWM':
+                unpack_plan.append((i, _PWM, 0, 0xFFFFFFFF, None))
+                pack_plan.append((i, _PWM, definition['PWM_period{}'.format(i)], None))
+            else:
+                unpack_plan.append((i, _UNSUPPORTED, 0, 0, data_type))
+                pack_plan.append((i, _UNSUPPORTED, None, data_type))
+        set_slot('definition', MappingProxyType(dict(definition)))
+        set_slot('names', tuple(names))
+        set_slot('data_types', tuple(data_types))
+        set_slot('positions', tuple(range(len(names))))
+        set_slot('unpack_plan', tuple(unpack_plan))
+        set_slot('pack_plan', tuple(pack_plan))
+        set_slot('_channels', None)
+
+    @property
+    def channels(self):
+        """
+        Tuple of the Channels of this packet, in packet order.
+        """
+        if self._channels is None:
+            channels = []
+            for i, data_type, shift, mask, args in self.unpack_plan:
+                name = self.names[i]
+                if data_type == _BOOLEAN:
+                    channels.append(Channel(name, 'Boolean', i, shift, 1))
+                elif data_type == _I16:
+                    channels.append(Channel(name, 'I16', i, shift, 16, scale=args))
+                elif data_type == _FXPI32:
+                    word_length, integer_word_length = self.pack_plan[i][2:]
+                    channels.append(Channel(name, 'FXPI32', i, shift, word_length, word_length=word_length,
+                                            integer_word_length=integer_word_length))
+                elif data_type == _PWM:
+                    # High time in the upper 32 bits, low time in the lower 32 bits
+                    channels.append(Channel(name, 'PWM', i, 0, 64, pwm_period=self.pack_plan[i][2]))
+                else:
+                    channels.append(Channel(name, args, i, 0, 0))
+            super(PacketLayout, self).__setattr__('_channels', tuple(channels))
+        return self._channels
+
+    def __setattr__(self, attribute, value):
+        raise AttributeError('PacketLayout objects are immutable')
+
+    def __delattr__(self, attribute):
+        raise AttributeError('PacketLayout objects are immutable')
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.channels)
+
+
+_FIRST_READ_LAYOUT = PacketLayout(_FIRST_READ_DEFINITION)
+
+
 class Packet(object):
     def __init__(self, config, direction, index):
         """
@@ -180,43 +1388,39 @@ class Packet(object):
         self.direction = direction
         self.index = index
         if self.direction.lower() == 'read':
-            fifo = config.read_fifo_tag
+            packet_layouts = config._packet_layouts['read']
         elif self.direction.lower() == 'write':
-            fifo = config.write_fifo_tag
+            packet_layouts = config._packet_layouts['write']
         else:
             raise BaseException('direction must be either read or write')
-
-        packet_def = {}
-        packet_tag = fifo[self.index]
-        packet_def['channel_count'] = packet_tag.__len__()
-        for cindex, child in enumerate(packet_tag):
-            packet_def['data_type{}'.format(cindex)] = child.tag
-            for grandchild in child:
-                if grandchild.tag == 'Name':
-                    packet_def['name{}'.format(cindex)] = grandchild.text
-                elif grandchild.tag == 'Scale':
-                    packet_def['Scale{}'.format(cindex)] = int(grandchild.text)
-                elif grandchild.tag == 'FXPWL':
-                    packet_def['FXPWL{}'.format(cindex)] = int(grandchild.text)
-                elif grandchild.tag == 'FXPIWL':
-                    packet_def['FXPIWL{}'.format(cindex)] = int(grandchild.text)
-                elif grandchild.tag == 'PWMPeriod':  # PWM period is measured in ticks of the FPGA clock
-                    packet_def['PWM_period{}'.format(cindex)] = int(grandchild.text)
-                else:
-                    continue
-        self.definition = packet_def
+        self._bind(packet_layouts[self.index - 1])
 
     def __iter__(self):
-        for i in range(self.definition['channel_count']):
-            channel = {}
-            channel['name'] = self.definition['name{}'.format(i)]
-            channel['data_type'] = self.definition['data_type{}'.format(i)]
-            if channel['data_type'] == 'FXPI32':
-                channel['FXPWL'] = self.definition['FXPWL{}'.format(i)]
-                channel['FXPIWL'] = self.definition['FXPIWL{}'.format(i)]
-            elif channel['data_type'] == 'I16':
-                channel['Scale'] = self.definition['Scale{}'.format(i)]
-            yield channel
+        """
+        Iterate over the Channels of this packet. They are built once with the layout, so iterating allocates nothing
+        per channel, and each Channel still answers channel['name'] and the other keys of the old channel dictionaries.
+        """
+        return iter(self.packet_layout.channels)
+
+    @property
+    def definition(self):
+        """
+        Read-only view of the packet definition as the flat dictionary found in the .fpgaconfig, with keys such as
+        channel_count, name0, data_type0 and Scale0.
+        """
+        return self.packet_layout.definition
+
+    def _bind(self, packet_layout):
+        """
+        Make this packet use a PacketLayout, copying the plans the hot paths read into attributes of the packet.
+        """
+        self.packet_layout = packet_layout
+        self._names = packet_layout.names
+        self._data_types = packet_layout.data_types
+        self._positions = packet_layout.positions
+        self._handles = self._positions
+        self._unpack_plan = packet_layout.unpack_plan
+        self._pack_plan = packet_layout.pack_plan
 
     def _unpack(self, data):
         """
@@ -224,69 +1428,137 @@ class Packet(object):
         :param data: U64 value that comes out of the DMA_Read
         :return: real_values: dictionary of real_values with channel names as keys and unpacked channels as values
         """
-        binstr = '{0:064b}'.format(int(data))
         real_values = {}
-        for i in range(self.definition['channel_count']):
-            if self.definition['data_type{}'.format(i)] == 'FXPI32':
-                chnlunpck = 0
-                chnldata = binstr[int(i*32):int((i+1)*32)]
-                nopad = chnldata[32 - int(self.definition['FXPWL{}'.format(i)]):int((i + 1) * 32)]
-                for index, char in enumerate(nopad):
-                    if int(nopad[0]) != 0:
-                        if int(char) == 0:
-                            char = 1
-                        else:
-                            char = 0
-                    powof = int(self.definition['FXPIWL{}'.format(i)]) - 1 - index
-                    bitval = int(char) * 2 ** powof
-                    chnlunpck = chnlunpck + bitval
-                real_values['{}'.format(self.definition['name{}'.format(i)])] = chnlunpck
-
-            elif self.definition['data_type{}'.format(i)] == 'PWM':
-                hitime = int(binstr[:32], 2)
-                lowtime = int(binstr[32:], 2)
-                dutycycle = (hitime/(hitime+lowtime))*100
-                real_values['{}'.format(self.definition['name{}'.format(i)])] = dutycycle
-
-            elif self.definition['data_type{}'.format(i)] == 'Boolean':
-                bit = int(binstr[63-i])
-                real_values['{}'.format(self.definition['name{}'.format(i)])] = bool(bit)
-
-            elif self.definition['data_type{}'.format(i)] == 'I16':
-                analog_data_str = binstr[int((3-i)*16):int((4-i)*16)]
-                analog_int = 0
-                if analog_data_str[0] == '1':
-                    for char in range(15):
-                        if analog_data_str[char+1] == '0':
-                            analog_int += 2**(14-char)
-                        elif analog_data_str[char+1] != '1':
-                            raise PacketError(message='{} has a non binary character in data string'.format(
-                                self.definition['name{}'.format(i)]), packetID=self.index)
-                    analog_int *= -1
-                    analog_int -= 1
-                elif analog_data_str[0] == '0':
-                    for char in range(15):
-                        if analog_data_str[char+1] == '1':
-                            analog_int += 2**(14-char)
-                        elif analog_data_str[char+1] == '0':
-                            continue
-                        else:
-                            raise PacketError(message='{} has a non binary character in data string'.format(
-                                self.definition['name{}'.format(i)]), packetID=self.index)
-                else:
-                    raise PacketError(message='{} has a non binary character in data string'.format(
-                        self.definition['name{}'.format(i)]), packetID=self.index)
+        self._unpack_into(data, real_values, self._names)
+        return real_values
+
+    def _unpack_into(self, data, values, handles, plan=None):
+        """
+        Unpack a U64 straight into a table of channel values.
+        :param data: U64 value that comes out of the DMA_Read
+        :param values: table the unpacked channels are stored in, such as the VeriStandFPGA channel values array
+        :param handles: the key or index in values of each channel of this packet, in channel order
+        :param plan: steps of the unpack plan to run, to decode only some channels. Defaults to every channel.
+        """
+        data = int(data)
+        if plan is None:
+            plan = self._unpack_plan
+        for i, data_type, shift, mask, args in plan:
+            raw = (data >> shift) & mask
+            if data_type == _BOOLEAN:
+                values[handles[i]] = bool(raw)
+
+            elif data_type == _I16:
+                if raw & 0x8000:
+                    raw -= 0x10000
                 analog_cal = 0
-                scale = self.definition['Scale{}'.format(i)]
-                if analog_int > 0:
-                    analog_cal = (scale * analog_int)/32767
-                elif analog_int < 0:
-                    analog_cal = (-1 * scale * analog_int)/-32768
-                real_values['{}'.format(self.definition['name{}'.format(i)])] = analog_cal
+                if raw > 0:
+                    analog_cal = (args * raw)/32767
+                elif raw < 0:
+                    analog_cal = (-1 * args * raw)/-32768
+                values[handles[i]] = analog_cal
+
+            elif data_type == _FXPI32:
+                sign_bit, lsb_weight = args
+                if raw & sign_bit:
+                    # Negative values come back as the magnitude of their ones' complement, as they always have
+                    raw = ~raw & mask
+                values[handles[i]] = raw * lsb_weight
+
+            elif data_type == _PWM:
+                hitime = (data >> 32) & mask
+                lowtime = raw
+                values[handles[i]] = (hitime/(hitime+lowtime))*100
+
+            else:
+                raise PacketError(message='{} has an unsupported data type of {}'.format(self._names[i], args),
+                                  packetID=self.index)
+
+    def _unpack_array(self, data, names=None):
+        """
+        Vectorized counterpart of _unpack for many frames of this packet at once.
+        :param data: numpy array of U64 values that came out of the DMA_Read for this packet
+        :param names: collection of channel names to decode. All channels are decoded by default.
+        :return: real_values: dictionary of numpy arrays with channel names as keys
+        """
+        data = np.asarray(data, dtype=np.uint64)
+        real_values = {}
+        for i, data_type, shift, mask, args in self._unpack_plan:
+            name = self._names[i]
+            if names is not None and name not in names:
+                continue
+            raw = (data >> np.uint64(shift)) & np.uint64(mask)
+            if data_type == _BOOLEAN:
+                real_values[name] = raw.astype(bool)
+
+            elif data_type == _I16:
+                signed = raw.astype(np.uint16).view(np.int16).astype(np.float64)
+                real_values[name] = np.where(signed > 0, (args * signed)/32767, (args * signed)/32768)
+
+            elif data_type == _FXPI32:
+                sign_bit, lsb_weight = args
+                negative = (raw & np.uint64(sign_bit)) != 0
+                raw = np.where(negative, ~raw & np.uint64(mask), raw)
+                real_values[name] = raw.astype(np.float64) * lsb_weight
+
+            elif data_type == _PWM:
+                hitime = ((data >> np.uint64(32)) & np.uint64(mask)).astype(np.float64)
+                lowtime = raw.astype(np.float64)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    real_values[name] = (hitime/(hitime+lowtime))*100
+
+            else:
+                raise PacketError(message='{} has an unsupported data type of {}'.format(name, args),
+                                  packetID=self.index)
+
+        return real_values
+
+    def _unpack_write_array(self, data, names=None):
+        """
+        Vectorized inverse of _pack_from, for DMA_Write frames of this packet. DMA_Write lays channels out unlike
+        DMA_Read: one after the other from bit 0, FXPI32 channel 0 in the lower 32 bits, and I16 channels on the
+        fixed 10 V scale _pack_from packs them with rather than on their Scale.
+        Values come back as they were packed, truncated to the resolution of their data type. A negative FXPI32 is
+        not packed as a value, see _pack_from, so a frame holding one does not decode to the values written.
+        :param data: numpy array of U64 values that went into the DMA_Write for this packet
+        :param names: collection of channel names to decode. All channels are decoded by default.
+        :return: real_values: dictionary of numpy arrays with channel names as keys
+        """
+        data = np.asarray(data, dtype=np.uint64)
+        real_values = {}
+        width = 0
+        for i, data_type, arg0, arg1 in self._pack_plan:
+            name = self._names[i]
+            wanted = names is None or name in names
+            if data_type == _BOOLEAN:
+                if wanted:
+                    real_values[name] = ((data >> np.uint64(width)) & np.uint64(1)).astype(bool)
+                width += 1
+
+            elif data_type == _I16:
+                if wanted:
+                    raw = (data >> np.uint64(width)) & np.uint64(0xFFFF)
+                    signed = raw.astype(np.uint16).view(np.int16).astype(np.float64)
+                    real_values[name] = np.where(signed > 0, (10 * signed)/32767, (10 * signed)/32768)
+                width += 16
+
+            elif data_type == _FXPI32:
+                if wanted:
+                    raw = (data >> np.uint64(width)) & np.uint64(0xFFFFFFFF)
+                    real_values[name] = raw.astype(np.float64) * 2.0 ** (arg1 - arg0)
+                width += 32
+
+            elif data_type == _PWM:
+                if wanted:
+                    hitime = (data >> np.uint64(32)).astype(np.float64)
+                    lowtime = (data & np.uint64(0xFFFFFFFF)).astype(np.float64)
+                    with np.errstate(divide='ignore', invalid='ignore'):
+                        real_values[name] = (hitime/(hitime+lowtime))*100
+                width = 64
 
             else:
-                raise PacketError(message='{} has an unsupported data type of {}'.format(
-                    self.definition['name{}'.format(i)], self.definition['data_type{}'.format(i)]), packetID=self.index)
+                raise PacketError(message='{} has an unsupported data type of {}'.format(name, arg1),
+                                  packetID=self.index)
 
         return real_values
 
@@ -296,77 +1568,149 @@ class Packet(object):
         :param real_values: list of values to write to the channels in this packet
         :return packed_data: a U64 that represents the real values entered into this function
         """
-        datastr = ''
-        for i in range(self.definition['channel_count']):
-            if self.definition['data_type{}'.format(i)] == 'Boolean':
-                value = int(real_values[i])
-                if value:
-                    bit = 1
+        return self._pack_from(real_values, self._positions)
+
+    def _pack_array(self, columns, iterations):
+        """
+        Vectorized counterpart of _pack_from for many frames of this packet at once, packing the same bits.
+        :param columns: values of each channel of this packet in channel order, each a numpy array with one value per
+            frame or a single value for every frame
+        :param iterations: number of frames
+        :return: numpy uint64 array of the packed frames
+        """
+        packed = np.zeros(iterations, dtype=np.uint64)
+        width = np.zeros(iterations, dtype=np.uint64)
+        for i, data_type, arg0, arg1 in self._pack_plan:
+            value = np.broadcast_to(np.asarray(columns[i], dtype=np.float64), (iterations,))
+            if data_type == _BOOLEAN:
+                packed |= _shift_left((_truncate(value, self._names[i]) != 0).astype(np.uint64), width)
+                width += np.uint64(1)
+
+            elif data_type == _PWM:
+                dutycycle = _truncate(np.broadcast_to(np.asarray(columns[0], dtype=np.float64), (iterations,)),
+                                      self._names[0])
+                if ((dutycycle < 0) | (dutycycle > 100)).any():
+                    raise PacketError(message='{} holds a duty cycle outside 0 to 100 %'.format(self._names[0]),
+                                      packetID=self.index)
+                hi_time = np.round((dutycycle/100) * arg0).astype(np.int64)
+                low_time = arg0 - hi_time
+                packed = ((hi_time << 32) | low_time).view(np.uint64)
+                width = np.full(iterations, 64, dtype=np.uint64)
+
+            elif data_type == _FXPI32:
+                word_length, integer_word_length = arg0, arg1
+                negative = _truncate(value, self._names[i]) < 0
+                # Negative values complement the channels already packed, see _pack_from. From 64 bits up the mask
+                # wraps around to all ones.
+                complement = ~packed & (_shift_left(np.ones(iterations, dtype=np.uint64), width) - np.uint64(1))
+                largest = (1 << (word_length - 1)) - 1
+                scaled = np.abs(value) * 2.0 ** (word_length - integer_word_length)
+                magnitude = np.where(scaled >= largest, largest, np.floor(np.minimum(scaled, largest)))
+                magnitude = magnitude.astype(np.uint64)
+                packed |= _shift_left(np.where(negative, complement, magnitude), width)
+                width += np.where(negative, width + np.uint64(32 - word_length), np.uint64(32)).astype(np.uint64)
+
+            elif data_type == _I16:
+                if np.isinf(value).any():
+                    raise OverflowError('{} holds an infinite value'.format(self._names[i]))
+                raw_value = np.where(value > 0, np.round((32767 * value)/10),
+                                     np.where(value < 0, np.round((-32768 * value)/-10), 0))
+                raw_value = np.nan_to_num(np.clip(raw_value, -32768, 32767)).astype(np.int64)
+                packed |= _shift_left((raw_value & 0xFFFF).astype(np.uint64), width)
+                width += np.uint64(16)
+
+            else:
+                raise PacketError(message='{} has an unsupported data type of {}'.format(self._names[i], arg1),
+                                  packetID=self.index)
+        if not width.all():
+            raise PacketError(message='Packet packs to no bits, see _pack_from', packetID=self.index)
+        return packed
+
+    def _pack_from(self, values, handles):
+        """
+        Pack this packet's channels straight out of a table of channel values.
+        :param values: table holding the channel values, such as the VeriStandFPGA channel values array
+        :param handles: the key or index in values of each channel of this packet, in channel order
+        :return packed_data: a U64 that represents the values of this packet's channels
+        """
+        packed_data = 0
+        width = 0
+        for i, data_type, arg0, arg1 in self._pack_plan:
+            if data_type == _BOOLEAN:
+                if int(values[handles[i]]):
+                    packed_data |= 1 << width
+                width += 1
+
+            elif data_type == _PWM:
+                dutycycle = int(values[handles[0]])
+                if not 0 <= dutycycle <= 100:
+                    # The string codec could not pack these either, above 100 % it raised and below 0 % it built
+                    # a negative word
+                    raise PacketError(message='{} has a duty cycle of {} %, outside 0 to 100 %'.format(
+                        self._names[0], values[handles[0]]), packetID=self.index)
+                hi_time = int(round((dutycycle/100) * arg0))
+                low_time = arg0 - hi_time
+                packed_data = (hi_time << 32) | low_time
+                width = 64
+
+            elif data_type == _FXPI32:
+                word_length, integer_word_length = arg0, arg1
+                if int(values[handles[i]]) < 0:
+                    # The negative branch complements the channels already packed rather than this channel's
+                    # magnitude, and pads the result out to 32 - FXPWL bits. Kept bit for bit so frames do not change.
+                    complement = ~packed_data & ((1 << width) - 1)
+                    packed_data |= complement << width
+                    width += width + 32 - word_length
                 else:
-                    bit = 0
-                datastr = (str(bit)) + datastr
-
-            elif self.definition['data_type{}'.format(i)] == 'PWM':
-                dutycycle = int(real_values[0])
-                hi_time = int(round((dutycycle/100) * self.definition['PWM_period{}'.format(i)]))
-                low_time = self.definition['PWM_period{}'.format(i)] - hi_time
-                datastr = '{0:032b}'.format(hi_time) + '{0:032b}'.format(low_time)
-
-            elif self.definition['data_type{}'.format(i)] == 'FXPI32':
-                binstr = '0'
-                negstr = ''
-                value = float(real_values[i])
-                for j in range(int(self.definition['FXPWL{}'.format(i)])-1):
-                    check = abs(value) - 2**(int(self.definition['FXPIWL{}'.format(i)])-2-j)
-                    if check >= 0:
-                        binstr = binstr + '1'
-                        value = check
+                    # Truncate towards zero onto the FXPWL - 1 magnitude bits, saturating at full scale
+                    largest = (1 << (word_length - 1)) - 1
+                    scaled = abs(float(values[handles[i]])) * 2.0 ** (word_length - integer_word_length)
+                    if scaled >= largest:
+                        magnitude = largest
+                    elif scaled == scaled:
+                        magnitude = int(scaled)
                     else:
-                        binstr = binstr + '0'
-                if int(real_values[i]) < 0:
-                    for char in datastr:
-                        if char == '0':
-                            negstr = negstr + '1'
-                        else:
-                            negstr = negstr + '0'
-                    binstr = negstr
-                for j in range(32-int(self.definition['FXPWL{}'.format(i)])):
-                    binstr = '0' + binstr
-                datastr = binstr + datastr
-
-            elif self.definition['data_type{}'.format(i)] == 'I16':
-                calibrated_value = float(real_values[i])
+                        magnitude = 0
+                    packed_data |= magnitude << width
+                    width += 32
+
+            elif data_type == _I16:
+                calibrated_value = float(values[handles[i]])
                 raw_value = 0
                 if calibrated_value > 0:
                     raw_value = int(round((32767 * calibrated_value)/10))
                 elif calibrated_value < 0:
                     raw_value = int(round((-32768 * calibrated_value)/-10))
-                if raw_value >= 0:
-                    binstr = '0'
-                    for bit in range(15):
-                        bitcheck = int(raw_value - 2 ** (14-bit))
-                        if bitcheck >= 0:
-                            binstr += '1'
-                            raw_value = bitcheck
-                        else:
-                            binstr += '0'
-                else:
-                    binstr = '1'
-                    for bit in range(15):
-                        bitcheck = int(raw_value + 2 ** (14-bit))
-                        if bitcheck < 0:
-                            binstr += '0'
-                            raw_value = bitcheck
-                        else:
-                            binstr += '1'
-                datastr = binstr + datastr
+                raw_value = max(-32768, min(32767, raw_value))
+                packed_data |= (raw_value & 0xFFFF) << width
+                width += 16
 
             else:
-                raise PacketError(message='{} has an unsupported data type of {}'.format(
-                    self.definition['name{}'.format(i)], self.definition['data_type{}'.format(i)]), packetID=self.index)
-        packed_data = int(datastr, 2)
+                raise PacketError(message='{} has an unsupported data type of {}'.format(self._names[i], arg1),
+                                  packetID=self.index)
+        if not width:
+            # Negative 32 bit FXPI32s add no bits when nothing was packed before them, and the string codec could
+            # not parse the empty string it was left with either
+            raise PacketError(message='Packet packs to no bits', packetID=self.index)
         return packed_data
 
+
+def packet_from_definition(direction, index, definition):
+    """
+    Create a packet from a definition dictionary, as found in Packet.definition, instead of from the XML.
+    :param direction: direction of the FIFO. This should be 'read' or 'write'.
+    :param index: The index of the packet. The value should be an integer of 1 or greater.
+    :param definition: the packet definition
+    """
+    if index == 1 and direction.lower() == 'read':
+        return FirstReadPacket()
+    this_packet = Packet.__new__(Packet)
+    this_packet.direction = direction
+    this_packet.index = index
+    this_packet._bind(PacketLayout(definition))
+    return this_packet
+
+
 class FirstReadPacket(Packet):
     """
 
@@ -374,8 +1718,128 @@ class FirstReadPacket(Packet):
     """
 
     def __init__(self):
-        self.definition = {}
-        self.definition['channel_count'] = 1
-        self.definition['name0'] = 'Is Late?'
-        self.definition['data_type0'] = 'Boolean'
+        self._bind(_FIRST_READ_LAYOUT)
+
+
+class _PendingReads(object):
+    """
+    Last DMA_Read frame of a VeriStandFPGA with channels subscribed, and which of its read packets have been decoded
+    into the channel values since it was read. generation counts the frames read, so that reading a frame leaves
+    every packet pending without touching each of them.
+    """
+    __slots__ = ('packets', 'values', 'frame', 'generation', 'decoded', 'packet_of', 'fresh')
+
+    def __init__(self, read_packet_list, values, channel_count):
+        self.packets = read_packet_list
+        self.values = values
+        self.frame = None
+        self.generation = 0
+        self.decoded = [0] * len(read_packet_list)
+        # Read packet each channel is decoded from, -1 for channels that are only written
+        self.packet_of = [-1] * channel_count
+        for pack_index, this_packet in enumerate(read_packet_list):
+            for handle in this_packet._handles:
+                self.packet_of[handle] = pack_index
+        # Channels decoded on every read, which are never pending
+        self.fresh = frozenset()
+
+    def refresh(self, handle):
+        """
+        Decode the packet of a channel from the last frame, unless it is up to date.
+        """
+        pack_index = self.packet_of[handle]
+        if pack_index >= 0 and self.decoded[pack_index] != self.generation and handle not in self.fresh:
+            self._decode(pack_index)
+
+    def flush(self):
+        """
+        Decode every pending packet, so that all the channel values are up to date.
+        """
+        if self.frame is not None:
+            for pack_index in range(len(self.packets)):
+                if self.decoded[pack_index] != self.generation:
+                    self._decode(pack_index)
+
+    def _decode(self, pack_index):
+        this_packet = self.packets[pack_index]
+        this_packet._unpack_into(self.frame[pack_index], self.values, this_packet._handles)
+        self.decoded[pack_index] = self.generation
+
+
+def _truncate(value, name):
+    """
+    Truncate floats towards zero like int() does for each value, raising on the values int() would refuse.
+    """
+    if not np.isfinite(value).all():
+        raise ValueError('{} holds a value that is not finite'.format(name))
+    return np.trunc(value)
+
+
+def _shift_left(value, shift):
+    """
+    Shift uint64 values left by per-element amounts, shifting out to zero at 64 bits and above, where numpy would
+    wrap the shift amount instead.
+    """
+    return np.where(shift < 64, value << np.minimum(shift, np.uint64(63)), np.uint64(0))
+
+
+def _fifo_buffer(fifo, buffer):
+    """
+    Bind a FIFO to a preallocated numpy uint64 buffer, picking the cheapest transfer the FIFO object supports.
+    """
+    if hasattr(fifo, '_read_func') and hasattr(fifo, '_session'):
+        return _DirectFIFOBuffer(fifo, buffer)
+    return _CopyingFIFOBuffer(fifo, buffer)
+
+
+class _DirectFIFOBuffer(object):
+    """
+    Transfers between a nifpga FIFO and a numpy buffer by handing the buffer's memory straight to the NiFpga
+    ReadFifoU64 and WriteFifoU64 calls, so the driver copies to or from it without any Python objects in between.
+    This is used rather than acquire_read_region, which creates several Python objects on every call.
+    """
+
+    def __init__(self, fifo, buffer):
+        self.buffer = buffer
+        self.view = memoryview(buffer).cast('B').cast('Q')
+        self._fifo = fifo
+        self._pointer = buffer.ctypes.data_as(ctypes.POINTER(ctypes.c_uint64))
+        self._length = len(buffer)
+        self._elements_remaining = ctypes.c_size_t()
+
+    def read(self, timeout):
+        self._fifo._read_func(self._fifo._session, self._fifo._number, self._pointer, self._length, timeout,
+                              self._elements_remaining)
+        return self._elements_remaining.value
+
+    def write(self, timeout):
+        self._fifo._write_func(self._fifo._session, self._fifo._number, self._pointer, self._length, timeout,
+                               self._elements_remaining)
+        return self._elements_remaining.value
+
+
+class _CopyingFIFOBuffer(object):
+    """
+    Transfers between any other FIFO object and a numpy buffer. FIFOs offering read_into and write_from, like the
+    simulated ones, fill and drain the buffer in place. Otherwise the list returned by read is copied into it.
+    """
+
+    def __init__(self, fifo, buffer):
+        self.buffer = buffer
+        self.view = memoryview(buffer).cast('B').cast('Q')
+        self._fifo = fifo
+        self._length = len(buffer)
+        self._read_into = getattr(fifo, 'read_into', None)
+        self._write_from = getattr(fifo, 'write_from', None)
+
+    def read(self, timeout):
+        if self._read_into is not None:
+            return self._read_into(self.view, timeout)
+        read_tup = self._fifo.read(number_of_elements=self._length, timeout_ms=timeout)
+        self.buffer[:] = read_tup.data
+        return read_tup.elements_remaining
 
+    def write(self, timeout):
+        if self._write_from is not None:
+            return self._write_from(self.view, timeout)
+        return self._fifo.write(data=self.buffer, timeout_ms=timeout)
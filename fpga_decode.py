@@ -0,0 +1,379 @@
+"""
+DMA_Read frames decoded by a pool of worker processes, for configurations with so many read packets that decoding
+saturates one core. Threads do not help there, as decoding holds the GIL.
+
+Frames are decoded in chunks, each in one slot of two shared memory blocks. The raw U64s of a chunk are put in its
+slot of the frame block, straight from the FIFO when a FIFODecoder feeds the pool. A worker process decodes the slot
+with the vectorized codec into the same slot of the result block, which holds one float64 column per read channel,
+and chunks are collected in the order they were submitted. The packet layout is sent to each worker once, when the
+pool starts, so a task only carries a slot number and a frame count.
+"""
+import multiprocessing
+import os
+import threading
+from collections import deque
+
+from fpga_config import packet_from_definition, _fifo_buffer, _require_numpy
+from fpga_shared import _attach, _require_shared_memory
+from fpga_stream import is_fifo_timeout
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def _read_columns(read_packet_list):
+    """
+    :return: the read channel names, one column each in packet order, and the names of the Boolean channels
+    """
+    names = []
+    booleans = set()
+    for this_packet in read_packet_list:
+        for name, data_type in zip(this_packet._names, this_packet._data_types):
+            if name not in names:
+                names.append(name)
+            if data_type == 'Boolean':
+                booleans.add(name)
+    return names, booleans
+
+
+class _Blocks(object):
+    """
+    numpy views of the frame and result blocks, shaped (slots, chunk_frames, read_packets) and
+    (slots, channels, chunk_frames), so that each decoded column of a slot is contiguous.
+    """
+
+    def __init__(self, frame_memory, result_memory, slots, chunk_frames, read_packets, channels):
+        self.frames = np.ndarray((slots, chunk_frames, read_packets), dtype=np.uint64, buffer=frame_memory.buf)
+        self.results = np.ndarray((slots, channels, chunk_frames), dtype=np.float64, buffer=result_memory.buf)
+
+
+class _DecodeWorker(object):
+    """
+    State of one worker process: the read packets, built from the layout sent at pool start, and the shared blocks.
+    """
+
+    def __init__(self, layout, frame_name, result_name, slots, chunk_frames):
+        self.read_packet_list = [packet_from_definition('read', index + 1, definition)
+                                 for index, definition in enumerate(layout['read'])]
+        names, _ = _read_columns(self.read_packet_list)
+        self.columns = dict((name, column) for column, name in enumerate(names))
+        self._frame_memory = _attach(frame_name)
+        self._result_memory = _attach(result_name)
+        self.blocks = _Blocks(self._frame_memory, self._result_memory, slots, chunk_frames, layout['read_packets'],
+                              len(names))
+
+    def decode(self, slot, frames):
+        data = self.blocks.frames[slot, :frames]
+        results = self.blocks.results[slot]
+        columns = self.columns
+        for i, this_packet in enumerate(self.read_packet_list):
+            for name, values in this_packet._unpack_array(data[:, i]).items():
+                results[columns[name], :frames] = values
+
+
+_worker = None
+
+
+def _start_worker(layout, frame_name, result_name, slots, chunk_frames):
+    global _worker
+    _worker = _DecodeWorker(layout, frame_name, result_name, slots, chunk_frames)
+
+
+def _decode_slot(slot, frames):
+    _worker.decode(slot, frames)
+
+
+class DecodeExecutor(object):
+    """
+    Pool of worker processes decoding chunks of DMA_Read frames held in shared memory.
+
+    Chunks go through slots: acquire a free slot, fill frame_buffer(slot) with the raw frames, submit it, and later
+    collect the oldest chunk submitted, read its columns and release the slot. decode does all of that for a block
+    of frames already in memory, such as a recording. One thread may submit while another collects, as FIFODecoder
+    and VeriStandFPGA.read_decoded do, but decode must not be used at the same time.
+    """
+
+    def __init__(self, layout, workers=None, chunk_frames=256, slots=None):
+        """
+        :param layout: packet layout of the configuration, as returned by VeriStandFPGA.layout
+        :param workers: number of worker processes, one less than the number of CPUs by default
+        :param chunk_frames: number of frames per chunk, the unit of work of a worker. Each channel of a chunk costs a
+            few numpy calls whatever the chunk length, so chunks of thousands of frames decode fastest.
+        :param slots: number of chunks in flight at most, twice the number of workers by default
+        """
+        _require_numpy()
+        _require_shared_memory()
+        if workers is None:
+            workers = max(1, (os.cpu_count() or 1) - 1)
+        if slots is None:
+            slots = 2 * workers
+        self.workers = workers
+        self.chunk_frames = chunk_frames
+        self.slots = slots
+        self.read_packets = layout['read_packets']
+        self.read_packet_list = [packet_from_definition('read', index + 1, definition)
+                                 for index, definition in enumerate(layout['read'])]
+        self.channel_names, self._boolean_names = _read_columns(self.read_packet_list)
+        self._frame_memory = shared_memory.SharedMemory(create=True,
+                                                        size=max(8, 8 * slots * chunk_frames * self.read_packets))
+        self._result_memory = shared_memory.SharedMemory(
+            create=True, size=max(8, 8 * slots * chunk_frames * len(self.channel_names)))
+        self._blocks = _Blocks(self._frame_memory, self._result_memory, slots, chunk_frames, self.read_packets,
+                               len(self.channel_names))
+        self._pool = multiprocessing.Pool(workers, initializer=_start_worker,
+                                          initargs=(layout, self._frame_memory.name, self._result_memory.name, slots,
+                                                    chunk_frames))
+        self._free = deque(range(slots))
+        self._pending = deque()
+        self._condition = threading.Condition()
+        self.chunks_decoded = 0
+        self.frames_decoded = 0
+        self.error = None
+
+    def frame_buffer(self, slot):
+        """
+        :return: flat numpy uint64 view of the frames of a slot, chunk_frames * read_packets U64s
+        """
+        return self._blocks.frames[slot].reshape(-1)
+
+    def acquire(self, timeout=None):
+        """
+        Take a free slot, waiting for one to be released if there are none.
+        :param timeout: time in seconds to wait at most, without limit by default
+        :return: the slot number, or None on timeout
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._free, timeout):
+                return None
+            return self._free.popleft()
+
+    def submit(self, slot, frames):
+        """
+        Hand the frames put in a slot to the pool.
+        :param slot: slot number, from acquire
+        :param frames: number of frames in the slot, at most chunk_frames
+        """
+        job = self._pool.apply_async(_decode_slot, (slot, frames))
+        with self._condition:
+            self._pending.append((slot, frames, job))
+            self._condition.notify_all()
+
+    def fail(self, error):
+        """
+        Report that no more chunks will be submitted because of error. collect raises it once the chunks already
+        submitted have been collected, rather than waiting for a chunk that never comes.
+        """
+        with self._condition:
+            self.error = error
+            self._condition.notify_all()
+
+    @property
+    def pending(self):
+        """
+        Number of chunks submitted and not collected yet.
+        """
+        return len(self._pending)
+
+    def collect(self, timeout=None):
+        """
+        Wait for the oldest chunk submitted to be decoded. Errors raised decoding it are raised here, and so is the
+        error passed to fail once every chunk submitted before it has been collected.
+        :param timeout: time in seconds to wait at most, without limit by default
+        :return: (slot, frames) of the chunk, or None on timeout
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._pending or self.error is not None, timeout):
+                return None
+            if not self._pending:
+                raise self.error
+            slot, frames, job = self._pending[0]
+        job.wait(timeout)
+        if not job.ready():
+            return None
+        with self._condition:
+            self._pending.popleft()
+        try:
+            job.get()
+        except BaseException:
+            self.release(slot)
+            raise
+        self.chunks_decoded += 1
+        self.frames_decoded += frames
+        return slot, frames
+
+    def columns(self, slot, frames):
+        """
+        Copy the decoded columns of a collected slot out of the result block.
+        :return: dictionary of numpy arrays with channel names as keys, one element per frame, as from
+            VeriStandFPGA.decode_read_frames
+        """
+        results = self._blocks.results[slot]
+        columns = {}
+        for column, name in enumerate(self.channel_names):
+            if name in self._boolean_names:
+                columns[name] = results[column, :frames].astype(bool)
+            else:
+                columns[name] = results[column, :frames].copy()
+        return columns
+
+    def release(self, slot):
+        """
+        Give a collected slot back, for a later chunk.
+        """
+        with self._condition:
+            self._free.append(slot)
+            self._condition.notify_all()
+
+    def decode(self, frames):
+        """
+        Decode a block of raw DMA_Read frames, chunk by chunk, across the pool.
+        :param frames: array-like of U64 values shaped (iterations, read_packets), as read from the DMA_Read FIFO
+        :return: dictionary of numpy arrays with channel names as keys, in frame order, as from
+            VeriStandFPGA.decode_read_frames
+        """
+        frames = np.asarray(frames, dtype=np.uint64)
+        if frames.ndim != 2 or frames.shape[1] != self.read_packets:
+            raise ValueError('frames must be shaped (iterations, {}), got {}'.format(self.read_packets,
+                                                                                     frames.shape))
+        iterations = len(frames)
+        results = np.empty((len(self.channel_names), iterations))
+        starts = deque()
+        submitted = 0
+        while submitted < iterations or starts:
+            # Keep every slot busy, then take the oldest chunk
+            while submitted < iterations and self._free:
+                slot = self.acquire()
+                stop = min(submitted + self.chunk_frames, iterations)
+                self._blocks.frames[slot, :stop - submitted] = frames[submitted:stop]
+                self.submit(slot, stop - submitted)
+                starts.append(submitted)
+                submitted = stop
+            slot, count = self.collect()
+            start = starts.popleft()
+            results[:, start:start + count] = self._blocks.results[slot, :, :count]
+            self.release(slot)
+        return dict((name, results[column].astype(bool) if name in self._boolean_names else results[column])
+                    for column, name in enumerate(self.channel_names))
+
+    def stats(self):
+        """
+        :return: dictionary of the executor counters: workers, slots, chunk_frames, chunks_decoded, frames_decoded
+            and pending
+        """
+        return {'workers': self.workers,
+                'slots': self.slots,
+                'chunk_frames': self.chunk_frames,
+                'chunks_decoded': self.chunks_decoded,
+                'frames_decoded': self.frames_decoded,
+                'pending': self.pending}
+
+    def close(self):
+        """
+        Stop the worker processes and remove the shared memory blocks. Chunks not collected yet are dropped.
+        """
+        if self._pool is None:
+            return
+        self._pool.terminate()
+        self._pool.join()
+        self._pool = None
+        self._pending.clear()
+        # The numpy views must be gone before the blocks can be closed
+        self._blocks = None
+        for memory in (self._frame_memory, self._result_memory):
+            memory.close()
+            memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_val, trace):
+        self.close()
+
+
+class FIFODecoder(threading.Thread):
+    """
+    Thread reading the DMA_Read FIFO chunk by chunk straight into the free slots of a DecodeExecutor, and into
+    recorder when one is set, and handing each chunk to the pool. It does no decoding itself, so that it keeps up
+    with the FIFO. When no slot is free, because the chunks decoded are not being collected fast enough, it waits
+    and counts a stall, and the FIFO fills meanwhile.
+    FIFO timeouts are counted and retried, any other error stops the thread, is kept in error and is passed to the
+    executor, which raises it from collect.
+    """
+
+    def __init__(self, fifo, executor, timeout):
+        """
+        :param fifo: the DMA_Read FIFO of the session
+        :param executor: DecodeExecutor to feed
+        :param timeout: timeout in ms of a chunk read, and of the wait for a free slot
+        """
+        super(FIFODecoder, self).__init__(name='DMA_READ decoder')
+        self.daemon = True
+        self.fifo = fifo
+        self.executor = executor
+        self.timeout = timeout
+        self.reads = 0
+        self.timeouts = 0
+        self.stalls = 0
+        self.backlog = 0
+        self.max_backlog = 0
+        self.error = None
+        self.recorder = None
+        self._stop_event = threading.Event()
+        self._transfers = [_fifo_buffer(fifo, executor.frame_buffer(slot)) for slot in range(executor.slots)]
+
+    def run(self):
+        executor = self.executor
+        frame_length = executor.read_packets
+        try:
+            while not self._stop_event.is_set():
+                slot = executor.acquire(self.timeout / 1000)
+                if slot is None:
+                    self.stalls += 1
+                    continue
+                transfer = self._transfers[slot]
+                while True:
+                    try:
+                        elements_remaining = transfer.read(self.timeout)
+                        break
+                    except BaseException as error:
+                        if not is_fifo_timeout(error):
+                            executor.release(slot)
+                            raise
+                        self.timeouts += 1
+                        if self._stop_event.is_set():
+                            executor.release(slot)
+                            return
+                recorder = self.recorder
+                if recorder is not None:
+                    recorder.record_read(transfer.view)
+                executor.submit(slot, executor.chunk_frames)
+                self.reads += 1
+                self.backlog = elements_remaining // frame_length
+                self.max_backlog = max(self.max_backlog, self.backlog)
+        except BaseException as error:
+            self.error = error
+            executor.fail(error)
+        finally:
+            # The transfers hold views of the frame block, which must be gone before the executor closes it
+            self._transfers = None
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def stats(self):
+        """
+        :return: dictionary of the decoder counters, in frames where applicable
+        """
+        return {'frames_read': self.reads * self.executor.chunk_frames,
+                'reads': self.reads,
+                'timeouts': self.timeouts,
+                'stalls': self.stalls,
+                'fifo_backlog': self.backlog,
+                'max_fifo_backlog': self.max_backlog}
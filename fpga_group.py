@@ -0,0 +1,215 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+
+from fpga_config import VeriStandFPGA, ConfigError
+
+SEPARATOR = '/'
+
+
+class FPGAGroup(object):
+    """
+    Several VeriStandFPGA devices driven as one.
+
+    Each device is given a namespace, and its channels appear in the group as 'namespace/channel name'. FIFO reads
+    and writes of the devices run concurrently on a thread pool with one thread per device. The nifpga calls
+    release the GIL while they wait on the driver, so waiting on one device no longer holds up the others and the
+    time an iteration takes stays close to that of the slowest device instead of the sum over all of them.
+    Packing and unpacking still need the GIL, so they do not run in parallel.
+    """
+
+    def __init__(self, devices):
+        """
+        :param devices: mapping of namespaces to VeriStandFPGA objects. Iteration order is kept.
+        """
+        self.devices = OrderedDict(devices)
+        if not self.devices:
+            raise ValueError('An FPGAGroup needs at least one device')
+        for namespace in self.devices:
+            if SEPARATOR in namespace:
+                raise ValueError('Device namespace {!r} cannot contain {!r}'.format(namespace, SEPARATOR))
+        self._executor = ThreadPoolExecutor(max_workers=len(self.devices), thread_name_prefix='FPGAGroup')
+        self.channel_value_table = GroupChannelTable(self)
+
+    @classmethod
+    def from_configs(cls, filepaths):
+        """
+        :param filepaths: mapping of namespaces to .fpgaconfig file paths
+        :return: an FPGAGroup of a new VeriStandFPGA per configuration
+        """
+        return cls((namespace, VeriStandFPGA(filepath)) for namespace, filepath in filepaths.items())
+
+    def _map(self, function):
+        """
+        Call function with each device concurrently, and wait for all of them to finish.
+        If any call raises, the error of the first device in group order is raised once every call has finished.
+        :return: dictionary of the results with namespaces as keys
+        """
+        futures = [(namespace, self._executor.submit(function, fpga)) for namespace, fpga in self.devices.items()]
+        results = OrderedDict()
+        error = None
+        for namespace, future in futures:
+            try:
+                results[namespace] = future.result()
+            except BaseException as device_error:
+                if error is None:
+                    error = device_error
+        if error is not None:
+            raise error
+        return results
+
+    def init_fpga(self, resources, loop_rate, sessions=None, read_fifo_depth=None, write_fifo_depth=None):
+        """
+        Open a session to every device, download and run the bitfiles and set up the template registers.
+        The devices are initialised concurrently.
+        :param resources: mapping of namespaces to the device name of that FPGA as it appears in NI-MAX
+        :param loop_rate: FPGA loop rate in usec, shared by every device
+        :param sessions: mapping of namespaces to already created sessions, see VeriStandFPGA.init_fpga
+        :param read_fifo_depth: DMA_Read FIFO depth of every device in loop iterations, see VeriStandFPGA.init_fpga
+        :param write_fifo_depth: DMA_Write FIFO depth of every device in loop iterations
+        """
+        sessions = sessions or {}
+        namespaces = dict((fpga, namespace) for namespace, fpga in self.devices.items())
+
+        def init_device(fpga):
+            namespace = namespaces[fpga]
+            fpga.init_fpga(resources.get(namespace), loop_rate, session=sessions.get(namespace),
+                           read_fifo_depth=read_fifo_depth, write_fifo_depth=write_fifo_depth)
+
+        self._map(init_device)
+
+    def start_fpga_main_loop(self):
+        """
+        Start the main loop of every device. The Start registers are written back to back from this thread once
+        every device is known to be initialised, so the devices start as close together as the host allows.
+        """
+        for namespace, fpga in self.devices.items():
+            if fpga.session is None:
+                raise ConfigError('Device {} is not initialized. Please first call FPGAGroup.init_fpga'.format(
+                    namespace))
+        for fpga in self.devices.values():
+            fpga.start_fpga_main_loop()
+
+    def stop_fpga(self):
+        self._map(lambda fpga: fpga.stop_fpga())
+
+    def vs_read_fifo(self, timeout):
+        """
+        Read one iteration from the DMA_Read FIFO of every device into its channel table, concurrently.
+        """
+        self._map(lambda fpga: fpga.vs_read_fifo(timeout))
+
+    def vs_write_fifo(self, timeout):
+        """
+        Write the channel table of every device to its DMA_Write FIFO, concurrently.
+        """
+        self._map(lambda fpga: fpga.vs_write_fifo(timeout))
+
+    def vs_read_write_fifo(self, timeout):
+        """
+        Read one iteration from and then write one iteration to every device, in a single pass over the thread
+        pool. Use this when the outputs written do not depend on the inputs of the same iteration.
+        """
+        def read_write(fpga):
+            fpga.vs_read_fifo(timeout)
+            fpga.vs_write_fifo(timeout)
+
+        self._map(read_write)
+
+    def _split(self, channel_name):
+        namespace, separator, name = channel_name.partition(SEPARATOR)
+        if not separator or namespace not in self.devices:
+            raise KeyError(channel_name)
+        return self.devices[namespace], name
+
+    def _resolve(self, channel_name):
+        """
+        :return: the device and device channel name of a namespaced channel name
+        :raises ConfigError: when the group has no such channel, as VeriStandFPGA.set_channels does
+        """
+        namespace, separator, name = channel_name.partition(SEPARATOR)
+        fpga = self.devices.get(namespace) if separator else None
+        if fpga is None or name not in fpga.channel_handles:
+            raise ConfigError(message='{} is not a channel of this FPGAGroup, expected "namespace{}channel '
+                                      'name"'.format(channel_name, SEPARATOR))
+        return fpga, name
+
+    def set_channel(self, channel_name, value):
+        """
+        :param channel_name: namespaced channel name, 'namespace/channel name'
+        """
+        fpga, name = self._resolve(channel_name)
+        fpga.set_channel(name, value)
+
+    def get_channel(self, channel_name):
+        """
+        :param channel_name: namespaced channel name, 'namespace/channel name'
+        """
+        fpga, name = self._resolve(channel_name)
+        return fpga.get_channel(name)
+
+    def set_channels(self, channels):
+        """
+        Set many channels at once, see VeriStandFPGA.set_channels. Every name is resolved before any channel of
+        any device is set.
+        :param channels: mapping of namespaced channel names to values
+        """
+        per_device = {}
+        for channel_name, value in channels.items():
+            fpga, name = self._resolve(channel_name)
+            per_device.setdefault(fpga, {})[name] = value
+        for fpga, device_channels in per_device.items():
+            fpga.set_channels(device_channels)
+
+    def close(self):
+        """
+        Shut down the thread pool. The FPGA sessions are left as they are.
+        """
+        self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_val, trace):
+        self.close()
+
+
+class GroupChannelTable(MutableMapping):
+    """
+    Merged view of the channel tables of the devices of an FPGAGroup, keyed by 'namespace/channel name'.
+    As a mapping it raises KeyError for unknown names, like VeriStandFPGA.channel_value_table, where the FPGAGroup
+    methods raise ConfigError.
+    """
+
+    def __init__(self, group):
+        self._devices = group.devices
+        self._split = group._split
+
+    def __getitem__(self, channel_name):
+        fpga, name = self._split(channel_name)
+        return fpga.channel_value_table[name]
+
+    def __setitem__(self, channel_name, value):
+        fpga, name = self._split(channel_name)
+        fpga.channel_value_table[name] = value
+
+    def __delitem__(self, channel_name):
+        raise TypeError('Channels cannot be removed from an FPGAGroup channel table')
+
+    def __iter__(self):
+        for namespace, fpga in self._devices.items():
+            for name in fpga.channel_handles:
+                yield namespace + SEPARATOR + name
+
+    def __len__(self):
+        return sum(len(fpga.channel_handles) for fpga in self._devices.values())
+
+    def __contains__(self, channel_name):
+        try:
+            fpga, name = self._split(channel_name)
+        except KeyError:
+            return False
+        return name in fpga.channel_handles
@@ -0,0 +1,234 @@
+import ctypes
+import os
+import sys
+import time
+import warnings
+from array import array
+
+from fpga_config import ConfigError
+
+
+def pin_current_thread(cpu):
+    """
+    Pin the calling thread to one CPU core.
+    :param cpu: index of the core
+    :return: the previous affinity, to hand to restore_thread_affinity
+    :raises OSError: when the thread cannot be pinned, including on platforms without CPU affinity
+    """
+    if sys.platform == 'win32':
+        kernel32 = ctypes.windll.kernel32
+        kernel32.SetThreadAffinityMask.restype = ctypes.c_size_t
+        kernel32.SetThreadAffinityMask.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+        previous = kernel32.SetThreadAffinityMask(kernel32.GetCurrentThread(), 1 << cpu)
+        if not previous:
+            raise ctypes.WinError()
+        return previous
+    if not hasattr(os, 'sched_setaffinity'):
+        raise OSError('CPU pinning is not supported on {}'.format(sys.platform))
+    previous = os.sched_getaffinity(0)
+    os.sched_setaffinity(0, {cpu})
+    return previous
+
+
+def restore_thread_affinity(previous):
+    """
+    Undo pin_current_thread.
+    :param previous: the affinity returned by pin_current_thread
+    """
+    if sys.platform == 'win32':
+        kernel32 = ctypes.windll.kernel32
+        kernel32.SetThreadAffinityMask(kernel32.GetCurrentThread(), previous)
+    else:
+        os.sched_setaffinity(0, previous)
+
+
+class LoopRunner(object):
+    """
+    Runs a read, compute, write loop on a VeriStandFPGA at a fixed rate.
+
+    Iterations are scheduled on a fixed grid of one slot per loop period on the host clock, starting when the first
+    frame is read so that the slots line up with the FPGA's loop. The runner sleeps until spin_threshold before its
+    slot and busy waits the rest of the way, which wakes it far more precisely than sleeping alone. It then reads
+    one iteration from the DMA_Read FIFO, calls the callback and writes the DMA_Write FIFO. An iteration that ends
+    after the next slot has begun is a deadline miss.
+    After falling behind, frames already waiting in the DMA_Read FIFO are processed straight away, without waiting
+    for their slots, until the runner has caught up with the FPGA. If frames were lost instead, so that nothing is
+    waiting, the slots that were missed are skipped and counted in skipped_periods.
+
+    For every iteration the wake-up jitter, the compute time of the callback, whether the deadline was missed and
+    the FPGA's 'Is Late?' flag are recorded, so that misses seen by the host can be compared with the lateness the
+    FPGA reports.
+    """
+
+    def __init__(self, fpga, callback, loop_rate=None, spin_threshold=0.002, cpu=None, timeout=None,
+                 history=100000):
+        """
+        :param fpga: the VeriStandFPGA to run, initialised with init_fpga
+        :param callback: called as callback(fpga, iteration) between the read and the write of every iteration.
+            Call LoopRunner.stop from it to end the loop after that iteration.
+        :param loop_rate: loop period in usec. Defaults to the 'Loop Rate (usec)' register of the FPGA.
+        :param spin_threshold: time in seconds before each deadline from which the runner busy waits instead of
+            sleeping. It should cover the sleep granularity of the OS, about 1-2 ms on Windows.
+        :param cpu: index of a CPU core to pin the loop thread to while it runs. Pinning only helps, so the loop
+            runs unpinned, with a warning, where the thread cannot be pinned.
+        :param timeout: timeout of the FIFO reads and writes in ms. Defaults to ten loop periods.
+        :param history: number of most recent iterations whose jitter and compute time are kept for stats
+        """
+        if fpga.read_fifo_object is None:
+            raise ConfigError('Session not initialized. Please first call the VeriStandFPGA.init_fpga method '
+                              'before creating a LoopRunner')
+        self.fpga = fpga
+        self.callback = callback
+        if loop_rate is None:
+            loop_rate = fpga.loop_timer.read()
+        self.period = loop_rate / 1e6
+        self.spin_threshold = spin_threshold
+        self.cpu = cpu
+        if timeout is None:
+            timeout = max(1, int(10 * loop_rate / 1000))
+        self.timeout = timeout
+        self.history = history
+        self.jitter = array('d', bytes(8 * history))
+        self.compute_time = array('d', bytes(8 * history))
+        self._late_handle = fpga.get_handle('Is Late?')
+        self._running = False
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.iterations = 0
+        self.deadline_misses = 0
+        self.skipped_periods = 0
+        self.max_fifo_backlog = 0
+        self.late_flags = 0
+        self.late_and_missed = 0
+        self.max_jitter = 0.0
+        self.max_compute_time = 0.0
+
+    def stop(self):
+        """
+        End the loop once the current iteration is done.
+        """
+        self._running = False
+
+    def run(self, iterations=None):
+        """
+        Run the loop in this thread until stop is called or iterations have run.
+        :param iterations: number of iterations to run, without limit by default
+        """
+        fpga = self.fpga
+        callback = self.callback
+        period = self.period
+        spin_threshold = self.spin_threshold
+        timeout = self.timeout
+        values = fpga.channel_values
+        late_handle = self._late_handle
+        jitter = self.jitter
+        compute_time = self.compute_time
+        history = self.history
+        perf_counter = time.perf_counter
+        sleep = time.sleep
+        previous_affinity = None
+        if self.cpu is not None:
+            try:
+                previous_affinity = pin_current_thread(self.cpu)
+            except OSError as error:
+                warnings.warn('Running the loop without pinning it to CPU {}: {}'.format(self.cpu, error),
+                              RuntimeWarning, stacklevel=2)
+        self._running = True
+        read_packets = fpga.read_packets
+        try:
+            start = perf_counter()
+            count = 0
+            slot_index = 0
+            backlog = 0
+            while self._running and (iterations is None or count < iterations):
+                scheduled = start + slot_index * period
+                now = perf_counter()
+                if backlog and now < scheduled:
+                    # The FPGA is ahead of the slots, it had frames waiting before this run started
+                    start -= scheduled - now
+                    scheduled = now
+                if not backlog:
+                    if now - scheduled > period:
+                        # Nothing left to catch up on, frames were lost. Move on to the slot under way.
+                        skipped = int((now - scheduled) / period)
+                        self.skipped_periods += skipped
+                        slot_index += skipped
+                        scheduled += skipped * period
+                    remaining = scheduled - now
+                    if remaining > spin_threshold:
+                        sleep(remaining - spin_threshold)
+                    now = perf_counter()
+                    while now < scheduled:
+                        now = perf_counter()
+                wake_jitter = now - scheduled
+
+                backlog = fpga.vs_read_fifo(timeout) // read_packets
+                if not count:
+                    # Line the slots up with the arrival of the FPGA's frames
+                    start = scheduled = perf_counter()
+                compute_start = perf_counter()
+                callback(fpga, count)
+                compute_end = perf_counter()
+                fpga.vs_write_fifo(timeout)
+                end = perf_counter()
+
+                slot = self.iterations % history
+                jitter[slot] = wake_jitter
+                compute_time[slot] = compute_end - compute_start
+                if wake_jitter > self.max_jitter:
+                    self.max_jitter = wake_jitter
+                if compute_end - compute_start > self.max_compute_time:
+                    self.max_compute_time = compute_end - compute_start
+                missed = end > scheduled + period
+                late = values[late_handle] != 0
+                if missed:
+                    self.deadline_misses += 1
+                if late:
+                    self.late_flags += 1
+                    if missed:
+                        self.late_and_missed += 1
+                if backlog > self.max_fifo_backlog:
+                    self.max_fifo_backlog = backlog
+                self.iterations += 1
+                count += 1
+                slot_index += 1
+        finally:
+            self._running = False
+            if previous_affinity is not None:
+                restore_thread_affinity(previous_affinity)
+
+    def stats(self):
+        """
+        :return: dictionary of the loop statistics. Times are in seconds, and the jitter and compute_time
+            summaries cover the last history iterations.
+            deadline_misses counts iterations the host finished after the next slot had begun, late_flags those
+            the FPGA flagged 'Is Late?', late_and_missed those flagged by both, missed_only and late_only those
+            flagged by one side alone. skipped_periods counts slots skipped after frames were lost, and
+            max_fifo_backlog is the most frames seen waiting in the DMA_Read FIFO after a read.
+        """
+        kept = min(self.iterations, self.history)
+        return {'period': self.period,
+                'iterations': self.iterations,
+                'deadline_misses': self.deadline_misses,
+                'late_flags': self.late_flags,
+                'late_and_missed': self.late_and_missed,
+                'missed_only': self.deadline_misses - self.late_and_missed,
+                'late_only': self.late_flags - self.late_and_missed,
+                'skipped_periods': self.skipped_periods,
+                'max_fifo_backlog': self.max_fifo_backlog,
+                'jitter': _summary(self.jitter[:kept], self.max_jitter),
+                'compute_time': _summary(self.compute_time[:kept], self.max_compute_time)}
+
+
+def _summary(samples, maximum):
+    """
+    :return: dictionary of the mean, median, 99th percentile and all-time maximum of samples
+    """
+    if not samples:
+        return {'mean': 0.0, 'p50': 0.0, 'p99': 0.0, 'max': maximum}
+    ordered = sorted(samples)
+    return {'mean': sum(ordered) / len(ordered),
+            'p50': ordered[(len(ordered) - 1) // 2],
+            'p99': ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))],
+            'max': maximum}
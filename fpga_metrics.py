@@ -0,0 +1,272 @@
+"""
+Opt-in timing of the VeriStand FPGA hot path. Enable it with VeriStandFPGA.enable_metrics.
+
+Each FIFO read and write is split into stages, timed in ns into fixed size histograms:
+
+    fifo_read    the DMA_Read FIFO read, including the wait for the frame
+    unpack       decoding the frame into the channel table, and recording it when a recording is running
+    user         from the end of a read to the start of the next write, the time spent in the caller's own logic
+    pack         encoding the changed write packets
+    fifo_write   the DMA_Write FIFO write, and recording the frame when a recording is running
+"""
+import time
+from array import array
+from collections import OrderedDict
+
+from fpga_stream import is_fifo_timeout
+
+try:
+    clock = time.perf_counter_ns
+except AttributeError:
+    def clock():
+        return int(time.perf_counter() * 1e9)
+
+STAGES = ('fifo_read', 'unpack', 'user', 'pack', 'fifo_write')
+
+
+class LatencyHistogram(object):
+    """
+    Histogram of durations in ns with log-linear buckets, in the manner of an HDR histogram.
+    Durations below 2 ** sub_bucket_bits ns are counted exactly. Above that each power of two is split into
+    2 ** (sub_bucket_bits - 1) buckets, so a percentile is never off by more than 1 part in 2 ** (sub_bucket_bits - 1)
+    of its value. The buckets are one preallocated array, so recording never allocates.
+    """
+
+    def __init__(self, highest_ns=60 * 10 ** 9, sub_bucket_bits=7):
+        """
+        :param highest_ns: largest duration told apart. Longer durations are counted in the last bucket, and max
+            still records them exactly.
+        :param sub_bucket_bits: log2 of the number of buckets below the first power of two, which sets the precision
+        """
+        self.sub_bucket_bits = sub_bucket_bits
+        self._sub_buckets = 1 << sub_bucket_bits
+        self._half = self._sub_buckets >> 1
+        self._last = self._index(highest_ns)
+        self.counts = array('Q', bytes(8 * (self._last + 1)))
+        self.reset()
+
+    def reset(self):
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        self.count = 0
+        self.total = 0
+        self.min = 0
+        self.max = 0
+
+    def _index(self, value):
+        if value < self._sub_buckets:
+            return value
+        shift = value.bit_length() - self.sub_bucket_bits
+        return self._sub_buckets + (shift - 1) * self._half + (value >> shift) - self._half
+
+    def _bucket_top(self, index):
+        """
+        :return: the largest duration counted in bucket index
+        """
+        if index < self._sub_buckets:
+            return index
+        shift, offset = divmod(index - self._sub_buckets, self._half)
+        shift += 1
+        return ((offset + self._half + 1) << shift) - 1
+
+    def record(self, value):
+        """
+        :param value: duration in ns
+        """
+        # _index inlined, as this runs several times per loop iteration
+        if value < self._sub_buckets:
+            if value < 0:
+                value = 0
+            index = value
+        else:
+            shift = value.bit_length() - self.sub_bucket_bits
+            index = self._sub_buckets + (shift - 1) * self._half + (value >> shift) - self._half
+            if index > self._last:
+                index = self._last
+        self.counts[index] += 1
+        if value > self.max:
+            self.max = value
+        if value < self.min or not self.count:
+            self.min = value
+        self.count += 1
+        self.total += value
+
+    def percentile(self, percent):
+        """
+        :param percent: percentile between 0 and 100
+        :return: a duration in ns at or above the given percentile of the recorded durations, 0 if there are none
+        """
+        if not self.count:
+            return 0
+        rank = max(1, int(-(-self.count * percent // 100)))
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return min(self._bucket_top(index), self.max)
+        return self.max
+
+    def summary(self):
+        """
+        :return: dictionary of the count, mean, min, p50, p99, p99.9 and max of the recorded durations, in ns
+        """
+        return OrderedDict((('count', self.count),
+                            ('mean', self.total / self.count if self.count else 0.0),
+                            ('min', self.min),
+                            ('p50', self.percentile(50)),
+                            ('p99', self.percentile(99)),
+                            ('p99.9', self.percentile(99.9)),
+                            ('max', self.max)))
+
+
+class Instrumentation(object):
+    """
+    Stage histograms and counters of one VeriStandFPGA, fed by its read and write paths while it is enabled.
+    Recording the five stages of an iteration costs a few us, so the stages may be sampled: with sample_every set
+    to N only one read and one write in N are recorded in the histograms, while the frame, timeout, error and late
+    counters still count every iteration.
+    """
+
+    clock = staticmethod(clock)
+
+    def __init__(self, highest_ns=60 * 10 ** 9, sub_bucket_bits=7, sample_every=1):
+        """
+        :param highest_ns: largest duration the histograms tell apart, in ns
+        :param sub_bucket_bits: precision of the histograms, see LatencyHistogram
+        :param sample_every: record the stages of one read and one write in sample_every
+        """
+        if sample_every < 1:
+            raise ValueError('sample_every must be 1 or more')
+        self.sample_every = sample_every
+        self.histograms = OrderedDict((stage, LatencyHistogram(highest_ns, sub_bucket_bits)) for stage in STAGES)
+        self._fifo_read = self.histograms['fifo_read']
+        self._unpack = self.histograms['unpack']
+        self._user = self.histograms['user']
+        self._pack = self.histograms['pack']
+        self._fifo_write = self.histograms['fifo_write']
+        self.reset()
+
+    def reset(self):
+        for histogram in self.histograms.values():
+            histogram.reset()
+        self.frames_read = 0
+        self.frames_written = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.late_iterations = 0
+        self.fifo_backlog = 0
+        self.max_fifo_backlog = 0
+        self._read_end = None
+        self._reads_to_skip = 0
+        self._writes_to_skip = 0
+
+    def read_done(self, started, transferred, finished, late):
+        """
+        Account for one frame read.
+        :param started: clock() before the FIFO read
+        :param transferred: clock() after the FIFO read
+        :param finished: clock() after unpacking
+        :param late: the 'Is Late?' flag of the frame
+        """
+        self.frames_read += 1
+        if late:
+            self.late_iterations += 1
+        if self._reads_to_skip:
+            self._reads_to_skip -= 1
+            self._read_end = None
+            return
+        self._reads_to_skip = self.sample_every - 1
+        self._fifo_read.record(transferred - started)
+        self._unpack.record(finished - transferred)
+        self._read_end = finished
+
+    def write_done(self, started, packed, finished):
+        """
+        Account for one frame written.
+        :param started: clock() before packing
+        :param packed: clock() after packing
+        :param finished: clock() after the FIFO write
+        """
+        self.frames_written += 1
+        if self._writes_to_skip:
+            self._writes_to_skip -= 1
+            return
+        self._writes_to_skip = self.sample_every - 1
+        # In a loop alternating reads and writes, the write sampled follows the read sampled
+        if self._read_end is not None:
+            self._user.record(started - self._read_end)
+            self._read_end = None
+        self._pack.record(packed - started)
+        self._fifo_write.record(finished - packed)
+
+    def backlog(self, frames):
+        """
+        Account for the frames left waiting in the DMA_Read FIFO after a read.
+        """
+        self.fifo_backlog = frames
+        if frames > self.max_fifo_backlog:
+            self.max_fifo_backlog = frames
+
+    def fifo_error(self, error):
+        """
+        Count an error raised by a FIFO read or write, telling timeouts apart.
+        """
+        if is_fifo_timeout(error):
+            self.timeouts += 1
+        else:
+            self.errors += 1
+
+    def as_dict(self):
+        """
+        :return: dictionary of the counters, and of a summary per stage under 'stages' with durations in ns
+        """
+        return OrderedDict((('frames_read', self.frames_read),
+                            ('frames_written', self.frames_written),
+                            ('timeouts', self.timeouts),
+                            ('errors', self.errors),
+                            ('late_iterations', self.late_iterations),
+                            ('fifo_backlog', self.fifo_backlog),
+                            ('max_fifo_backlog', self.max_fifo_backlog),
+                            ('stages', OrderedDict((stage, histogram.summary())
+                                                   for stage, histogram in self.histograms.items()))))
+
+    def prometheus(self, prefix='veristand_fpga', labels=None):
+        """
+        :param prefix: prefix of the metric names
+        :param labels: dictionary of extra labels to put on every sample, such as the device name
+        :return: the metrics in the Prometheus text exposition format, durations in seconds
+        """
+        extra = ''.join('{}="{}",'.format(key, _escape_label(value)) for key, value in sorted((labels or {}).items()))
+        lines = []
+        for name, value, description in (
+                ('frames_read', self.frames_read, 'Frames read from the DMA_Read FIFO'),
+                ('frames_written', self.frames_written, 'Frames written to the DMA_Write FIFO'),
+                ('fifo_timeouts', self.timeouts, 'FIFO reads and writes that timed out'),
+                ('fifo_errors', self.errors, 'FIFO reads and writes that failed other than by timing out'),
+                ('late_iterations', self.late_iterations, "Frames read with the FPGA's Is Late? flag set")):
+            metric = '{}_{}_total'.format(prefix, name)
+            lines.append('# HELP {} {}'.format(metric, description))
+            lines.append('# TYPE {} counter'.format(metric))
+            lines.append('{}{} {}'.format(metric, '{' + extra.rstrip(',') + '}' if extra else '', value))
+        for name, value, description in (
+                ('fifo_backlog_frames', self.fifo_backlog, 'Frames left in the DMA_Read FIFO after the last read'),
+                ('max_fifo_backlog_frames', self.max_fifo_backlog,
+                 'Most frames left in the DMA_Read FIFO after a read')):
+            metric = '{}_{}'.format(prefix, name)
+            lines.append('# HELP {} {}'.format(metric, description))
+            lines.append('# TYPE {} gauge'.format(metric))
+            lines.append('{}{} {}'.format(metric, '{' + extra.rstrip(',') + '}' if extra else '', value))
+        metric = '{}_stage_duration_seconds'.format(prefix)
+        lines.append('# HELP {} Time spent in each stage of a FIFO read or write'.format(metric))
+        lines.append('# TYPE {} summary'.format(metric))
+        for stage, histogram in self.histograms.items():
+            for quantile, percent in (('0.5', 50), ('0.99', 99), ('0.999', 99.9), ('1', 100)):
+                lines.append('{}{{{}stage="{}",quantile="{}"}} {!r}'.format(
+                    metric, extra, stage, quantile, histogram.percentile(percent) / 1e9))
+            lines.append('{}_sum{{{}stage="{}"}} {!r}'.format(metric, extra, stage, histogram.total / 1e9))
+            lines.append('{}_count{{{}stage="{}"}} {}'.format(metric, extra, stage, histogram.count))
+        return '\n'.join(lines) + '\n'
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
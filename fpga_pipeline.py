@@ -0,0 +1,468 @@
+"""
+Streaming signal processing of decoded VeriStand FPGA read channels.
+
+A Pipeline is a chain of stages fed batches of decoded read data, as returned by VeriStandFPGA.read_fifo_batch,
+VeriStandFPGA.decode_read_frames or FrameRecording.decode: a dictionary of equally long 1-D numpy arrays, one per
+channel, oldest sample first. Each stage turns a batch into a new batch for the next stage, and keeps whatever state
+it needs to carry on seamlessly with the next batch, so that feeding a run in batches of any size gives the same
+output as feeding it whole. Only that state and the output of the last stage are kept, so memory stays bounded over
+long runs.
+
+Built-in stages, all vectorized with numpy:
+
+    Decimate      keep one sample in every factor
+    BlockReduce   min, max and mean of each block of samples
+    IIRFilter     IIR filter, such as a low pass, with its state kept across batches
+    Trigger       windows of samples around edge or level triggers, with pre and post trigger samples
+
+A stage is any object with process(batch) returning a batch, and reset() and flush() methods. flush returns the
+output still held back at the end of a run, such as a partial block.
+"""
+import math
+
+from fpga_config import _require_numpy
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class Pipeline(object):
+    """
+    Chain of stages processing batches of decoded read data.
+    """
+
+    def __init__(self, stages, keep=None):
+        """
+        :param stages: stages in processing order
+        :param keep: largest number of output samples kept in the pipeline for result, dropping the oldest. None
+            keeps every output sample, 0 keeps none, so that only the return values of feed are seen.
+        """
+        _require_numpy()
+        self.stages = list(stages)
+        self.keep = keep
+        self._kept = []
+        self._kept_samples = 0
+
+    def feed(self, batch):
+        """
+        Process one batch through every stage.
+        :param batch: dictionary of 1-D arrays of the same length, with channel names as keys
+        :return: the batch output by the last stage
+        """
+        batch = dict((key, np.asarray(column)) for key, column in batch.items())
+        _batch_length(batch)
+        for stage in self.stages:
+            batch = stage.process(batch)
+        self._keep(batch)
+        return batch
+
+    def feed_frames(self, fpga, frames):
+        """
+        Decode raw DMA_Read frames, such as those read from a stream cursor, and process them.
+        :param fpga: VeriStandFPGA the frames were read from
+        :param frames: U64s of a whole number of frames back to back, or frames shaped (iterations, read_packets)
+        :return: the batch output by the last stage
+        """
+        frames = np.asarray(frames, dtype=np.uint64).reshape(-1, fpga.read_packets)
+        return self.feed(fpga.decode_read_frames(frames))
+
+    def flush(self):
+        """
+        End a run: take the output each stage still holds back through the stages after it.
+        :return: the batch output by the last stage
+        """
+        batch = {}
+        for stage in self.stages:
+            if _batch_length(batch):
+                batch = _concatenate([stage.process(batch), stage.flush()])
+            else:
+                batch = stage.flush()
+        self._keep(batch)
+        return batch
+
+    def reset(self):
+        """
+        Clear the state of every stage and the kept output, to start a new run.
+        """
+        for stage in self.stages:
+            stage.reset()
+        self._kept = []
+        self._kept_samples = 0
+
+    def result(self):
+        """
+        :return: the output kept so far as one batch
+        """
+        return _concatenate(self._kept)
+
+    def _keep(self, batch):
+        samples = _batch_length(batch)
+        if self.keep == 0 or not samples:
+            return
+        self._kept.append(batch)
+        self._kept_samples += samples
+        if self.keep is not None:
+            while self._kept_samples > self.keep:
+                excess = self._kept_samples - self.keep
+                oldest = self._kept[0]
+                oldest_samples = _batch_length(oldest)
+                if oldest_samples <= excess:
+                    self._kept.pop(0)
+                    self._kept_samples -= oldest_samples
+                else:
+                    self._kept[0] = dict((key, column[excess:]) for key, column in oldest.items())
+                    self._kept_samples -= excess
+
+
+class Decimate(object):
+    """
+    Keeps one sample in every factor, counting across batches. There is no anti-aliasing, put an IIRFilter low pass
+    before it where the signal needs one.
+    """
+
+    def __init__(self, factor):
+        if factor < 1:
+            raise ValueError('The decimation factor must be at least 1')
+        self.factor = factor
+        self.reset()
+
+    def reset(self):
+        self._position = 0
+
+    def process(self, batch):
+        start = -self._position % self.factor
+        self._position += _batch_length(batch)
+        return dict((key, column[start::self.factor]) for key, column in batch.items())
+
+    def flush(self):
+        return {}
+
+
+class BlockReduce(object):
+    """
+    Reduces each block of samples to statistics of its channels. The reduced channels come out as
+    '<channel>_<statistic>', the other columns, such as 'time' and 'iteration', as their first sample in the block.
+    A partial block is carried over to the next batch, and only output by flush.
+    """
+
+    STATISTICS = ('min', 'max', 'mean')
+
+    def __init__(self, block, channels=None, statistics=STATISTICS):
+        """
+        :param block: number of samples per block
+        :param channels: channels to reduce. Defaults to every column but 'time' and 'iteration'.
+        :param statistics: statistics to output, among 'min', 'max' and 'mean'
+        """
+        if block < 1:
+            raise ValueError('The block size must be at least 1')
+        for statistic in statistics:
+            if statistic not in self.STATISTICS:
+                raise ValueError('Unknown statistic {!r}, expected one of {}'.format(statistic, self.STATISTICS))
+        self.block = block
+        self.channels = channels
+        self.statistics = tuple(statistics)
+        self.reset()
+
+    def reset(self):
+        self._partial = {}
+
+    def process(self, batch):
+        if self._partial:
+            batch = _concatenate([self._partial, batch])
+        length = _batch_length(batch)
+        whole = length - length % self.block
+        self._partial = dict((key, column[whole:].copy()) for key, column in batch.items())
+        return self._reduce(batch, whole)
+
+    def flush(self):
+        length = _batch_length(self._partial)
+        partial = self._partial
+        self._partial = {}
+        if not length:
+            return {}
+        return self._reduce(partial, length, block=length)
+
+    def _reduce(self, batch, length, block=None):
+        block = block or self.block
+        channels = self.channels
+        if channels is None:
+            channels = [key for key in batch if key not in ('time', 'iteration')]
+        channels = set(channels)
+        reduced = {}
+        for key, column in batch.items():
+            blocks = column[:length].reshape(-1, block)
+            if key not in channels:
+                reduced[key] = blocks[:, 0]
+                continue
+            for statistic in self.statistics:
+                if statistic == 'min':
+                    reduced[key + '_min'] = blocks.min(axis=1)
+                elif statistic == 'max':
+                    reduced[key + '_max'] = blocks.max(axis=1)
+                else:
+                    reduced[key + '_mean'] = blocks.mean(axis=1)
+        return reduced
+
+
+class IIRFilter(object):
+    """
+    Filters channels through the IIR filter with coefficients b and a, the same difference equation as
+    scipy.signal.lfilter, keeping the filter state of each channel across batches. Other columns pass through.
+
+    Samples are filtered a block at a time from the state space form of the filter: the outputs of a block are one
+    matrix product of the block's inputs with the impulse response of the filter, plus the response to the state
+    left by the block before, so all the channels of a block are filtered at once without a Python loop per sample.
+    """
+
+    def __init__(self, b, a, channels, settle=False, block=64):
+        """
+        :param b: numerator coefficients
+        :param a: denominator coefficients, a[0] not 0
+        :param channels: channels to filter
+        :param settle: start each channel from the steady state of its first sample, rather than from zero, to
+            avoid the filter's step response at the start of a run
+        :param block: number of samples filtered per matrix product
+        """
+        _require_numpy()
+        b = np.atleast_1d(np.asarray(b, dtype=np.float64))
+        a = np.atleast_1d(np.asarray(a, dtype=np.float64))
+        if not a[0]:
+            raise ValueError('a[0] of an IIR filter cannot be 0')
+        order = max(len(a), len(b)) - 1
+        b = np.concatenate([b, np.zeros(order + 1 - len(b))]) / a[0]
+        a = np.concatenate([a, np.zeros(order + 1 - len(a))]) / a[0]
+        self.b = b
+        self.a = a
+        self.channels = list(channels)
+        self.settle = settle
+        self.block = block
+        # Transposed direct form II: state s, input x, output y
+        # y[n] = C s[n] + D x[n], s[n + 1] = A s[n] + B x[n]
+        transition = np.zeros((order, order))
+        if order:
+            transition[:, 0] = -a[1:]
+            transition[:-1, 1:] = np.eye(order - 1)
+        self._transition = transition
+        self._input = b[1:] - a[1:] * b[0]
+        self._feedthrough = b[0]
+        # powers[k] is A ** k, for k from 0 to block
+        powers = [np.eye(order)]
+        for _ in range(block):
+            powers.append(transition.dot(powers[-1]))
+        self._powers = np.array(powers)
+        impulse = np.empty(block)
+        impulse[0] = b[0]
+        for k in range(1, block):
+            impulse[k] = powers[k - 1][0].dot(self._input) if order else 0.0
+        rows = np.arange(block)
+        lags = rows[:, None] - rows[None, :]
+        # Output of a block as a matrix product with its inputs, and with the state it starts from
+        self._impulse_matrix = np.where(lags >= 0, impulse[np.clip(lags, 0, None)], 0.0)
+        self._state_output = self._powers[:block, 0, :] if order else np.zeros((block, 0))
+        # State left by a block of inputs: column k of A ** (block - 1 - k) B
+        self._state_input = np.stack([powers[block - 1 - k].dot(self._input) for k in range(block)], axis=1) \
+            if order else np.zeros((0, block))
+        self.reset()
+
+    @classmethod
+    def low_pass(cls, cutoff, sample_rate, channels, **kwargs):
+        """
+        Second order Butterworth low pass filter.
+        :param cutoff: cutoff frequency in Hz
+        :param sample_rate: sample rate of the channels in Hz, the loop rate of the FPGA
+        :param channels: channels to filter
+        :param kwargs: further arguments of IIRFilter
+        """
+        omega = 2 * math.pi * cutoff / sample_rate
+        alpha = math.sin(omega) / math.sqrt(2)
+        cosine = math.cos(omega)
+        b = [(1 - cosine) / 2, 1 - cosine, (1 - cosine) / 2]
+        a = [1 + alpha, -2 * cosine, 1 - alpha]
+        return cls(b, a, channels, **kwargs)
+
+    def reset(self):
+        self._state = None
+
+    def process(self, batch):
+        length = _batch_length(batch)
+        if not length:
+            return batch
+        inputs = np.stack([np.asarray(batch[channel], dtype=np.float64) for channel in self.channels], axis=1)
+        if self._state is None:
+            self._state = np.zeros((len(self._input), len(self.channels)))
+            if self.settle and len(self._input):
+                # State the filter is in after a constant input equal to the first sample for ever
+                identity = np.eye(len(self._input))
+                self._state = np.linalg.solve(identity - self._transition, np.outer(self._input, inputs[0]))
+        outputs = np.empty_like(inputs)
+        state = self._state
+        block = self.block
+        for start in range(0, length, block):
+            chunk = inputs[start:start + block]
+            size = len(chunk)
+            outputs[start:start + size] = (self._impulse_matrix[:size, :size].dot(chunk) +
+                                           self._state_output[:size].dot(state))
+            state = self._powers[size].dot(state) + self._state_input[:, block - size:].dot(chunk)
+        self._state = state
+        filtered = dict(batch)
+        for i, channel in enumerate(self.channels):
+            filtered[channel] = outputs[:, i]
+        return filtered
+
+    def flush(self):
+        return {}
+
+
+class Trigger(object):
+    """
+    Captures windows of samples around the points where a channel crosses or passes a level.
+
+    mode is one of 'rising' and 'falling', for the sample at which the channel crosses the level upwards or
+    downwards, 'either' for both, and 'above' and 'below' for the first sample at which the channel is at or above,
+    or at or below, the level. A window holds the pre samples before the trigger and the post samples from it on,
+    and the trigger rearms at the end of the window, so windows never overlap. Windows that run past the end of a
+    batch are completed from the next ones.
+
+    The output holds every column of the completed windows back to back, with 'capture' numbering the windows from
+    0 and 'offset' giving the position of each sample from its trigger, from -pre to post - 1.
+    """
+
+    MODES = ('rising', 'falling', 'either', 'above', 'below')
+
+    def __init__(self, channel, level, mode='rising', pre=0, post=100):
+        if mode not in self.MODES:
+            raise ValueError('Unknown trigger mode {!r}, expected one of {}'.format(mode, self.MODES))
+        if pre < 0 or post < 1:
+            raise ValueError('A trigger needs pre >= 0 and post >= 1 samples')
+        self.channel = channel
+        self.level = level
+        self.mode = mode
+        self.pre = pre
+        self.post = post
+        self.reset()
+
+    def reset(self):
+        self.captures = 0
+        self._position = 0
+        self._armed_at = 0
+        self._history = {}
+        self._pending = None
+        self._last = None
+
+    def _candidates(self, values):
+        """
+        :return: indexes into values of the samples that would trigger if armed
+        """
+        level = self.level
+        if self.mode == 'above':
+            return np.flatnonzero(values >= level)
+        if self.mode == 'below':
+            return np.flatnonzero(values <= level)
+        previous = np.empty_like(values)
+        previous[1:] = values[:-1]
+        crossings = np.zeros(len(values), dtype=bool)
+        if self._last is not None and len(values):
+            previous[0] = self._last
+            first = slice(None)
+        else:
+            first = slice(1, None)
+        if self.mode in ('rising', 'either'):
+            crossings[first] |= (previous[first] < level) & (values[first] >= level)
+        if self.mode in ('falling', 'either'):
+            crossings[first] |= (previous[first] > level) & (values[first] <= level)
+        return np.flatnonzero(crossings)
+
+    def process(self, batch):
+        length = _batch_length(batch)
+        windows = []
+        if self._pending is not None:
+            parts, first_offset, missing = self._pending
+            taken = min(missing, length)
+            parts.append(dict((key, column[:taken]) for key, column in batch.items()))
+            if taken < missing:
+                self._pending = (parts, first_offset, missing - taken)
+            else:
+                self._pending = None
+                windows.append((_concatenate(parts), first_offset))
+        values = np.asarray(batch[self.channel]) if length else np.empty(0)
+        candidates = self._candidates(values)
+        if length:
+            self._last = values[-1]
+        # Samples before this batch are kept in _history, so that windows can start before it
+        combined = _concatenate([self._history, batch]) if self._history else batch
+        combined_start = self._position - _batch_length(self._history)
+        end = self._position + length
+        index = int(np.searchsorted(candidates, self._armed_at - self._position))
+        while index < len(candidates):
+            trigger = self._position + int(candidates[index])
+            first = max(trigger - self.pre, combined_start)
+            last = trigger + self.post
+            window = dict((key, column[first - combined_start:min(last, end) - combined_start])
+                          for key, column in combined.items())
+            if last > end:
+                self._pending = ([window], first - trigger, last - end)
+            else:
+                windows.append((window, first - trigger))
+            self._armed_at = last
+            index = int(np.searchsorted(candidates, last - self._position))
+        self._position = end
+        if self.pre:
+            self._history = dict((key, column[-self.pre:].copy()) for key, column in combined.items())
+        return self._number(windows, batch)
+
+    def _number(self, windows, batch):
+        """
+        :param windows: the completed windows, as (columns, offset of the first sample) pairs
+        :return: the completed windows as one batch, with their capture numbers and sample offsets
+        """
+        if not windows:
+            empty = dict((key, column[:0]) for key, column in batch.items())
+            empty['capture'] = np.empty(0, dtype=np.int64)
+            empty['offset'] = np.empty(0, dtype=np.int64)
+            return empty
+        numbered = []
+        for window, first_offset in windows:
+            samples = _batch_length(window)
+            window = dict(window)
+            window['capture'] = np.full(samples, self.captures, dtype=np.int64)
+            window['offset'] = np.arange(first_offset, first_offset + samples)
+            numbered.append(window)
+            self.captures += 1
+        return _concatenate(numbered)
+
+    def flush(self):
+        """
+        A window still waiting for post trigger samples at the end of a run is dropped.
+        """
+        self._pending = None
+        return {}
+
+
+def _batch_length(batch):
+    """
+    :return: the number of samples in a batch, checking that every column has the same length
+    """
+    length = None
+    for key, column in batch.items():
+        if np.ndim(column) != 1:
+            raise ValueError('Column {} of a batch is not 1-D'.format(key))
+        if length is None:
+            length = len(column)
+        elif len(column) != length:
+            raise ValueError('The columns of a batch must all have the same length, {} has {} samples instead of '
+                             '{}'.format(key, len(column), length))
+    return length or 0
+
+
+def _concatenate(batches):
+    """
+    :return: batches joined one after the other. Batches without samples are skipped.
+    """
+    batches = [batch for batch in batches if _batch_length(batch)]
+    if not batches:
+        return {}
+    if len(batches) == 1:
+        return batches[0]
+    return dict((key, np.concatenate([batch[key] for batch in batches])) for key in batches[0])
@@ -0,0 +1,281 @@
+"""
+Raw frame recordings of VeriStand FPGA sessions.
+
+A recording file starts with a fixed 32 byte prefix:
+
+    magic        8 bytes   b'VSFPGARC'
+    version      uint32
+    header size  uint32    length of the JSON header in bytes
+    record size  uint64    number of U64 words per record
+    records      uint64    number of records written so far
+
+followed by the JSON header holding the packet layout of the configuration, padded to a multiple of 8 bytes, and
+then by fixed size records of little endian U64 words:
+
+    timestamp    monotonic clock of the host in ns when the frame was read or written
+    iteration    index of the frame in its direction, counting from 0
+    direction    0 for DMA_Read frames, 1 for DMA_Write frames
+    frame        the packets of the frame, zero padded to the larger of the two FIFOs
+
+Reading a recording only needs numpy, not nifpga.
+"""
+import json
+import mmap
+import struct
+import threading
+import time
+from array import array
+
+from fpga_config import packet_from_definition, _require_numpy
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MAGIC = b'VSFPGARC'
+VERSION = 1
+READ = 0
+WRITE = 1
+_PREFIX = struct.Struct('<8sIIQQ')
+_RECORD_COUNT_WORD = 3
+_HEADER_WORDS = 3
+
+try:
+    _monotonic_ns = time.monotonic_ns
+except AttributeError:
+    def _monotonic_ns():
+        return int(time.monotonic() * 1e9)
+
+
+class FrameRecorder(object):
+    """
+    Appends raw DMA_Read and DMA_Write frames to a memory-mapped recording file.
+    The file is grown by doubling when it fills up, and truncated to the records written on close.
+    Appends are serialised by a lock, so frames may be recorded from the streaming reader thread and the control
+    loop at the same time, and timestamps increase monotonically through the file.
+    """
+
+    def __init__(self, filepath, layout, initial_records=4096):
+        """
+        :param filepath: path of the recording file. An existing file is overwritten.
+        :param layout: packet layout of the configuration, as returned by VeriStandFPGA.layout
+        :param initial_records: number of records to make room for up front
+        """
+        self.filepath = filepath
+        self.layout = layout
+        self.read_packets = layout['read_packets']
+        self.write_packets = layout['write_packets']
+        self.record_words = _HEADER_WORDS + max(self.read_packets, self.write_packets, 1)
+        header = json.dumps(layout).encode('utf-8')
+        header += b' ' * (-len(header) % 8)
+        self._data_offset = _PREFIX.size + len(header)
+        self._file = open(filepath, 'w+b')
+        self._file.write(_PREFIX.pack(MAGIC, VERSION, len(header), self.record_words, 0))
+        self._file.write(header)
+        self.capacity = 0
+        self.record_count = 0
+        self.read_iterations = 0
+        self.write_iterations = 0
+        self._mmap = None
+        self._words = None
+        self._lock = threading.Lock()
+        self._resize(max(initial_records, 1))
+
+    def _resize(self, capacity):
+        if self._words is not None:
+            self._words.release()
+            self._mmap.close()
+        self._file.truncate(self._data_offset + capacity * self.record_words * 8)
+        self._mmap = mmap.mmap(self._file.fileno(), 0)
+        self._words = memoryview(self._mmap).cast('Q')
+        self.capacity = capacity
+
+    def record_read(self, data):
+        """
+        Record one or more DMA_Read frames.
+        :param data: U64s of a whole number of frames, back to back
+        """
+        self._append(READ, data, self.read_packets)
+
+    def record_write(self, data):
+        """
+        Record one or more DMA_Write frames.
+        :param data: U64s of a whole number of frames, back to back
+        """
+        self._append(WRITE, data, self.write_packets)
+
+    def _append(self, direction, data, frame_length):
+        if isinstance(data, list):
+            data = array('Q', data)
+        else:
+            data = memoryview(data).cast('B').cast('Q')
+        frames = len(data) // frame_length if frame_length else 0
+        with self._lock:
+            if self._words is None:
+                raise ValueError('Recording {} is closed'.format(self.filepath))
+            if self.record_count + frames > self.capacity:
+                self._resize(max(self.capacity * 2, self.record_count + frames))
+            words = self._words
+            timestamp = _monotonic_ns()
+            base = self._data_offset // 8 + self.record_count * self.record_words
+            for frame in range(frames):
+                if direction == READ:
+                    iteration = self.read_iterations
+                    self.read_iterations += 1
+                else:
+                    iteration = self.write_iterations
+                    self.write_iterations += 1
+                words[base] = timestamp
+                words[base + 1] = iteration
+                words[base + 2] = direction
+                words[base + _HEADER_WORDS:base + _HEADER_WORDS + frame_length] = \
+                    data[frame * frame_length:(frame + 1) * frame_length]
+                base += self.record_words
+            self.record_count += frames
+            words[_RECORD_COUNT_WORD] = self.record_count
+
+    def close(self):
+        """
+        Flush the recording and trim the file to the records written.
+        """
+        with self._lock:
+            if self._words is None:
+                return
+            self._words.release()
+            self._words = None
+            self._mmap.flush()
+            self._mmap.close()
+            self._file.truncate(self._data_offset + self.record_count * self.record_words * 8)
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_val, trace):
+        self.close()
+
+
+class FrameRecording(object):
+    """
+    Read-only view of a recording file written by FrameRecorder.
+    The file is memory-mapped, and only the channels and time range asked for are decoded, with the packet codecs
+    rebuilt from the layout stored in the file.
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self._file = open(filepath, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, header_size, self.record_words, self.record_count = _PREFIX.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError('{} is not a VeriStand FPGA frame recording'.format(filepath))
+        if version != VERSION:
+            raise ValueError('{} is a version {} recording, only version {} is supported'.format(
+                filepath, version, VERSION))
+        self._data_offset = _PREFIX.size + header_size
+        self.layout = json.loads(self._mmap[_PREFIX.size:self._data_offset].decode('utf-8'))
+        self.bitfile = self.layout['bitfile']
+        self.read_packet_list = [packet_from_definition('read', index + 1, definition)
+                                 for index, definition in enumerate(self.layout['read'])]
+        self.write_packet_list = [packet_from_definition('write', index + 1, definition)
+                                  for index, definition in enumerate(self.layout['write'])]
+        self.channel_locations = {}
+        for direction, packet_list in ((WRITE, self.write_packet_list), (READ, self.read_packet_list)):
+            for index, this_packet in enumerate(packet_list):
+                for name in this_packet._names:
+                    self.channel_locations[name] = (direction, index)
+        self._records = None
+
+    def __len__(self):
+        return self.record_count
+
+    def records(self):
+        """
+        :return: every record as a (records, record size) numpy uint64 array mapped onto the file, without copying
+        """
+        if self._records is None:
+            _require_numpy()
+            self._records = np.frombuffer(self._mmap, dtype='<u8', count=self.record_count * self.record_words,
+                                          offset=self._data_offset).reshape(self.record_count, self.record_words)
+        return self._records
+
+    def frames(self, direction, start=None, stop=None):
+        """
+        Raw frames of one direction within a time range.
+        :param direction: 'read' or 'write'
+        :param start: start of the time range in seconds since the first record, inclusive
+        :param stop: end of the time range in seconds since the first record, exclusive
+        :return: (timestamps in ns, iterations, frames shaped (frames, packets)) as numpy arrays
+        """
+        code = READ if direction.lower() == 'read' else WRITE
+        packets = self.read_packets if code == READ else self.write_packets
+        block = self._time_slice(start, stop)
+        block = block[block[:, 2] == code]
+        return block[:, 0], block[:, 1], block[:, _HEADER_WORDS:_HEADER_WORDS + packets]
+
+    @property
+    def read_packets(self):
+        return self.layout['read_packets']
+
+    @property
+    def write_packets(self):
+        return self.layout['write_packets']
+
+    def _time_slice(self, start, stop):
+        records = self.records()
+        if not len(records):
+            return records
+        timestamps = records[:, 0]
+        first = int(timestamps[0])
+        low = 0
+        high = len(records)
+        if start is not None:
+            low = int(np.searchsorted(timestamps, np.uint64(first + int(start * 1e9)), side='left'))
+        if stop is not None:
+            high = int(np.searchsorted(timestamps, np.uint64(first + int(stop * 1e9)), side='left'))
+        return records[low:high]
+
+    def decode(self, channels, start=None, stop=None):
+        """
+        Decode some channels over a time range. All channels must be in the same direction. Write channels are
+        decoded the way DMA_Write packs them, see Packet._unpack_write_array.
+        :param channels: channel names to decode
+        :param start: start of the time range in seconds since the first record, inclusive
+        :param stop: end of the time range in seconds since the first record, exclusive
+        :return: dictionary of numpy arrays with a 'time' key holding seconds since the first record, an
+            'iteration' key, and one key per channel
+        """
+        if isinstance(channels, str):
+            channels = [channels]
+        try:
+            locations = [self.channel_locations[name] for name in channels]
+        except KeyError as error:
+            raise KeyError('{} is not a channel in this recording'.format(error.args[0]))
+        directions = set(direction for direction, index in locations)
+        if len(directions) > 1:
+            raise ValueError('Read and write channels cannot be decoded together, they are recorded at different '
+                             'times. Decode each direction separately.')
+        direction = directions.pop() if directions else READ
+        records = self.records()
+        first = int(records[0, 0]) if len(records) else 0
+        timestamps, iterations, frames = self.frames('read' if direction == READ else 'write', start, stop)
+        columns = {'time': (timestamps - np.uint64(first)).astype(np.float64) / 1e9, 'iteration': iterations}
+        wanted = set(channels)
+        for index in sorted(set(index for _, index in locations)):
+            if direction == READ:
+                columns.update(self.read_packet_list[index]._unpack_array(frames[:, index], names=wanted))
+            else:
+                columns.update(self.write_packet_list[index]._unpack_write_array(frames[:, index], names=wanted))
+        return columns
+
+    def close(self):
+        self._records = None
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_val, trace):
+        self.close()
@@ -0,0 +1,312 @@
+"""
+Channel table of a VeriStand FPGA session published in shared memory, for dashboards, loggers and control logic
+running in other processes.
+
+The shared memory block starts with a fixed 72 byte prefix:
+
+    magic         8 bytes   b'VSFPGASH'
+    version       uint32
+    header size   uint32    length of the JSON header in bytes
+    channels      uint64    number of channels, in handle order
+    ring frames   uint64    number of DMA_Read frames the frame ring holds, 0 without a ring
+    frame length  uint64    number of U64 words per frame
+    sequence      uint64    twice the number of tables published, plus one while a table is being written
+    ring count    uint64    number of frames published to the ring so far
+    ring claim    uint64    ring count once the frames being written are published
+
+followed by the JSON header holding the channel names in handle order, the handles of the Boolean channels and the
+packet layout of the configuration, padded to a multiple of 8 bytes, then by two slots of float64 channel values and
+by the frame ring of U64 words.
+
+Tables are published alternately to the two slots, under a sequence lock. A reader takes the slot of the last table
+published, reads the channels it wants straight from it and checks the sequence again. The slot it read is only
+written to again by the publish after next, so the publisher never waits for readers and a reader only retries
+when it took longer than a whole publish. The frame ring works the same way: the publisher raises ring claim, copies
+the frames in and then raises ring count, and readers discard any frames that ring claim shows may have been
+overwritten while they copied them.
+This relies on the stores of the publisher becoming visible to other processes in the order they are made, as they
+do on x86.
+"""
+import json
+import os
+import struct
+import time
+from array import array
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+MAGIC = b'VSFPGASH'
+VERSION = 1
+_PREFIX = struct.Struct('<8sIIQQQQQQ')
+_SEQUENCE_WORD = 5
+_RING_COUNT_WORD = 6
+_RING_CLAIM_WORD = 7
+
+
+def _require_shared_memory():
+    if shared_memory is None:
+        raise ImportError('Sharing the channel table needs multiprocessing.shared_memory, from Python 3.8')
+
+
+class SharedChannelTable(object):
+    """
+    Publishes the channel values of a VeriStandFPGA, and optionally its most recent DMA_Read frames, to a shared
+    memory block that SharedChannelReader objects in other processes attach to by name.
+    Create it with VeriStandFPGA.start_sharing, which publishes after every read and write.
+    """
+
+    def __init__(self, values, channel_names, boolean_handles, layout, ring_frames=0, name=None):
+        """
+        :param values: the channel values array of the VeriStandFPGA
+        :param channel_names: channel names in handle order
+        :param boolean_handles: handles of the Boolean channels
+        :param layout: packet layout of the configuration, as returned by VeriStandFPGA.layout
+        :param ring_frames: number of recent DMA_Read frames to keep in shared memory, 0 for none
+        :param name: name of the shared memory block. A unique name is made up by default.
+        """
+        _require_shared_memory()
+        self.values = values
+        self.channels = len(channel_names)
+        self.ring_frames = ring_frames
+        self.frame_length = layout['read_packets']
+        header = json.dumps({'channels': list(channel_names),
+                             'booleans': sorted(boolean_handles),
+                             'layout': layout}).encode('utf-8')
+        header += b' ' * (-len(header) % 8)
+        self._values_offset = _PREFIX.size + len(header)
+        self._ring_offset = self._values_offset + 2 * 8 * self.channels
+        size = self._ring_offset + 8 * ring_frames * self.frame_length
+        self._memory = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.name = self._memory.name
+        self._memory.buf[:_PREFIX.size] = _PREFIX.pack(MAGIC, VERSION, len(header), self.channels, ring_frames,
+                                                       self.frame_length, 0, 0, 0)
+        self._memory.buf[_PREFIX.size:self._values_offset] = header
+        self._words = self._memory.buf[:_PREFIX.size].cast('Q')
+        self._slots = _value_slots(self._memory.buf, self._values_offset, self.channels)
+        self._ring = self._memory.buf[self._ring_offset:size].cast('Q')
+        self.tables_published = 0
+        self.publish()
+
+    def publish(self):
+        """
+        Publish the current channel values.
+        """
+        sequence = 2 * self.tables_published
+        words = self._words
+        words[_SEQUENCE_WORD] = sequence + 1
+        self._slots[(self.tables_published + 1) & 1][:] = self.values
+        words[_SEQUENCE_WORD] = sequence + 2
+        self.tables_published += 1
+
+    def publish_frames(self, data):
+        """
+        Append DMA_Read frames to the frame ring. Only the last ring_frames frames are kept.
+        :param data: U64s of a whole number of frames, back to back
+        """
+        if not self.ring_frames:
+            return
+        frame_length = self.frame_length
+        if isinstance(data, list):
+            data = array('Q', data)
+        else:
+            data = memoryview(data).cast('B').cast('Q')
+        frames = len(data) // frame_length if frame_length else 0
+        words = self._words
+        count = words[_RING_COUNT_WORD]
+        words[_RING_CLAIM_WORD] = count + frames
+        ring = self._ring
+        for frame in range(max(0, frames - self.ring_frames), frames):
+            start = ((count + frame) % self.ring_frames) * frame_length
+            ring[start:start + frame_length] = data[frame * frame_length:(frame + 1) * frame_length]
+        words[_RING_COUNT_WORD] = count + frames
+
+    def close(self):
+        """
+        Remove the shared memory block. Readers already attached keep their mapping until they close.
+        """
+        if self._memory is None:
+            return
+        for view in self._slots + (self._words, self._ring):
+            view.release()
+        self._memory.close()
+        self._memory.unlink()
+        self._memory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_val, trace):
+        self.close()
+
+
+class SharedChannelReader(object):
+    """
+    Read-only view of a SharedChannelTable from another process. Channel values are read straight from shared
+    memory, only those asked for, and the reader never holds up the publishing process.
+    """
+
+    def __init__(self, name):
+        """
+        :param name: name of the shared memory block, SharedChannelTable.name in the publishing process
+        """
+        _require_shared_memory()
+        self.name = name
+        self._memory = _attach(name)
+        buf = self._memory.buf
+        magic, version, header_size, self.channels, self.ring_frames, self.frame_length, _, _, _ = \
+            _PREFIX.unpack_from(buf, 0)
+        if magic != MAGIC:
+            self._memory.close()
+            raise ValueError('{} is not a VeriStand FPGA shared channel table'.format(name))
+        if version != VERSION:
+            self._memory.close()
+            raise ValueError('{} is a version {} shared channel table, only version {} is supported'.format(
+                name, version, VERSION))
+        values_offset = _PREFIX.size + header_size
+        header = json.loads(bytes(buf[_PREFIX.size:values_offset]).decode('utf-8'))
+        self.channel_names = header['channels']
+        self.channel_handles = dict((channel_name, handle) for handle, channel_name in enumerate(self.channel_names))
+        self._boolean_handles = frozenset(header['booleans'])
+        self.layout = header['layout']
+        ring_offset = values_offset + 2 * 8 * self.channels
+        self._words = buf[:_PREFIX.size].cast('Q')
+        self._slots = _value_slots(buf, values_offset, self.channels)
+        self._ring = buf[ring_offset:ring_offset + 8 * self.ring_frames * self.frame_length].cast('Q')
+        self.last_sequence = 0
+
+    def get_handle(self, channel_name):
+        """
+        Resolve a channel name to the handle read_handles takes. Resolve handles once, outside of any loop.
+        """
+        try:
+            return self.channel_handles[channel_name]
+        except KeyError:
+            raise KeyError('{} is not a channel in shared table {}'.format(channel_name, self.name))
+
+    @property
+    def tables_published(self):
+        """
+        Number of tables published so far.
+        """
+        return self._words[_SEQUENCE_WORD] >> 1
+
+    def read_handles(self, handles):
+        """
+        Read some channels from the same published table.
+        :param handles: channel handles, see get_handle
+        :return: list of the channel values, as floats, in the order of handles. The number of the table they
+            come from is kept in last_sequence.
+        """
+        words = self._words
+        slots = self._slots
+        while True:
+            published = words[_SEQUENCE_WORD] >> 1
+            slot = slots[published & 1]
+            values = [slot[handle] for handle in handles]
+            # The slot read is next written to by the publish after the next one, which raises the sequence to
+            # 2 * published + 3 first
+            if words[_SEQUENCE_WORD] < 2 * published + 3:
+                self.last_sequence = published
+                return values
+
+    def read(self, channels=None):
+        """
+        Read some channels from the same published table.
+        :param channels: channel names, every channel by default
+        :return: dictionary of the channel values with channel names as keys. Boolean channels are returned as
+            bools, every other channel as a float.
+        """
+        if channels is None:
+            channels = self.channel_names
+        elif isinstance(channels, str):
+            channels = [channels]
+        handles = [self.get_handle(channel_name) for channel_name in channels]
+        values = self.read_handles(handles)
+        booleans = self._boolean_handles
+        return dict((channel_name, bool(value) if handle in booleans else value)
+                    for channel_name, handle, value in zip(channels, handles, values))
+
+    def wait_for_table(self, after, timeout=None, poll=0.0005):
+        """
+        Wait for a table newer than after to be published, polling without taking any lock.
+        :param after: number of the last table seen, such as last_sequence
+        :param timeout: time in seconds to wait at most, without limit by default
+        :param poll: time in seconds between two checks
+        :return: the number of the newest table published, or None on timeout
+        """
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while True:
+            published = self.tables_published
+            if published > after:
+                return published
+            if deadline is not None and time.perf_counter() >= deadline:
+                return None
+            time.sleep(poll)
+
+    @property
+    def frames_published(self):
+        """
+        Number of DMA_Read frames published to the frame ring so far.
+        """
+        return self._words[_RING_COUNT_WORD]
+
+    def latest_frames(self, count=1):
+        """
+        Copy the most recent DMA_Read frames out of the frame ring.
+        :param count: number of frames wanted, at most ring_frames
+        :return: array of the U64s of up to count frames, oldest first and back to back. Fewer frames are returned
+            when fewer have been published.
+        """
+        if count > self.ring_frames:
+            raise ValueError('The frame ring of {} holds {} frames'.format(self.name, self.ring_frames))
+        words = self._words
+        frame_length = self.frame_length
+        while True:
+            last = words[_RING_COUNT_WORD]
+            first = max(0, last - count)
+            frames = array('Q')
+            for index in range(first, last):
+                start = (index % self.ring_frames) * frame_length
+                frames.extend(self._ring[start:start + frame_length])
+            # Frames from first on were not written to while they were copied if the ring was not claimed past them
+            if first >= words[_RING_CLAIM_WORD] - self.ring_frames:
+                return frames
+
+    def close(self):
+        if self._memory is None:
+            return
+        for view in self._slots + (self._words, self._ring):
+            view.release()
+        self._memory.close()
+        self._memory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_val, trace):
+        self.close()
+
+
+def _value_slots(buf, offset, channels):
+    return tuple(buf[offset + slot * 8 * channels:offset + (slot + 1) * 8 * channels].cast('d') for slot in (0, 1))
+
+
+def _attach(name):
+    """
+    Attach to an existing shared memory block. Before Python 3.13 every block attached to is registered with the
+    resource tracker, which removes it when the process exits, even though the publisher still owns it, so the block
+    is unregistered again straight after attaching.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+    memory = shared_memory.SharedMemory(name=name)
+    if os.name == 'posix':
+        # Only POSIX shared memory is registered, see SharedMemory.__init__
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(memory._name, 'shared_memory')
+    return memory
@@ -0,0 +1,428 @@
+import math
+import threading
+import time
+from collections import namedtuple
+
+from fpga_config import _BOOLEAN, _I16, _FXPI32, _PWM
+from fpga_stream import FIFO_TIMEOUT_CODE
+
+
+class SimulatedFifoTimeout(BaseException):
+    """
+    Raised by a simulated FIFO when a read or write times out.
+    Mirrors nifpga's FifoTimeoutError, which is also a BaseException reporting status code -50400.
+    """
+    def get_code(self):
+        return FIFO_TIMEOUT_CODE
+
+    def get_code_string(self):
+        return 'FifoTimeout'
+
+
+class SimulatedRegister(object):
+    """
+    Stand-in for a nifpga register. Writes are stored and handed back by read.
+    """
+
+    def __init__(self, name, value):
+        self.name = name
+        self.value = value
+
+    def read(self):
+        return self.value
+
+    def write(self, value):
+        self.value = value
+
+
+class SimulatedFIFO(object):
+    """
+    Stand-in for a nifpga U64 DMA FIFO. The elements live in a list guarded by the session lock,
+    and the owning SimulatedSession moves data in or out of it as simulated loop iterations elapse.
+    """
+    ReadValues = namedtuple('ReadValues', ['data', 'elements_remaining'])
+
+    def __init__(self, session, name, depth):
+        self.name = name
+        self.depth = depth
+        self._session = session
+        self._elements = []
+
+    def configure(self, requested_depth):
+        with self._session._lock:
+            self.depth = requested_depth
+        return requested_depth
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def read(self, number_of_elements, timeout_ms=0):
+        self._session._driver_call()
+        deadline = self._session._deadline(timeout_ms)
+        while True:
+            with self._session._lock:
+                self._session._tick()
+                if len(self._elements) >= number_of_elements:
+                    data = self._elements[:number_of_elements]
+                    del self._elements[:number_of_elements]
+                    return self.ReadValues(data=data, elements_remaining=len(self._elements))
+            self._session._wait(deadline)
+
+    def read_into(self, buffer, timeout_ms=0):
+        """
+        Fill buffer with the next len(buffer) elements, without handing back a new list.
+        :return: number of elements remaining in the FIFO
+        """
+        number_of_elements = len(buffer)
+        self._session._driver_call()
+        deadline = self._session._deadline(timeout_ms)
+        while True:
+            with self._session._lock:
+                self._session._tick()
+                if len(self._elements) >= number_of_elements:
+                    for i in range(number_of_elements):
+                        buffer[i] = self._elements[i]
+                    del self._elements[:number_of_elements]
+                    return len(self._elements)
+            self._session._wait(deadline)
+
+    def write_from(self, buffer, timeout_ms=0):
+        """
+        Write every element of buffer to the FIFO.
+        :return: number of empty elements remaining in the FIFO
+        """
+        self._session._driver_call()
+        deadline = self._session._deadline(timeout_ms)
+        while True:
+            with self._session._lock:
+                self._session._tick()
+                if len(self._elements) + len(buffer) <= self.depth:
+                    for element in buffer:
+                        self._elements.append(int(element))
+                    return self.depth - len(self._elements)
+            self._session._wait(deadline)
+
+    def write(self, data, timeout_ms=0):
+        try:
+            data = list(data)
+        except TypeError:
+            data = [data]
+        self._session._driver_call()
+        deadline = self._session._deadline(timeout_ms)
+        while True:
+            with self._session._lock:
+                self._session._tick()
+                if len(self._elements) + len(data) <= self.depth:
+                    self._elements.extend(data)
+                    return self.depth - len(self._elements)
+            self._session._wait(deadline)
+
+
+class SimulatedSession(object):
+    """
+    Stand-in for nifpga.Session running a VeriStand FPGA template bitfile, for use without an NI target.
+    Pass it to VeriStandFPGA.init_fpga through the session argument.
+
+    Once the Start register is set, the simulated FPGA loop runs one iteration per 'Loop Rate (usec)', or at
+    rate_hz if given. Each iteration pushes one frame of read_packets U64s into DMA_READ and consumes one frame of
+    write_packets U64s from DMA_WRITE if one is waiting. When DMA_READ is full the frame is dropped, counted in
+    overflows, and the next frame that fits has its 'Is Late?' bit set, as the FPGA would report.
+    :param config: VeriStandFPGA object describing the packets of the bitfile
+    :param rate_hz: loop rate override in iterations per second
+    :param frame_source: callable taking the iteration number and returning a list of read_packets U64s.
+        Defaults to a LayoutFrameSource generating waveforms that follow the read packets of config.
+    :param fifo_depth: depth of both DMA FIFOs in elements
+    :param call_latency: time in seconds every FIFO read or write spends in the simulated driver, sleeping without
+        the GIL the way a DMA transfer does, before it touches the FIFO
+    :param loopback: mapping of read channel names to write channel names, for the default frame source to read
+        back the last values written to those channels, see LayoutFrameSource
+    """
+
+    def __init__(self, config, rate_hz=None, frame_source=None, fifo_depth=10000, call_latency=0.0, loopback=None):
+        self.read_packets = config.read_packets
+        self.write_packets = config.write_packets
+        self.rate_hz = rate_hz
+        self.frame_source = frame_source or LayoutFrameSource(config, loopback=loopback, session=self)
+        self.call_latency = call_latency
+        self.fifos = {'DMA_READ': SimulatedFIFO(self, 'DMA_READ', fifo_depth),
+                      'DMA_WRITE': SimulatedFIFO(self, 'DMA_WRITE', fifo_depth)}
+        self.registers = {'Loop Rate (usec)': SimulatedRegister('Loop Rate (usec)', 1000),
+                          'Start': SimulatedRegister('Start', False),
+                          'Write to  RTSI': SimulatedRegister('Write to  RTSI', False),
+                          'Use External Timing': SimulatedRegister('Use External Timing', False),
+                          'Generate IRQ': SimulatedRegister('Generate IRQ', False)}
+        self.fpga_vi_state = 'NotRunning'
+        self.iterations = 0
+        self.overflows = 0
+        self.last_write_frame = None
+        self._late = False
+        self._start_time = None
+        self._lock = threading.Lock()
+
+    def download(self):
+        pass
+
+    def run(self):
+        self.fpga_vi_state = 'Running'
+
+    def abort(self):
+        self.fpga_vi_state = 'NotRunning'
+
+    def reset(self):
+        with self._lock:
+            self.fpga_vi_state = 'NotRunning'
+            self.registers['Start'].write(False)
+            self._start_time = None
+            for fifo in self.fifos.values():
+                del fifo._elements[:]
+
+    def close(self):
+        self.reset()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_val, trace):
+        self.close()
+
+    def _period(self):
+        if self.rate_hz:
+            return 1.0 / self.rate_hz
+        return self.registers['Loop Rate (usec)'].read() / 1e6
+
+    def _tick(self):
+        """
+        Run every loop iteration that has come due since the last call. Called with the lock held.
+        """
+        if not self.registers['Start'].read():
+            return
+        now = time.perf_counter()
+        if self._start_time is None:
+            self._start_time = now - self.iterations * self._period()
+        due = int((now - self._start_time) / self._period())
+        read_fifo = self.fifos['DMA_READ']._elements
+        read_depth = self.fifos['DMA_READ'].depth
+        write_fifo = self.fifos['DMA_WRITE']._elements
+        while self.iterations < due:
+            if len(read_fifo) + self.read_packets > read_depth:
+                # Skip straight over the iterations that would overflow, however many came due while nobody read
+                skipped = due - self.iterations
+                consumed = 0
+                if self.write_packets:
+                    consumed = min(skipped, len(write_fifo) // self.write_packets) * self.write_packets
+                if consumed:
+                    self.last_write_frame = write_fifo[consumed - self.write_packets:consumed]
+                    del write_fifo[:consumed]
+                self.overflows += skipped
+                self.iterations = due
+                self._late = True
+                break
+            if len(write_fifo) >= self.write_packets:
+                self.last_write_frame = write_fifo[:self.write_packets]
+                del write_fifo[:self.write_packets]
+            frame = self.frame_source(self.iterations)
+            if self._late:
+                frame = [frame[0] | 1] + list(frame[1:])
+                self._late = False
+            read_fifo.extend(frame)
+            self.iterations += 1
+
+    def _driver_call(self):
+        if self.call_latency:
+            time.sleep(self.call_latency)
+
+    def _deadline(self, timeout_ms):
+        if timeout_ms < 0:
+            return None
+        return time.perf_counter() + timeout_ms / 1000.0
+
+    def _wait(self, deadline):
+        """
+        Sleep until the next loop iteration is due, or raise a timeout once the deadline has passed.
+        """
+        now = time.perf_counter()
+        if deadline is not None and now >= deadline:
+            raise SimulatedFifoTimeout()
+        pause = self._period()
+        if self._start_time is not None:
+            pause = self._start_time + (self.iterations + 1) * pause - now
+        if deadline is not None:
+            pause = min(pause, deadline - now)
+        time.sleep(max(pause, 0))
+
+
+class LayoutFrameSource(object):
+    """
+    Frame source for a SimulatedSession generating DMA_Read frames that follow the read packets of a configuration,
+    each channel encoded the way VeriStandFPGA decodes it:
+
+        Boolean   square wave, channel i toggling every i + 1 iterations
+        I16       sine wave of 80 % of the channel's scale, channels phase shifted
+        FXPI32    sawtooth from 0 to half of the channel's range
+        PWM       duty cycle swinging between 10 % and 90 %
+
+    The waveforms repeat every period iterations, so frames are only computed for the first period and then reused.
+    Read channels given in loopback instead read back the value last written to a write channel, taken from the
+    frames the simulated FPGA consumes from DMA_WRITE. Negative FXPI32 values do not loop back, as the DMA_Write
+    packing does not encode them.
+    """
+
+    def __init__(self, config, loopback=None, period=1000, session=None):
+        """
+        :param config: VeriStandFPGA whose read packets the frames follow
+        :param loopback: mapping of read channel names to the write channel names they read back
+        :param period: period of the waveforms in iterations
+        :param session: the SimulatedSession the frames are for, needed for loopback
+        """
+        self.period = period
+        self.session = session
+        self._fields = []
+        # The first packet holds the 'Is Late?' flag, which the session sets itself
+        for pack_index, this_packet in enumerate(config.read_packet_list[1:], 1):
+            for step in this_packet._unpack_plan:
+                if step[1] in (_BOOLEAN, _I16, _FXPI32, _PWM):
+                    self._fields.append((pack_index, this_packet._pack_plan[step[0]], step))
+        self.read_packets = config.read_packets
+        self._frames = {}
+        self._loopback = []
+        for read_name, write_name in (loopback or {}).items():
+            read_field = self._find_read_field(config, read_name)
+            write_field = self._find_write_field(config, write_name)
+            self._loopback.append((read_field, write_field))
+
+    @staticmethod
+    def _find_read_field(config, channel_name):
+        for pack_index, this_packet in enumerate(config.read_packet_list[1:], 1):
+            for step in this_packet._unpack_plan:
+                if this_packet._names[step[0]] == channel_name:
+                    return pack_index, this_packet._pack_plan[step[0]], step
+        raise KeyError('{} is not a read channel'.format(channel_name))
+
+    @staticmethod
+    def _find_write_field(config, channel_name):
+        """
+        :return: (write packet index, data type, bit offset, pack arguments) of a write channel, as laid out by the
+            DMA_Write packing for non-negative values
+        """
+        for pack_index, this_packet in enumerate(config.write_packet_list):
+            offset = 0
+            for i, data_type, arg0, arg1 in this_packet._pack_plan:
+                if this_packet._names[i] == channel_name:
+                    return pack_index, data_type, offset, (arg0, arg1)
+                offset += {_BOOLEAN: 1, _I16: 16, _FXPI32: 32}.get(data_type, 64)
+        raise KeyError('{} is not a write channel'.format(channel_name))
+
+    def __call__(self, iteration):
+        phase = iteration % self.period
+        frame = self._frames.get(phase)
+        if frame is None:
+            frame = [0] * self.read_packets
+            for pack_index, pack_step, step in self._fields:
+                frame[pack_index] |= _encode_field(self._waveform(step, phase), pack_step, step)
+            self._frames[phase] = frame
+        if not self._loopback or self.session is None or self.session.last_write_frame is None:
+            return frame
+        frame = list(frame)
+        written = self.session.last_write_frame
+        for (pack_index, pack_step, step), (write_index, data_type, offset, args) in self._loopback:
+            value = _decode_write_field(written[write_index], data_type, offset, args)
+            shift, mask = step[2], step[3]
+            if step[1] == _PWM:
+                frame[pack_index] = _encode_field(value, pack_step, step)
+            else:
+                frame[pack_index] = (frame[pack_index] & ~(mask << shift)) | _encode_field(value, pack_step, step)
+        return frame
+
+    def _waveform(self, step, phase):
+        i, data_type, shift, mask, args = step
+        angle = 2 * math.pi * phase / self.period
+        if data_type == _BOOLEAN:
+            return (phase // (i + 1)) & 1
+        if data_type == _I16:
+            return 0.8 * float(args) * math.sin(angle + i)
+        if data_type == _FXPI32:
+            sign_bit, lsb_weight = args
+            return (sign_bit - 1) * lsb_weight * 0.5 * phase / self.period
+        return 50 + 40 * math.sin(angle)
+
+
+def _encode_field(value, pack_step, step):
+    """
+    Encode a channel value into the bits VeriStandFPGA decodes it from in a DMA_Read packet.
+    """
+    i, data_type, shift, mask, args = step
+    if data_type == _BOOLEAN:
+        return (1 if value else 0) << shift
+    if data_type == _I16:
+        scaled = value / float(args)
+        raw = int(round(scaled * 32767)) if scaled > 0 else int(round(scaled * 32768))
+        return (max(-32768, min(32767, raw)) & 0xFFFF) << shift
+    if data_type == _FXPI32:
+        sign_bit, lsb_weight = args
+        # Read packets come back as magnitudes, so only the magnitude is encoded
+        return min(int(abs(value) / lsb_weight), sign_bit - 1) << shift
+    period = pack_step[2] or 1000
+    hi_time = max(0, min(period, int(round(value / 100 * period))))
+    return (hi_time << 32) | (period - hi_time)
+
+
+def _decode_write_field(word, data_type, offset, args):
+    """
+    Decode a channel value from a DMA_Write word, inverting the DMA_Write packing of VeriStandFPGA.
+    """
+    if data_type == _BOOLEAN:
+        return (word >> offset) & 1
+    if data_type == _I16:
+        raw = (word >> offset) & 0xFFFF
+        if raw & 0x8000:
+            raw -= 0x10000
+        return raw * 10 / 32767 if raw > 0 else raw * 10 / 32768
+    if data_type == _FXPI32:
+        word_length, integer_word_length = args
+        return ((word >> offset) & 0xFFFFFFFF) / 2.0 ** (word_length - integer_word_length)
+    hi_time = word >> 32
+    low_time = word & 0xFFFFFFFF
+    return hi_time / (hi_time + low_time) * 100 if hi_time + low_time else 0.0
+
+
+def write_synthetic_config(filepath, read_packets, write_packets, bitfile='Simulated.lvbitx'):
+    """
+    Write a .fpgaconfig file with the given number of packets in each direction, for exercising the API with the
+    simulator. Packets cycle through the supported layouts: 4 I16s, 32 Booleans, 2 FXPI32s and a PWM.
+    The first read packet is the 'Is Late?' packet and holds no channels.
+    :param filepath: path of the .fpgaconfig file to write
+    :param read_packets: number of DMA_Read packets, including the 'Is Late?' packet
+    :param write_packets: number of DMA_Write packets
+    :param bitfile: bitfile name written to the configuration
+    """
+    lines = ['<?xml version="1.0" encoding="utf-8"?>', '<FPGA>', '  <Bitfile>{}</Bitfile>'.format(bitfile)]
+    for tag, direction, count in (('DMA_Read', 'In', read_packets), ('DMA_Write', 'Out', write_packets)):
+        lines.append('  <{}>'.format(tag))
+        lines.append('    <Packets>{}</Packets>'.format(count))
+        for pack_index in range(1, count + 1):
+            lines.append('    <Packet>')
+            if tag == 'DMA_Read' and pack_index == 1:
+                lines.append('    </Packet>')
+                continue
+            layout = pack_index % 4
+            prefix = '{}{}_'.format(direction, pack_index)
+            if layout == 0:
+                for i in range(4):
+                    lines.append('      <I16><Name>{}AI{}</Name><Scale>10</Scale></I16>'.format(prefix, i))
+            elif layout == 1:
+                for i in range(32):
+                    lines.append('      <Boolean><Name>{}DIO{}</Name></Boolean>'.format(prefix, i))
+            elif layout == 2:
+                for i in range(2):
+                    lines.append('      <FXPI32><Name>{}FXP{}</Name><FXPWL>24</FXPWL><FXPIWL>16</FXPIWL>'
+                                 '</FXPI32>'.format(prefix, i))
+            else:
+                lines.append('      <PWM><Name>{}PWM</Name><PWMPeriod>4000</PWMPeriod></PWM>'.format(prefix))
+            lines.append('    </Packet>')
+        lines.append('  </{}>'.format(tag))
+    lines.append('</FPGA>')
+    with open(filepath, 'w') as config_file:
+        config_file.write('\n'.join(lines) + '\n')
@@ -0,0 +1,288 @@
+import threading
+from array import array
+
+
+FIFO_TIMEOUT_CODE = -50400
+
+
+def is_fifo_timeout(error):
+    """
+    True if error is a FIFO timeout status raised by nifpga, or by a session standing in for it.
+    """
+    get_code = getattr(error, 'get_code', None)
+    return get_code is not None and get_code() == FIFO_TIMEOUT_CODE
+
+
+class FrameRing(object):
+    """
+    Preallocated ring buffer of raw DMA_Read frames, each frame being the read_packets U64s of one loop iteration.
+
+    The ring has a single writer, a FIFOReader, and any number of readers, each with its own FrameCursor. No locks are
+    taken: the writer copies a chunk of frames into the buffer and only then advances write_count, and readers check
+    write_count again after copying to discard any frames the writer may have overwritten under them.
+    """
+
+    def __init__(self, capacity, frame_length, max_chunk=1):
+        """
+        :param capacity: number of frames the ring holds
+        :param frame_length: number of U64s per frame
+        :param max_chunk: largest number of frames the writer publishes at once
+        """
+        if capacity <= max_chunk:
+            raise ValueError('Ring capacity must be larger than the chunk size of {} frames'.format(max_chunk))
+        self.capacity = capacity
+        self.frame_length = frame_length
+        self.max_chunk = max_chunk
+        self.buffer = array('Q', bytes(8 * capacity * frame_length))
+        self.write_count = 0
+
+    def publish(self, data):
+        """
+        Append whole frames to the ring. Only the writer may call this.
+        :param data: sequence of U64s holding a whole number of frames, at most max_chunk of them
+        """
+        frames = len(data) // self.frame_length
+        if not isinstance(data, array):
+            data = array('Q', data)
+        start = (self.write_count % self.capacity) * self.frame_length
+        split = min(len(data), len(self.buffer) - start)
+        self.buffer[start:start + split] = data[:split]
+        if split < len(data):
+            self.buffer[:len(data) - split] = data[split:]
+        self.write_count += frames
+
+    def oldest_valid(self):
+        """
+        Index of the oldest frame that is guaranteed not to be overwritten by a publish already under way.
+        """
+        return self.write_count + self.max_chunk - self.capacity
+
+    def copy_frames(self, first, last):
+        """
+        Copy frames first to last - 1 out of the ring, without checking that they are still valid.
+        """
+        start = (first % self.capacity) * self.frame_length
+        stop = start + (last - first) * self.frame_length
+        if stop <= len(self.buffer):
+            return self.buffer[start:stop]
+        return self.buffer[start:] + self.buffer[:stop - len(self.buffer)]
+
+    def latest(self):
+        """
+        :return: the U64s of the most recent frame, or None if nothing has been published yet
+        """
+        while True:
+            newest = self.write_count - 1
+            if newest < 0:
+                return None
+            frame = self.copy_frames(newest, newest + 1)
+            if newest >= self.oldest_valid():
+                return frame
+
+    def cursor(self):
+        """
+        :return: a FrameCursor that yields every frame published from now on
+        """
+        return FrameCursor(self, self.write_count)
+
+
+class FrameCursor(object):
+    """
+    Read position of one consumer in a FrameRing.
+    Frames the writer overwrote before this consumer got to them are skipped and counted in overruns.
+    """
+
+    def __init__(self, ring, position):
+        self.ring = ring
+        self.position = position
+        self.overruns = 0
+
+    @property
+    def backlog(self):
+        """
+        Number of published frames this cursor has not read yet.
+        """
+        return self.ring.write_count - self.position
+
+    def read(self, max_frames=None):
+        """
+        Take the frames published since the last call.
+        :param max_frames: largest number of frames to return
+        :return: array of U64s holding the frames back to back, oldest first
+        """
+        ring = self.ring
+        first = max(self.position, ring.oldest_valid())
+        last = ring.write_count
+        if max_frames is not None:
+            last = min(last, first + max_frames)
+        frames = ring.copy_frames(first, last)
+        # The writer may have lapped the start of what was just copied
+        valid = ring.oldest_valid()
+        if valid > first:
+            frames = frames[(min(valid, last) - first) * ring.frame_length:]
+            first = min(valid, last)
+        self.overruns += first - self.position
+        self.position = last
+        return frames
+
+    def __iter__(self):
+        """
+        Yield each frame published since the last read as its own array of U64s, without waiting for new ones.
+        """
+        frames = self.read()
+        frame_length = self.ring.frame_length
+        for start in range(0, len(frames), frame_length):
+            yield frames[start:start + frame_length]
+
+
+class FIFOReader(threading.Thread):
+    """
+    Thread draining the DMA_Read FIFO into a FrameRing, and into recorder when one is set.
+    Each pass reads every whole frame waiting in the FIFO, up to chunk_frames, or blocks for one frame when it is
+    empty. FIFO timeouts are counted and retried, any other error stops the thread and is kept in error.
+    """
+
+    def __init__(self, fifo, ring, timeout):
+        """
+        :param fifo: the DMA_Read FIFO of the session
+        :param ring: FrameRing to publish frames to
+        :param timeout: timeout in ms of a blocking FIFO read
+        """
+        super(FIFOReader, self).__init__(name='DMA_READ reader')
+        self.daemon = True
+        self.fifo = fifo
+        self.ring = ring
+        self.timeout = timeout
+        self.reads = 0
+        self.timeouts = 0
+        self.backlog = 0
+        self.max_backlog = 0
+        self.error = None
+        self.recorder = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        frame_length = self.ring.frame_length
+        chunk_frames = self.ring.max_chunk
+        try:
+            while not self._stop_event.is_set():
+                waiting = self.fifo.read(number_of_elements=0, timeout_ms=0).elements_remaining // frame_length
+                frames = min(max(waiting, 1), chunk_frames)
+                try:
+                    read_tup = self.fifo.read(number_of_elements=frames * frame_length, timeout_ms=self.timeout)
+                except BaseException as error:
+                    if not is_fifo_timeout(error):
+                        raise
+                    self.timeouts += 1
+                    continue
+                self.ring.publish(read_tup.data)
+                recorder = self.recorder
+                if recorder is not None:
+                    recorder.record_read(read_tup.data)
+                self.reads += 1
+                self.backlog = read_tup.elements_remaining // frame_length
+                self.max_backlog = max(self.max_backlog, self.backlog)
+        except BaseException as error:
+            self.error = error
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def stats(self):
+        """
+        :return: dictionary of the reader counters, in frames where applicable
+        """
+        return {'frames_read': self.ring.write_count,
+                'reads': self.reads,
+                'timeouts': self.timeouts,
+                'fifo_backlog': self.backlog,
+                'max_fifo_backlog': self.max_backlog}
+
+
+class FIFOWriter(threading.Thread):
+    """
+    Thread playing a block of encoded frames to the DMA_Write FIFO in chunks, and to recorder when one is set.
+    Each chunk is handed to the FIFO in one call, straight from the frames' memory when the FIFO is a nifpga FIFO,
+    and the call blocks until the FIFO has room for it, so the FIFO is kept full with no work per frame in Python.
+    FIFO timeouts are counted and retried, any other error stops the thread and is kept in error.
+    """
+
+    def __init__(self, fifo, frames, timeout, chunk_frames, repeat=False):
+        """
+        :param fifo: the DMA_Write FIFO of the session
+        :param frames: C contiguous numpy uint64 array of frames shaped (iterations, write_packets)
+        :param timeout: timeout in ms of a chunk write
+        :param chunk_frames: number of frames written at once
+        :param repeat: start over from the first frame after the last one, until stopped
+        """
+        super(FIFOWriter, self).__init__(name='DMA_WRITE writer')
+        self.daemon = True
+        self.fifo = fifo
+        self.frames = frames
+        self.timeout = timeout
+        self.chunk_frames = max(1, chunk_frames)
+        self.repeat = repeat
+        self.frames_written = 0
+        self.loops = 0
+        self.writes = 0
+        self.timeouts = 0
+        self.error = None
+        self.recorder = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        from fpga_config import _fifo_buffer
+        iterations, frame_length = self.frames.shape
+        flat = self.frames.reshape(-1)
+        position = 0
+        try:
+            while iterations and not self._stop_event.is_set():
+                end = min(position + self.chunk_frames, iterations)
+                chunk = flat[position * frame_length:end * frame_length]
+                transfer = _fifo_buffer(self.fifo, chunk)
+                while True:
+                    try:
+                        transfer.write(self.timeout)
+                        break
+                    except BaseException as error:
+                        if not is_fifo_timeout(error):
+                            raise
+                        self.timeouts += 1
+                        if self._stop_event.is_set():
+                            return
+                recorder = self.recorder
+                if recorder is not None:
+                    recorder.record_write(chunk)
+                self.writes += 1
+                self.frames_written += end - position
+                position = end
+                if position == iterations:
+                    self.loops += 1
+                    if not self.repeat:
+                        break
+                    position = 0
+        except BaseException as error:
+            self.error = error
+
+    @property
+    def done(self):
+        """
+        True once every frame has been handed to the FIFO, for a stimulus that is not repeated, or after an error.
+        """
+        return not self.is_alive() and (self.error is not None or (not self.repeat and self.loops > 0))
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def stats(self):
+        """
+        :return: dictionary of the writer counters, in frames where applicable
+        """
+        return {'frames_written': self.frames_written,
+                'total_frames': len(self.frames),
+                'loops': self.loops,
+                'writes': self.writes,
+                'timeouts': self.timeouts,
+                'done': self.done}
@@ -0,0 +1,77 @@
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fpga_config import VeriStandFPGA  # noqa: E402
+from fpga_simulator import SimulatedSession, write_synthetic_config  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def layout_cache(tmp_path_factory, monkeypatch):
+    """
+    Keep the parsed layout cache of every test out of the home directory.
+    """
+    monkeypatch.setenv('VERISTAND_FPGA_CACHE', str(tmp_path_factory.getbasetemp() / 'layout_cache'))
+
+
+class SimulatedRig(object):
+    """
+    VeriStandFPGA on a SimulatedSession whose loop is never started, so that the test plays the FPGA: push puts
+    frames in DMA_READ in bursts of any size, the way the loop would after the host stalled.
+    Each frame carries its iteration number in the low 32 bits of every packet but the 'Is Late?' one, and a 1 in
+    the high 32 bits, which keeps PWM channels decodable.
+    """
+
+    def __init__(self, folder, read_packets, write_packets, init_options=None, **session_options):
+        config_path = os.path.join(str(folder), 'rig_{}_{}.fpgaconfig'.format(read_packets, write_packets))
+        write_synthetic_config(config_path, read_packets, write_packets)
+        self.fpga = VeriStandFPGA(config_path)
+        session_options.setdefault('frame_source', self.frame)
+        self.session = SimulatedSession(self.fpga, **session_options)
+        self.fpga.init_fpga(None, 1000, session=self.session, **(init_options or {}))
+        self.read_fifo = self.session.fifos['DMA_READ']
+        self.write_fifo = self.session.fifos['DMA_WRITE']
+        self.pushed = 0
+
+    def frame(self, iteration):
+        return [0] + [(1 << 32) | iteration] * (self.fpga.read_packets - 1)
+
+    def push(self, frames):
+        """
+        Put the next frames in DMA_READ at once.
+        """
+        with self.session._lock:
+            for _ in range(frames):
+                self.read_fifo._elements.extend(self.frame(self.pushed))
+                self.pushed += 1
+
+    def close(self):
+        self.fpga.stop_fpga()
+
+
+@pytest.fixture
+def make_rig(tmp_path):
+    rigs = []
+
+    def make(read_packets=4, write_packets=4, init_options=None, **session_options):
+        rig = SimulatedRig(tmp_path, read_packets, write_packets, init_options, **session_options)
+        rigs.append(rig)
+        return rig
+
+    yield make
+    for rig in rigs:
+        rig.close()
+
+
+def wait_until(condition, timeout=10.0):
+    """
+    Poll condition until it holds, failing the test after timeout seconds.
+    """
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        assert time.perf_counter() < deadline, 'timed out waiting for a background thread'
+        time.sleep(0.001)
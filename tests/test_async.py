@@ -0,0 +1,166 @@
+import asyncio
+
+import pytest
+
+from fpga_async import AsyncVeriStandFPGA
+from fpga_config import ConfigError, VeriStandFPGA
+from fpga_simulator import SimulatedFifoTimeout, SimulatedSession, write_synthetic_config
+
+
+def make_fpga(tmp_path):
+    config_path = str(tmp_path / 'async.fpgaconfig')
+    write_synthetic_config(config_path, 6, 4)
+    fpga = VeriStandFPGA(config_path)
+    return fpga, SimulatedSession(fpga)
+
+
+def test_init_fpga_forwards_fifo_depths(tmp_path):
+    fpga, session = make_fpga(tmp_path)
+
+    async def init():
+        async with AsyncVeriStandFPGA(fpga) as device:
+            await device.init_fpga(None, 1000, session=session, read_fifo_depth=300, write_fifo_depth=40)
+
+    asyncio.run(init())
+    try:
+        assert fpga.read_fifo_depth == 300
+        assert session.fifos['DMA_READ'].depth == 300 * 6
+        assert fpga.write_fifo_depth == 40
+        assert session.fifos['DMA_WRITE'].depth == 40 * 4
+    finally:
+        fpga.stop_fpga()
+
+
+def test_iterations_refused_while_fifo_is_drained(tmp_path):
+    fpga, session = make_fpga(tmp_path)
+    fpga.init_fpga(None, 1000, session=session)
+
+    async def iterate():
+        async with AsyncVeriStandFPGA(fpga) as device:
+            async for _ in device.iterations(0):
+                pass
+
+    try:
+        fpga.start_streaming(capacity=64, chunk_frames=8, timeout=10)
+        with pytest.raises(ConfigError):
+            asyncio.run(iterate())
+        fpga.stop_streaming()
+        fpga.start_decoding(workers=1, chunk_frames=8, timeout=10)
+        with pytest.raises(ConfigError):
+            asyncio.run(iterate())
+    finally:
+        fpga.stop_fpga()
+
+
+def expected_values(fpga, frame):
+    values = {}
+    for this_packet, word in zip(fpga.read_packet_list, frame):
+        values.update(this_packet._unpack(word))
+    return values
+
+
+def taken_from_fifo(rig):
+    return rig.pushed - len(rig.read_fifo._elements) // rig.fpga.read_packets
+
+
+def test_read_and_write(make_rig):
+    rig = make_rig(read_packets=6)
+    rig.push(2)
+
+    async def run():
+        async with AsyncVeriStandFPGA(rig.fpga) as device:
+            device.set_channel('Out2_FXP0', 12.5)
+            device.set_channel('Out1_DIO3', True)
+            await device.write(0)
+            await device.read(0)
+            await device.read(0)
+            return device.get_channel('In2_FXP1')
+
+    assert asyncio.run(run()) == 1 / 256
+    expected = [this_packet._pack_from(rig.fpga.channel_values, this_packet._handles)
+                for this_packet in rig.fpga.write_packet_list]
+    assert rig.write_fifo._elements == expected
+    assert rig.write_fifo._elements[0] == 1 << 3
+
+
+def test_iterations_yield_every_frame_in_order(make_rig, tmp_path):
+    rig = make_rig(read_packets=6)
+    rig.fpga.enable_metrics()
+    rig.fpga.start_recording(str(tmp_path / 'async.vsrec'))
+    rig.push(30)
+
+    async def run():
+        seen = []
+        async with AsyncVeriStandFPGA(rig.fpga) as device:
+            async for values in device.iterations(0, max_pending=4):
+                seen.append(values)
+                if len(seen) == 30:
+                    break
+        return seen
+
+    seen = asyncio.run(run())
+    assert seen == [expected_values(rig.fpga, rig.frame(i)) for i in range(30)]
+    # The frames went through the same read as vs_read_fifo
+    assert rig.fpga.metrics.frames_read == 30
+    assert rig.fpga.recorder.read_iterations == 30
+    assert rig.fpga.max_fifo_backlog == 29
+    assert rig.fpga.get_channel('In2_FXP1') == 29 / 256
+
+
+def test_iterations_read_at_most_max_pending_ahead(make_rig):
+    rig = make_rig(read_packets=6)
+    rig.push(100)
+
+    async def run():
+        taken = []
+        async with AsyncVeriStandFPGA(rig.fpga) as device:
+            async for _ in device.iterations(0, max_pending=4):
+                # Let the background task fill the queue while this consumer is slow
+                await asyncio.sleep(0.05)
+                taken.append(taken_from_fifo(rig))
+                if len(taken) == 3:
+                    break
+        return taken
+
+    taken = asyncio.run(run())
+    # The frame consumed, a full queue and the frame waiting to be queued
+    assert all(count <= 1 + len(taken[:i]) + 4 + 1 for i, count in enumerate(taken))
+    assert taken[-1] >= 3 + 4
+    # Frames read ahead are lost once the loop is left, though they went through the read like any other
+    lost = taken_from_fifo(rig) - 3
+    assert 0 < lost <= 4 + 1
+    assert rig.fpga.get_channel('In2_FXP1') == (taken_from_fifo(rig) - 1) / 256
+
+
+def test_iterations_raise_fifo_errors(make_rig):
+    rig = make_rig(read_packets=6)
+    rig.push(2)
+
+    async def run():
+        seen = 0
+        async with AsyncVeriStandFPGA(rig.fpga) as device:
+            async for _ in device.iterations(0):
+                seen += 1
+        return seen
+
+    with pytest.raises(SimulatedFifoTimeout):
+        asyncio.run(run())
+
+
+def test_cancelled_read_still_completes(make_rig):
+    rig = make_rig(read_packets=6)
+
+    async def run():
+        async with AsyncVeriStandFPGA(rig.fpga) as device:
+            read = asyncio.ensure_future(device.read(5000))
+            await asyncio.sleep(0.02)
+            read.cancel()
+            rig.push(2)
+            with pytest.raises(asyncio.CancelledError):
+                await read
+            # The next call runs after the cancelled read has taken its frame
+            await device.read(0)
+
+    asyncio.run(run())
+    assert rig.read_fifo._elements == []
+    assert rig.fpga.get_channel('In2_FXP1') == 1 / 256
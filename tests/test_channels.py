@@ -0,0 +1,105 @@
+import random
+
+import pytest
+
+from fpga_config import VeriStandFPGA, ConfigError
+from fpga_simulator import write_synthetic_config
+
+
+@pytest.fixture
+def config_path(tmp_path):
+    path = str(tmp_path / 'channels.fpgaconfig')
+    write_synthetic_config(path, 6, 4)
+    return path
+
+
+def test_handles_follow_packet_order(config_path):
+    fpga = VeriStandFPGA(config_path)
+    names = [name for this_packet in fpga.read_packet_list + fpga.write_packet_list for name in this_packet._names]
+    assert list(fpga.channel_handles) == names
+    assert [fpga.get_handle(name) for name in names] == list(range(len(names)))
+    assert len(fpga.channel_values) == len(names)
+    for this_packet in fpga.read_packet_list + fpga.write_packet_list:
+        assert this_packet._handles == tuple(fpga.get_handle(name) for name in this_packet._names)
+
+
+def test_handles_are_stable(config_path, tmp_path):
+    parsed = VeriStandFPGA(config_path, use_cache=False)
+    cached = VeriStandFPGA(config_path)
+    reloaded = VeriStandFPGA(config_path, cache_dir=str(tmp_path / 'other_cache'))
+    assert parsed.channel_handles == cached.channel_handles == reloaded.channel_handles
+    handles = dict(cached.channel_handles)
+    cached.set_channels({'Out1_DIO0': True, 'Out2_FXP0': 2.5})
+    cached.unpack_frame([1] + [random.Random(16).getrandbits(64) for _ in range(cached.read_packets - 1)])
+    assert cached.channel_handles == handles
+
+
+def test_handle_and_name_access_agree(make_rig):
+    rig = make_rig(read_packets=9, write_packets=4)
+    fpga = rig.fpga
+    rng = random.Random(17)
+    frames = [[rng.getrandbits(1)] + [rng.getrandbits(64) for _ in range(fpga.read_packets - 1)] for _ in range(20)]
+    rig.frame = lambda iteration: frames[iteration]
+    fpga.subscribe(['In2_FXP0'])
+    for iteration in range(len(frames)):
+        rig.push(1)
+        fpga.vs_read_fifo(timeout=0)
+        for name, handle in fpga.channel_handles.items():
+            value = fpga.get_channel(name)
+            by_handle = fpga.get_channel_by_handle(handle)
+            assert type(by_handle) is float, name
+            # Booleans are bools by name and 1.0 or 0.0 by handle
+            assert by_handle == value, (iteration, name)
+            assert type(value) is (bool if handle in fpga._boolean_handles else float), name
+
+    handle = fpga.get_handle('Out2_FXP1')
+    fpga.set_channel_by_handle(handle, 3.25)
+    assert fpga.get_channel('Out2_FXP1') == 3.25
+    fpga.set_channel('Out1_DIO7', True)
+    assert fpga.get_channel_by_handle(fpga.get_handle('Out1_DIO7')) == 1.0
+    with pytest.raises(ConfigError):
+        fpga.get_handle('No such channel')
+
+
+def test_layouts_are_immutable(config_path):
+    fpga = VeriStandFPGA(config_path)
+    this_packet = fpga.read_packet_list[3]
+    definition = this_packet.definition
+    assert definition['data_type0'] == 'I16'
+    with pytest.raises(TypeError):
+        definition['Scale0'] = 5
+    with pytest.raises(TypeError):
+        del definition['name0']
+    assert this_packet.definition['Scale0'] == 10
+
+    packet_layout = this_packet.packet_layout
+    for attribute in ('definition', 'names', 'unpack_plan', 'channels'):
+        with pytest.raises(AttributeError):
+            setattr(packet_layout, attribute, None)
+    with pytest.raises(AttributeError):
+        del packet_layout.names
+
+    channel = list(this_packet)[0]
+    with pytest.raises(AttributeError):
+        channel.scale = 5
+    with pytest.raises(AttributeError):
+        channel.extra = 1
+    with pytest.raises(AttributeError):
+        del channel.name
+    with pytest.raises(TypeError):
+        channel['Scale'] = 5
+    assert (channel.scale, channel['Scale']) == (10, 10)
+
+
+def test_channels_match_definition(config_path):
+    fpga = VeriStandFPGA(config_path)
+    for this_packet in fpga.read_packet_list + fpga.write_packet_list:
+        channels = list(this_packet)
+        # Iterating hands out the same Channels every time
+        assert all(first is second for first, second in zip(channels, this_packet))
+        definition = this_packet.definition
+        assert len(channels) == definition['channel_count']
+        for i, channel in enumerate(channels):
+            assert channel.index == i
+            assert dict(channel) == dict((key, definition[key + str(i)]) for key in channel)
+            assert channel['name'] == this_packet._names[i]
@@ -0,0 +1,302 @@
+"""
+Golden comparison of the compiled packet plans against the binary string codec they replaced.
+
+legacy_unpack and legacy_pack are the Packet._unpack and Packet._pack of the original implementation, unchanged
+apart from taking the packet definition and index as arguments.
+"""
+import random
+
+import pytest
+
+from fpga_config import PacketError, packet_from_definition
+
+
+def legacy_unpack(definition, index, data):
+    binstr = '{0:064b}'.format(int(data))
+    real_values = {}
+    for i in range(definition['channel_count']):
+        if definition['data_type{}'.format(i)] == 'FXPI32':
+            chnlunpck = 0
+            chnldata = binstr[int(i*32):int((i+1)*32)]
+            nopad = chnldata[32 - int(definition['FXPWL{}'.format(i)]):int((i + 1) * 32)]
+            for index, char in enumerate(nopad):
+                if int(nopad[0]) != 0:
+                    if int(char) == 0:
+                        char = 1
+                    else:
+                        char = 0
+                powof = int(definition['FXPIWL{}'.format(i)]) - 1 - index
+                bitval = int(char) * 2 ** powof
+                chnlunpck = chnlunpck + bitval
+            real_values['{}'.format(definition['name{}'.format(i)])] = chnlunpck
+
+        elif definition['data_type{}'.format(i)] == 'PWM':
+            hitime = int(binstr[:32], 2)
+            lowtime = int(binstr[32:], 2)
+            dutycycle = (hitime/(hitime+lowtime))*100
+            real_values['{}'.format(definition['name{}'.format(i)])] = dutycycle
+
+        elif definition['data_type{}'.format(i)] == 'Boolean':
+            bit = int(binstr[63-i])
+            real_values['{}'.format(definition['name{}'.format(i)])] = bool(bit)
+
+        elif definition['data_type{}'.format(i)] == 'I16':
+            analog_data_str = binstr[int((3-i)*16):int((4-i)*16)]
+            analog_int = 0
+            if analog_data_str[0] == '1':
+                for char in range(15):
+                    if analog_data_str[char+1] == '0':
+                        analog_int += 2**(14-char)
+                    elif analog_data_str[char+1] != '1':
+                        raise PacketError(message='{} has a non binary character in data string'.format(
+                            definition['name{}'.format(i)]), packetID=index)
+                analog_int *= -1
+                analog_int -= 1
+            elif analog_data_str[0] == '0':
+                for char in range(15):
+                    if analog_data_str[char+1] == '1':
+                        analog_int += 2**(14-char)
+                    elif analog_data_str[char+1] == '0':
+                        continue
+                    else:
+                        raise PacketError(message='{} has a non binary character in data string'.format(
+                            definition['name{}'.format(i)]), packetID=index)
+            else:
+                raise PacketError(message='{} has a non binary character in data string'.format(
+                    definition['name{}'.format(i)]), packetID=index)
+            analog_cal = 0
+            scale = definition['Scale{}'.format(i)]
+            if analog_int > 0:
+                analog_cal = (scale * analog_int)/32767
+            elif analog_int < 0:
+                analog_cal = (-1 * scale * analog_int)/-32768
+            real_values['{}'.format(definition['name{}'.format(i)])] = analog_cal
+
+        else:
+            raise PacketError(message='{} has an unsupported data type of {}'.format(
+                definition['name{}'.format(i)], definition['data_type{}'.format(i)]), packetID=index)
+
+    return real_values
+
+
+def legacy_pack(definition, index, real_values):
+    datastr = ''
+    for i in range(definition['channel_count']):
+        if definition['data_type{}'.format(i)] == 'Boolean':
+            value = int(real_values[i])
+            if value:
+                bit = 1
+            else:
+                bit = 0
+            datastr = (str(bit)) + datastr
+
+        elif definition['data_type{}'.format(i)] == 'PWM':
+            dutycycle = int(real_values[0])
+            hi_time = int(round((dutycycle/100) * definition['PWM_period{}'.format(i)]))
+            low_time = definition['PWM_period{}'.format(i)] - hi_time
+            datastr = '{0:032b}'.format(hi_time) + '{0:032b}'.format(low_time)
+
+        elif definition['data_type{}'.format(i)] == 'FXPI32':
+            binstr = '0'
+            negstr = ''
+            value = float(real_values[i])
+            for j in range(int(definition['FXPWL{}'.format(i)])-1):
+                check = abs(value) - 2**(int(definition['FXPIWL{}'.format(i)])-2-j)
+                if check >= 0:
+                    binstr = binstr + '1'
+                    value = check
+                else:
+                    binstr = binstr + '0'
+            if int(real_values[i]) < 0:
+                for char in datastr:
+                    if char == '0':
+                        negstr = negstr + '1'
+                    else:
+                        negstr = negstr + '0'
+                binstr = negstr
+            for j in range(32-int(definition['FXPWL{}'.format(i)])):
+                binstr = '0' + binstr
+            datastr = binstr + datastr
+
+        elif definition['data_type{}'.format(i)] == 'I16':
+            calibrated_value = float(real_values[i])
+            raw_value = 0
+            if calibrated_value > 0:
+                raw_value = int(round((32767 * calibrated_value)/10))
+            elif calibrated_value < 0:
+                raw_value = int(round((-32768 * calibrated_value)/-10))
+            if raw_value >= 0:
+                binstr = '0'
+                for bit in range(15):
+                    bitcheck = int(raw_value - 2 ** (14-bit))
+                    if bitcheck >= 0:
+                        binstr += '1'
+                        raw_value = bitcheck
+                    else:
+                        binstr += '0'
+            else:
+                binstr = '1'
+                for bit in range(15):
+                    bitcheck = int(raw_value + 2 ** (14-bit))
+                    if bitcheck < 0:
+                        binstr += '0'
+                        raw_value = bitcheck
+                    else:
+                        binstr += '1'
+            datastr = binstr + datastr
+
+        else:
+            raise PacketError(message='{} has an unsupported data type of {}'.format(
+                definition['name{}'.format(i)], definition['data_type{}'.format(i)]), packetID=index)
+    packed_data = int(datastr, 2)
+    return packed_data
+
+
+def i16_definition(scales):
+    definition = {'channel_count': len(scales)}
+    for i, scale in enumerate(scales):
+        definition.update({'name{}'.format(i): 'AI{}'.format(i), 'data_type{}'.format(i): 'I16',
+                           'Scale{}'.format(i): scale})
+    return definition
+
+
+def boolean_definition(count):
+    definition = {'channel_count': count}
+    for i in range(count):
+        definition.update({'name{}'.format(i): 'DIO{}'.format(i), 'data_type{}'.format(i): 'Boolean'})
+    return definition
+
+
+def fxp_definition(formats):
+    definition = {'channel_count': len(formats)}
+    for i, (word_length, integer_word_length) in enumerate(formats):
+        definition.update({'name{}'.format(i): 'FXP{}'.format(i), 'data_type{}'.format(i): 'FXPI32',
+                           'FXPWL{}'.format(i): word_length, 'FXPIWL{}'.format(i): integer_word_length})
+    return definition
+
+
+def pwm_definition(period):
+    return {'channel_count': 1, 'name0': 'PWM', 'data_type0': 'PWM', 'PWM_period0': period}
+
+
+DEFINITIONS = [
+    ('I16 scale 10', i16_definition([10, 10, 10, 10])),
+    ('I16 mixed scales', i16_definition([1, 5, 10, 20])),
+    ('I16 partial', i16_definition([10, 2])),
+    ('Boolean 1', boolean_definition(1)),
+    ('Boolean 32', boolean_definition(32)),
+    ('Boolean 64', boolean_definition(64)),
+    ('FXPI32 24/16', fxp_definition([(24, 16), (24, 16)])),
+    ('FXPI32 32/16', fxp_definition([(32, 16), (32, 16)])),
+    ('FXPI32 mixed', fxp_definition([(16, 8), (20, 4)])),
+    ('FXPI32 single', fxp_definition([(24, 16)])),
+    ('PWM 4000', pwm_definition(4000)),
+    ('PWM 1000', pwm_definition(1000)),
+    ('PWM 65535', pwm_definition(65535)),
+]
+IDS = [name for name, _ in DEFINITIONS]
+
+
+def outcome(function, *arguments):
+    """
+    :return: ('value', result) or ('raises', None), so that cases both codecs refuse compare equal
+    """
+    try:
+        return 'value', function(*arguments)
+    except (PacketError, ValueError, OverflowError, ZeroDivisionError):
+        return 'raises', None
+
+
+def frames_for(definition, rng):
+    frames = [0, 2 ** 64 - 1, 2 ** 63, 2 ** 63 - 1, 2 ** 32, 2 ** 32 - 1, 0x8000800080008000, 0x7FFF7FFF7FFF7FFF,
+              0x0000000100000001, 0x80000000FFFFFFFF]
+    # Sign boundaries of every FXP word length
+    for i in range(definition['channel_count']):
+        word_length = definition.get('FXPWL{}'.format(i))
+        if word_length:
+            shift = (1 - i) * 32
+            for raw in (1 << (word_length - 1), (1 << (word_length - 1)) - 1, (1 << word_length) - 1, 1):
+                frames.append(raw << shift)
+    frames.extend(rng.getrandbits(64) for _ in range(2000))
+    return frames
+
+
+def values_for(data_type, definition, i, rng):
+    if data_type == 'Boolean':
+        return [0, 1, 2, -1, 0.5, -0.5, 1.9] + [rng.choice((0, 1)) for _ in range(20)]
+    if data_type == 'I16':
+        return ([0.0, 10.0, -10.0, 9.9999, -9.9999, 10.0002, -10.0002, 15.0, -15.0, 1e-6, -1e-6, 0.00015, -0.00015,
+                 float('nan'), float('inf'), float('-inf')] + [rng.uniform(-12.0, 12.0) for _ in range(200)])
+    if data_type == 'FXPI32':
+        word_length = definition['FXPWL{}'.format(i)]
+        integer_word_length = definition['FXPIWL{}'.format(i)]
+        full_scale = 2.0 ** (integer_word_length - 1)
+        lsb = 2.0 ** (integer_word_length - word_length)
+        return ([0.0, lsb, lsb / 2, full_scale, full_scale - lsb, 2 * full_scale, -0.5, -0.99, -1.0, -full_scale,
+                 float('nan')] + [rng.uniform(-1.5 * full_scale, 1.5 * full_scale) for _ in range(200)])
+    return ([0, 100, 50, 0.4, 99.9, 100.9, -0.9, 12.5] +
+            [rng.uniform(0.0, 100.99) for _ in range(200)])
+
+
+@pytest.mark.parametrize('definition', [definition for _, definition in DEFINITIONS], ids=IDS)
+def test_unpack_matches_string_codec(definition):
+    rng = random.Random(1)
+    this_packet = packet_from_definition('read', 2, definition)
+    for data in frames_for(definition, rng):
+        expected = outcome(legacy_unpack, definition, 2, data)
+        assert outcome(this_packet._unpack, data) == expected, hex(data)
+        # The handle based decode used by the read paths fills the same values
+        values = {}
+        if expected[0] == 'value':
+            this_packet._unpack_into(data, values, this_packet._names)
+            assert values == expected[1], hex(data)
+
+
+def test_first_read_packet_matches_string_codec():
+    this_packet = packet_from_definition('read', 1, {})
+    definition = {'channel_count': 1, 'name0': 'Is Late?', 'data_type0': 'Boolean'}
+    for data in (0, 1, 2, 3, 2 ** 64 - 1, 2 ** 64 - 2):
+        assert this_packet._unpack(data) == legacy_unpack(definition, 1, data)
+
+
+@pytest.mark.parametrize('definition', [definition for _, definition in DEFINITIONS], ids=IDS)
+def test_pack_matches_string_codec(definition):
+    rng = random.Random(2)
+    this_packet = packet_from_definition('write', 1, definition)
+    count = definition['channel_count']
+    candidates = [values_for(definition['data_type{}'.format(i)], definition, i, rng) for i in range(count)]
+    cases = [[candidates[i][k % len(candidates[i])] for i in range(count)] for k in range(len(candidates[0]))]
+    cases.extend([rng.choice(candidates[i]) for i in range(count)] for _ in range(1000))
+    for real_values in cases:
+        assert outcome(this_packet._pack, real_values) == outcome(legacy_pack, definition, 1, real_values), \
+            real_values
+
+
+@pytest.mark.parametrize('period', [4000, 1000, 65535])
+@pytest.mark.parametrize('dutycycle', [101, 106.76, 150, 1e9, -1, -1.5, -50, -1e9])
+def test_pwm_duty_cycle_out_of_range(period, dutycycle):
+    definition = pwm_definition(period)
+    this_packet = packet_from_definition('write', 1, definition)
+    # The string codec raised above 100 % and built a negative word below 0 %, neither a valid U64
+    legacy = outcome(legacy_pack, definition, 1, [dutycycle])
+    assert legacy[0] == 'raises' or legacy[1] < 0
+    with pytest.raises(PacketError):
+        this_packet._pack([dutycycle])
+
+
+def test_pwm_duty_cycle_truncates_like_string_codec():
+    definition = pwm_definition(4000)
+    this_packet = packet_from_definition('write', 1, definition)
+    # int() truncates towards zero, so these are still 100 % and 0 %
+    for dutycycle in (100.99, -0.99, 100, 0):
+        assert this_packet._pack([dutycycle]) == legacy_pack(definition, 1, [dutycycle])
+        assert 0 <= this_packet._pack([dutycycle]) < 2 ** 64
+
+
+def test_unsupported_data_type():
+    definition = {'channel_count': 1, 'name0': 'U8', 'data_type0': 'U8'}
+    this_packet = packet_from_definition('write', 3, definition)
+    with pytest.raises(PacketError):
+        this_packet._pack([1])
+    with pytest.raises(PacketError):
+        this_packet._unpack(1)
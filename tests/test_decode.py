@@ -0,0 +1,166 @@
+import random
+
+import numpy as np
+import pytest
+
+from fpga_config import PacketError, packet_from_definition
+from fpga_decode import DecodeExecutor
+from test_codec import DEFINITIONS, IDS, boolean_definition, frames_for, fxp_definition, i16_definition, \
+    pwm_definition
+
+
+def random_frames(fpga, count, seed):
+    rng = random.Random(seed)
+    return np.array([[rng.getrandbits(1)] + [rng.getrandbits(64) for _ in range(fpga.read_packets - 1)]
+                     for _ in range(count)], dtype=np.uint64)
+
+
+def assert_same_columns(columns, expected):
+    assert sorted(columns) == sorted(expected)
+    for name in expected:
+        assert columns[name].dtype == expected[name].dtype, name
+        np.testing.assert_array_equal(columns[name], expected[name], err_msg=name)
+
+
+def scalar_unpack(this_packet, data):
+    """
+    :return: the channels of one U64 as _unpack_into decodes them, with nan for a PWM of no period
+    """
+    values = {}
+    try:
+        this_packet._unpack_into(data, values, this_packet._names)
+    except ZeroDivisionError:
+        # An all zero PWM word has no period, which the vectorized decode leaves as nan
+        values = dict((name, float('nan')) for name in this_packet._names)
+    return values
+
+
+IS_LATE = {'channel_count': 1, 'name0': 'Is Late?', 'data_type0': 'Boolean'}
+
+# (definition, U64, channel, value): the decodes the read paths have always produced, quirks included
+DECODES = [
+    # FXPI32 negatives come back as the magnitude of their ones' complement, channel 0 in the high 32 bits
+    (fxp_definition([(24, 16), (24, 16)]), 0x000100 << 32, 'FXP0', 1.0),
+    (fxp_definition([(24, 16), (24, 16)]), 0x000100, 'FXP1', 1.0),
+    (fxp_definition([(24, 16), (24, 16)]), 0x7FFFFF << 32, 'FXP0', 32767.99609375),
+    (fxp_definition([(24, 16), (24, 16)]), 0x800000 << 32, 'FXP0', 32767.99609375),
+    (fxp_definition([(24, 16), (24, 16)]), 0xFFFF00 << 32, 'FXP0', 0.99609375),
+    (fxp_definition([(24, 16), (24, 16)]), 0xFFFFFF, 'FXP1', 0.0),
+    (fxp_definition([(32, 16), (32, 16)]), 0xFFFFFFFF00000000, 'FXP0', 0.0),
+    (fxp_definition([(32, 16), (32, 16)]), 0x80000000, 'FXP1', 32767.9999847412109375),
+    # I16 channels from bit 0, negatives on 32768 steps and positives on 32767
+    (i16_definition([10, 10, 10, 10]), 0, 'AI0', 0.0),
+    (i16_definition([10, 10, 10, 10]), 0x7FFF, 'AI0', 10.0),
+    (i16_definition([10, 10, 10, 10]), 0x8000, 'AI0', -10.0),
+    (i16_definition([10, 10, 10, 10]), 0xFFFF, 'AI0', -10 / 32768),
+    (i16_definition([10, 10, 10, 10]), 0x0001, 'AI0', 10 / 32767),
+    (i16_definition([10, 10, 10, 10]), 0x8000 << 16, 'AI1', -10.0),
+    (i16_definition([1, 5, 10, 20]), 0x8000 << 48, 'AI3', -20.0),
+    (i16_definition([1, 5, 10, 20]), 0x7FFF << 48, 'AI3', 20.0),
+    (boolean_definition(32), 1 << 31, 'DIO31', True),
+    (boolean_definition(32), 1 << 31, 'DIO0', False),
+    (boolean_definition(64), 1 << 63, 'DIO63', True),
+    (pwm_definition(4000), (1000 << 32) | 3000, 'PWM', 25.0),
+    (pwm_definition(4000), 4000 << 32, 'PWM', 100.0),
+    (pwm_definition(4000), 4000, 'PWM', 0.0),
+    # Only bit 0 of the first read packet is 'Is Late?'
+    (IS_LATE, 1, 'Is Late?', True),
+    (IS_LATE, 2, 'Is Late?', False),
+    (IS_LATE, 2 ** 64 - 1, 'Is Late?', True),
+]
+
+
+def read_packet(definition):
+    return packet_from_definition('read', 1 if definition is IS_LATE else 2, definition)
+
+
+@pytest.mark.parametrize('definition, data, name, value', DECODES)
+def test_decodes(definition, data, name, value):
+    this_packet = read_packet(definition)
+    assert scalar_unpack(this_packet, data)[name] == value
+    decoded = this_packet._unpack_array(np.array([data, data], dtype=np.uint64))[name]
+    assert decoded.tolist() == [value, value]
+    assert decoded.dtype == (bool if isinstance(value, bool) else np.float64)
+
+
+@pytest.mark.parametrize('definition', [definition for _, definition in DEFINITIONS] + [IS_LATE],
+                         ids=IDS + ['Is Late?'])
+def test_vectorized_unpack_matches_scalar(definition):
+    this_packet = read_packet(definition)
+    data = frames_for(definition, random.Random(14)) + [data for _, data, _, _ in DECODES]
+    columns = this_packet._unpack_array(np.array(data, dtype=np.uint64))
+    expected = [scalar_unpack(this_packet, word) for word in data]
+    for name in this_packet._names:
+        np.testing.assert_array_equal(columns[name], [values[name] for values in expected], err_msg=name)
+
+
+def test_decode_read_frames_matches_unpack_frame(make_rig):
+    rig = make_rig(read_packets=9)
+    frames = random_frames(rig.fpga, 200, 15)
+    columns = rig.fpga.decode_read_frames(frames)
+    assert columns['Is Late?'].dtype == bool
+    assert 0 < columns['Is Late?'].sum() < len(frames)
+    for iteration, frame in enumerate(frames):
+        rig.fpga.unpack_frame([int(word) for word in frame])
+        for name, column in columns.items():
+            assert rig.fpga.get_channel(name) == column[iteration], (name, iteration)
+
+
+def test_executor_matches_vectorized_decode(make_rig):
+    rig = make_rig(read_packets=9)
+    frames = random_frames(rig.fpga, 100, 11)
+    # 100 frames make 14 chunks of 7 and a partial one, more than the slots, so slots are reused out of order
+    with DecodeExecutor(rig.fpga.layout(), workers=2, chunk_frames=7, slots=3) as executor:
+        assert_same_columns(executor.decode(frames), rig.fpga.decode_read_frames(frames))
+        assert executor.stats()['chunks_decoded'] == 15
+        assert executor.stats()['frames_decoded'] == 100
+        assert executor.pending == 0
+
+
+def test_worker_errors_are_raised_by_collect(make_rig):
+    rig = make_rig(read_packets=6)
+    layout = rig.fpga.layout()
+    layout['read'][3] = dict(layout['read'][3], data_type0='U8')
+    with DecodeExecutor(layout, workers=1, chunk_frames=4) as executor:
+        with pytest.raises(PacketError):
+            executor.decode(random_frames(rig.fpga, 8, 12))
+
+
+def test_decoded_fifo_matches_vectorized_decode(make_rig):
+    rig = make_rig(read_packets=9)
+    frames = random_frames(rig.fpga, 64, 13)
+    rig.frame = lambda iteration: [int(word) for word in frames[iteration]]
+    rig.push(64)
+    rig.fpga.start_decoding(workers=2, chunk_frames=8, slots=3, timeout=10)
+    chunks = [rig.fpga.read_decoded(timeout=10000) for _ in range(8)]
+    assert all(len(chunk['In2_FXP0']) == 8 for chunk in chunks)
+    columns = dict((name, np.concatenate([chunk[name] for chunk in chunks])) for name in chunks[0])
+    assert_same_columns(columns, rig.fpga.decode_read_frames(frames))
+    # The table holds the last frame
+    last = rig.fpga.decode_read_frames(frames[-1:])
+    assert rig.fpga.get_channel('In4_AI1') == last['In4_AI1'][0]
+    stats = rig.fpga.decoding_stats()
+    assert (stats['frames_read'], stats['frames_decoded'], stats['pending']) == (64, 64, 0)
+
+
+def test_decoder_thread_error_reaches_read_decoded(make_rig):
+    rig = make_rig(read_packets=6)
+    read_into = rig.read_fifo.read_into
+    reads = []
+
+    def failing_read_into(buffer, timeout_ms=0):
+        if len(reads) == 2:
+            raise RuntimeError('DMA link lost')
+        reads.append(timeout_ms)
+        return read_into(buffer, timeout_ms)
+
+    rig.read_fifo.read_into = failing_read_into
+    rig.push(24)
+    rig.fpga.start_decoding(workers=1, chunk_frames=8, timeout=10)
+    # The chunks read before the error are still handed out, then the error is raised instead of waiting for ever
+    assert len(rig.fpga.read_decoded()['In2_FXP0']) == 8
+    assert len(rig.fpga.read_decoded()['In2_FXP0']) == 8
+    with pytest.raises(RuntimeError):
+        rig.fpga.read_decoded()
+    with pytest.raises(RuntimeError):
+        rig.fpga.read_decoded(timeout=10)
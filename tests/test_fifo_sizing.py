@@ -0,0 +1,82 @@
+import time
+
+import numpy as np
+
+
+def iterations_read(columns):
+    # The low 32 bits of the packets carry the iteration number, In2_FXP1 holds the low 24 of them in 1/256ths
+    return list((columns['In2_FXP1'] * 256).astype(np.int64))
+
+
+def test_adaptive_reads_clear_a_burst(make_rig):
+    rig = make_rig(read_packets=6, init_options={'read_fifo_depth': 500})
+    fpga = rig.fpga
+    assert fpga.fifo_stats() == {'fifo_backlog': 0, 'max_fifo_backlog': 0, 'read_fifo_depth': 500,
+                                 'occupancy': 0.0}
+    seen = []
+    # While the host keeps up, min_iterations are read per call
+    for _ in range(5):
+        rig.push(2)
+        seen += iterations_read(fpga.read_fifo_adaptive(0, min_iterations=2, max_iterations=64))
+        assert fpga.fifo_backlog == 0
+    # A burst after a stall: the first read only learns of the backlog, the next ones clear it max_iterations
+    # at a time
+    rig.push(150)
+    seen += iterations_read(fpga.read_fifo_adaptive(0, min_iterations=2, max_iterations=64))
+    stats = fpga.fifo_stats()
+    assert stats['fifo_backlog'] == stats['max_fifo_backlog'] == 148
+    assert stats['occupancy'] == 148 / 500
+    sizes = []
+    while fpga.fifo_backlog:
+        columns = fpga.read_fifo_adaptive(0, min_iterations=2, max_iterations=64)
+        sizes.append(len(columns['In2_FXP1']))
+        seen += iterations_read(columns)
+    assert sizes == [64, 64, 20]
+    assert seen == list(range(160))
+    assert fpga.fifo_stats() == {'fifo_backlog': 0, 'max_fifo_backlog': 148, 'read_fifo_depth': 500,
+                                 'occupancy': 0.0}
+
+
+def test_producer_stalls_and_bursts(make_rig):
+    rig = make_rig(read_packets=6, init_options={'read_fifo_depth': 300})
+    fpga = rig.fpga
+    rng = np.random.RandomState(8)
+    seen = []
+    backlogs = []
+    for _ in range(40):
+        # The FPGA stalls for a while, or delivers a burst of frames at once
+        rig.push(int(rng.choice([0, 1, 3, 40, 120])))
+        if not rig.read_fifo._elements and not fpga.fifo_backlog:
+            continue
+        columns = fpga.read_fifo_adaptive(0, min_iterations=1, max_iterations=32)
+        seen += iterations_read(columns)
+        assert len(columns['In2_FXP1']) <= 32
+        backlogs.append(fpga.fifo_backlog)
+        assert fpga.fifo_backlog == len(rig.read_fifo._elements) // fpga.read_packets
+    while fpga.fifo_backlog:
+        seen += iterations_read(fpga.read_fifo_adaptive(0, min_iterations=1, max_iterations=32))
+    assert seen == list(range(rig.pushed))
+    assert fpga.max_fifo_backlog == max(backlogs)
+    assert fpga.fifo_stats()['occupancy'] == 0.0
+
+
+def test_running_loop_overflows_shallow_fifo(make_rig):
+    rig = make_rig(read_packets=6, init_options={'read_fifo_depth': 20}, rate_hz=1000)
+    fpga = rig.fpga
+    fpga.start_fpga_main_loop()
+    for _ in range(5):
+        fpga.read_fifo_adaptive(1000, max_iterations=16)
+    assert rig.session.overflows == 0
+    # The host stalls for far longer than the 20 frames of the FIFO last
+    time.sleep(0.1)
+    late = []
+    # The first frame that fits after the overflow, at the latest the 21st read from now, is flagged late
+    while len(late) < 40:
+        columns = fpga.read_fifo_adaptive(1000, max_iterations=16)
+        late += list(columns['Is Late?'])
+    assert rig.session.overflows > 0
+    assert any(late)
+    stats = fpga.fifo_stats()
+    assert 16 <= stats['max_fifo_backlog'] <= 20
+    assert stats['read_fifo_depth'] == 20
+    assert 0 <= stats['occupancy'] <= 1
@@ -0,0 +1,145 @@
+import pytest
+
+from fpga_config import ConfigError, VeriStandFPGA
+from fpga_group import FPGAGroup
+from fpga_simulator import SimulatedFifoTimeout, SimulatedSession, write_synthetic_config
+
+
+@pytest.fixture
+def group_of(make_rig):
+    groups = []
+
+    def make(**sizes):
+        """
+        :param sizes: mapping of namespaces to (read packets, write packets) of a rig per device
+        """
+        rigs = dict((namespace, make_rig(*packets)) for namespace, packets in sizes.items())
+        group = FPGAGroup((namespace, rigs[namespace].fpga) for namespace in sizes)
+        groups.append(group)
+        return group, rigs
+
+    yield make
+    for group in groups:
+        group.close()
+
+
+def test_namespaces_are_checked():
+    with pytest.raises(ValueError):
+        FPGAGroup({})
+    with pytest.raises(ValueError):
+        FPGAGroup({'a/b': None})
+
+
+def test_channel_names_are_routed(group_of):
+    group, rigs = group_of(a=(4, 4), b=(6, 2))
+    group.set_channel('a/Out2_FXP0', 1.5)
+    group.set_channel('b/Out1_DIO3', True)
+    assert rigs['a'].fpga.get_channel('Out2_FXP0') == 1.5
+    assert rigs['b'].fpga.get_channel('Out1_DIO3') is True
+    assert rigs['a'].fpga.get_channel('Out1_DIO3') is False
+    assert group.get_channel('a/Out2_FXP0') == 1.5
+
+    group.set_channels({'a/Out1_DIO0': True, 'b/Out1_DIO0': True, 'b/Out1_DIO1': True})
+    assert rigs['a'].fpga.get_channel('Out1_DIO0') is True
+    assert rigs['b'].fpga.get_channel('Out1_DIO1') is True
+
+    table = group.channel_value_table
+    assert table['b/Out1_DIO3'] is True
+    table['b/Out1_DIO3'] = False
+    assert rigs['b'].fpga.get_channel('Out1_DIO3') is False
+    names = list(table)
+    assert len(names) == len(table) == len(rigs['a'].fpga.channel_handles) + len(rigs['b'].fpga.channel_handles)
+    assert names[0].startswith('a/') and names[-1].startswith('b/')
+    assert 'b/In5_DIO0' in table
+    assert 'a/In5_DIO0' not in table
+    assert 'c/In2_FXP0' not in table
+    assert 'In2_FXP0' not in table
+
+
+def test_unknown_channel_names(group_of):
+    group, rigs = group_of(a=(4, 4), b=(4, 4))
+    for channel_name in ('a/No such channel', 'c/Out1_DIO0', 'Out1_DIO0'):
+        with pytest.raises(ConfigError):
+            group.set_channel(channel_name, 1)
+        with pytest.raises(ConfigError):
+            group.get_channel(channel_name)
+        with pytest.raises(KeyError):
+            group.channel_value_table[channel_name]
+
+    with pytest.raises(ConfigError):
+        group.set_channels({'a/Out1_DIO0': True, 'b/Out1_DIO0': True, 'b/No such channel': 1})
+    assert rigs['a'].fpga.get_channel('Out1_DIO0') is False
+    assert rigs['b'].fpga.get_channel('Out1_DIO0') is False
+
+
+def test_group_read_write(group_of):
+    group, rigs = group_of(a=(4, 4), b=(6, 2))
+    rigs['a'].push(2)
+    rigs['b'].push(3)
+    group.vs_read_fifo(timeout=0)
+    assert group.get_channel('a/In2_FXP1') == 0
+    group.vs_read_fifo(timeout=0)
+    assert group.get_channel('a/In2_FXP1') == group.get_channel('b/In2_FXP1') == 1 / 256
+    assert group.get_channel('b/In4_AI0') == rigs['b'].fpga.get_channel('In4_AI0')
+    assert len(rigs['a'].read_fifo._elements) == 0
+    assert len(rigs['b'].read_fifo._elements) == rigs['b'].fpga.read_packets
+
+    group.set_channels({'a/Out1_DIO0': True, 'b/Out1_DIO0': True})
+    group.vs_write_fifo(timeout=0)
+    assert rigs['a'].write_fifo._elements[0] == 1
+    assert rigs['b'].write_fifo._elements == [1, 0]
+
+    rigs['a'].push(1)
+    group.vs_read_write_fifo(timeout=0)
+    assert group.get_channel('a/In2_FXP1') == group.get_channel('b/In2_FXP1') == 2 / 256
+    assert len(rigs['a'].write_fifo._elements) == 2 * rigs['a'].fpga.write_packets
+    assert rigs['b'].write_fifo._elements == [1, 0, 1, 0]
+
+
+def test_device_errors(group_of):
+    group, rigs = group_of(a=(4, 4), b=(4, 4), c=(4, 4))
+    for rig in rigs.values():
+        rig.push(1)
+    group.vs_read_fifo(timeout=0)
+
+    rigs['b'].push(1)
+    with pytest.raises(SimulatedFifoTimeout):
+        group.vs_read_fifo(timeout=0)
+    assert group.get_channel('b/In2_FXP1') == 1 / 256
+    assert len(rigs['b'].read_fifo._elements) == 0
+
+    def device_error(namespace):
+        def fail(timeout):
+            raise ConfigError(message=namespace)
+        return fail
+
+    rigs['a'].fpga.vs_read_fifo = device_error('a')
+    rigs['c'].fpga.vs_read_fifo = device_error('c')
+    rigs['b'].push(1)
+    with pytest.raises(ConfigError) as raised:
+        group.vs_read_fifo(timeout=0)
+    assert raised.value.message == 'a'
+    assert group.get_channel('b/In2_FXP1') == 2 / 256
+
+
+def test_init_and_start(tmp_path):
+    paths = {}
+    for namespace, packets in (('a', (4, 4)), ('b', (6, 2))):
+        paths[namespace] = str(tmp_path / '{}.fpgaconfig'.format(namespace))
+        write_synthetic_config(paths[namespace], *packets)
+    with FPGAGroup.from_configs(paths) as group:
+        assert list(group.devices) == ['a', 'b']
+        assert all(isinstance(fpga, VeriStandFPGA) for fpga in group.devices.values())
+        with pytest.raises(ConfigError):
+            group.start_fpga_main_loop()
+
+        sessions = dict((namespace, SimulatedSession(fpga)) for namespace, fpga in group.devices.items())
+        group.init_fpga({}, 1000, sessions=sessions, read_fifo_depth=8)
+        for namespace, fpga in group.devices.items():
+            assert fpga.session is sessions[namespace]
+        group.start_fpga_main_loop()
+        try:
+            for _ in range(3):
+                group.vs_read_write_fifo(timeout=1000)
+        finally:
+            group.stop_fpga()
@@ -0,0 +1,111 @@
+import json
+import os
+from collections import OrderedDict
+
+import pytest
+
+import fpga_config
+from fpga_config import load_layout
+from fpga_simulator import write_synthetic_config
+
+
+@pytest.fixture
+def fresh_memo(monkeypatch):
+    """
+    Start from an empty in-memory cache. Clearing it again stands for a new process, left with the disk cache.
+    """
+    memo = OrderedDict()
+    monkeypatch.setattr(fpga_config, '_layout_memo', memo)
+    return memo
+
+
+def config(folder, name='cached.fpgaconfig'):
+    path = str(folder / name)
+    write_synthetic_config(path, 6, 4)
+    return path
+
+
+def cache_files(cache_dir):
+    return sorted(os.listdir(cache_dir)) if os.path.isdir(cache_dir) else []
+
+
+def first_scale(layout):
+    return layout['read'][3]['Scale0']
+
+
+def test_cached_layout_is_used_until_the_contents_change(tmp_path, fresh_memo, monkeypatch):
+    path = config(tmp_path)
+    cache_dir = str(tmp_path / 'cache')
+    layout = load_layout(path, cache_dir=cache_dir)
+    assert load_layout(path, cache_dir=cache_dir) is layout
+    assert len(cache_files(cache_dir)) == 1
+    fresh_memo.clear()
+
+    def parse(content):
+        raise AssertionError('parsed a cached layout')
+
+    monkeypatch.setattr(fpga_config, '_parse_layout', parse)
+    assert load_layout(path, cache_dir=cache_dir) == layout
+
+
+def test_same_size_edit_with_mtime_kept_is_reparsed(tmp_path, fresh_memo):
+    path = config(tmp_path)
+    cache_dir = str(tmp_path / 'cache')
+    assert first_scale(load_layout(path, cache_dir=cache_dir)) == 10
+    stat = os.stat(path)
+    with open(path) as config_file:
+        content = config_file.read()
+    with open(path, 'w') as config_file:
+        config_file.write(content.replace('<Scale>10</Scale>', '<Scale>20</Scale>'))
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert os.stat(path).st_size == stat.st_size
+    # Both the copy in memory and the cache file are found stale
+    assert first_scale(load_layout(path, cache_dir=cache_dir)) == 20
+    fresh_memo.clear()
+    assert first_scale(load_layout(path, cache_dir=cache_dir)) == 20
+
+
+def test_corrupt_cache_file_is_replaced(tmp_path, fresh_memo):
+    path = config(tmp_path)
+    cache_dir = str(tmp_path / 'cache')
+    layout = load_layout(path, cache_dir=cache_dir)
+    cache_path = os.path.join(cache_dir, cache_files(cache_dir)[0])
+    for corrupt in ('{"version": 1, "path": ', '[]', json.dumps({'version': 1, 'path': os.path.abspath(path)})):
+        fresh_memo.clear()
+        with open(cache_path, 'w') as cache_file:
+            cache_file.write(corrupt)
+        assert load_layout(path, cache_dir=cache_dir) == layout
+        with open(cache_path) as cache_file:
+            assert json.load(cache_file)['layout'] == layout
+
+
+def test_use_cache_false_bypasses_the_cache(tmp_path, fresh_memo):
+    path = config(tmp_path)
+    cache_dir = str(tmp_path / 'cache')
+    layout = load_layout(path, cache_dir=cache_dir, use_cache=False)
+    assert cache_files(cache_dir) == []
+    assert not fresh_memo
+    cached = load_layout(path, cache_dir=cache_dir)
+    assert cached == layout
+    assert load_layout(path, cache_dir=cache_dir, use_cache=False) is not cached
+    fpga = fpga_config.VeriStandFPGA(path, cache_dir=cache_dir, use_cache=False)
+    assert fpga.layout() == layout
+
+
+def test_least_recently_used_layouts_are_evicted(tmp_path, fresh_memo, monkeypatch):
+    monkeypatch.setattr(fpga_config, '_LAYOUT_MEMO_SIZE', 2)
+    monkeypatch.setattr(fpga_config, '_CACHE_FILES', 3)
+    cache_dir = str(tmp_path / 'cache')
+    paths = [config(tmp_path, 'config{}.fpgaconfig'.format(i)) for i in range(5)]
+    for i, path in enumerate(paths):
+        load_layout(path, cache_dir=cache_dir)
+        # Modification times can be coarse, make the order of use plain
+        cache_path = os.path.join(cache_dir, fpga_config.hashlib.sha1(
+            os.path.abspath(path).encode('utf-8')).hexdigest() + '.json')
+        os.utime(cache_path, ns=(i * 10 ** 9, i * 10 ** 9))
+    assert list(fresh_memo) == [os.path.abspath(path) for path in paths[3:]]
+    kept = []
+    for name in cache_files(cache_dir):
+        with open(os.path.join(cache_dir, name)) as cache_file:
+            kept.append(json.load(cache_file)['path'])
+    assert sorted(kept) == sorted(os.path.abspath(path) for path in paths[2:])
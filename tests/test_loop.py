@@ -0,0 +1,105 @@
+import os
+import time
+
+import pytest
+
+from fpga_loop import LoopRunner, pin_current_thread
+
+
+def late_frames(rig, late):
+    """
+    Make the frames of the iterations in late carry the 'Is Late?' flag.
+    """
+    frame = rig.frame
+
+    def late_frame(iteration):
+        return [1 if iteration in late else 0] + frame(iteration)[1:]
+
+    rig.frame = late_frame
+
+
+def test_loop_keeps_the_fpga_rate(make_rig):
+    rig = make_rig(read_packets=6, rate_hz=500)
+    seen = []
+
+    def callback(fpga, iteration):
+        seen.append((iteration, int(fpga.get_channel('In2_FXP1') * 256)))
+
+    runner = LoopRunner(rig.fpga, callback, loop_rate=2000, timeout=1000)
+    rig.fpga.start_fpga_main_loop()
+    start = time.perf_counter()
+    runner.run(iterations=100)
+    elapsed = time.perf_counter() - start
+    assert [iteration for iteration, _ in seen] == list(range(100))
+    # Every frame was read, in order, one per slot
+    first = seen[0][1]
+    assert [frame for _, frame in seen] == list(range(first, first + 100))
+    assert 0.15 < elapsed < 1.0
+    stats = runner.stats()
+    assert stats['iterations'] == 100
+    assert stats['skipped_periods'] == 0
+    assert stats['jitter']['p50'] < 0.002
+
+
+def test_loop_skips_the_periods_of_lost_frames(make_rig):
+    rig = make_rig(read_packets=6, rate_hz=500, init_options={'read_fifo_depth': 2})
+    seen = []
+
+    def callback(fpga, iteration):
+        seen.append(int(fpga.get_channel('In2_FXP1') * 256))
+        if iteration == 10:
+            # Far longer than the two frames the FIFO holds
+            time.sleep(0.05)
+
+    runner = LoopRunner(rig.fpga, callback, loop_rate=2000, timeout=1000)
+    rig.fpga.start_fpga_main_loop()
+    runner.run(iterations=40)
+    stats = runner.stats()
+    lost = rig.session.overflows
+    assert lost > 10
+    # The frames read jump over those the FPGA dropped, and the runner skipped about as many slots
+    gaps = [b - a - 1 for a, b in zip(seen, seen[1:]) if b - a > 1]
+    assert sum(gaps) == lost
+    assert 0 < stats['skipped_periods'] <= lost + 2
+    assert stats['deadline_misses'] >= 1
+    # The FPGA flagged the first frame it could write after dropping frames
+    assert stats['late_flags'] >= 1
+
+
+def test_late_flags_are_cross_checked_with_deadline_misses(make_rig):
+    rig = make_rig(read_packets=6)
+    late_frames(rig, {3, 7})
+    rig.push(20)
+
+    def callback(fpga, iteration):
+        if iteration in (7, 12):
+            time.sleep(0.03)
+
+    # Frames already waiting are processed straight away, so only the two slow iterations miss their deadline
+    runner = LoopRunner(rig.fpga, callback, loop_rate=20000, timeout=0)
+    runner.run(iterations=20)
+    stats = runner.stats()
+    assert stats['iterations'] == 20
+    assert (stats['late_flags'], stats['deadline_misses'], stats['late_and_missed']) == (2, 2, 1)
+    assert (stats['late_only'], stats['missed_only']) == (1, 1)
+    assert stats['max_fifo_backlog'] == 19
+    assert stats['compute_time']['max'] >= 0.03
+
+
+def test_pinning_is_optional(make_rig, monkeypatch):
+    rig = make_rig(read_packets=6)
+    rig.push(2)
+    if hasattr(os, 'sched_getaffinity'):
+        affinity = os.sched_getaffinity(0)
+        runner = LoopRunner(rig.fpga, lambda fpga, iteration: None, loop_rate=1000, timeout=0,
+                            cpu=min(affinity))
+        runner.run(iterations=1)
+        assert os.sched_getaffinity(0) == affinity
+    monkeypatch.delattr(os, 'sched_setaffinity', raising=False)
+    monkeypatch.setattr('sys.platform', 'unknown')
+    with pytest.raises(OSError):
+        pin_current_thread(0)
+    runner = LoopRunner(rig.fpga, lambda fpga, iteration: None, loop_rate=1000, timeout=0, cpu=0)
+    with pytest.warns(RuntimeWarning):
+        runner.run(iterations=1)
+    assert runner.iterations == 1
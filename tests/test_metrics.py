@@ -0,0 +1,29 @@
+from fpga_metrics import Instrumentation, LatencyHistogram
+
+
+def test_histogram_percentiles_within_precision():
+    histogram = LatencyHistogram(sub_bucket_bits=7)
+    for value in range(1, 100001):
+        histogram.record(value)
+    assert histogram.count == 100000
+    assert histogram.min == 1
+    assert histogram.max == 100000
+    for percent in (50, 99, 99.9):
+        exact = 100000 * percent / 100
+        assert exact <= histogram.percentile(percent) <= exact * (1 + 1 / 64.0)
+    histogram.record(-5)
+    assert histogram.min == 0
+
+
+def test_sampling_keeps_counters_exact():
+    metrics = Instrumentation(sample_every=4)
+    for iteration in range(100):
+        metrics.read_done(0, 10, 30, iteration % 10 == 0)
+        metrics.write_done(40, 45, 60)
+    assert metrics.frames_read == 100
+    assert metrics.frames_written == 100
+    assert metrics.late_iterations == 10
+    for stage, duration in (('fifo_read', 10), ('unpack', 20), ('user', 10), ('pack', 5), ('fifo_write', 15)):
+        histogram = metrics.histograms[stage]
+        assert histogram.count == 25
+        assert histogram.min == histogram.max == duration
@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+from fpga_pipeline import BlockReduce, Decimate, IIRFilter, Pipeline, Trigger
+
+SAMPLES = 3000
+
+
+def run():
+    rng = np.random.RandomState(3)
+    iteration = np.arange(SAMPLES)
+    return {'iteration': iteration,
+            'time': iteration / 1000.0,
+            'A': np.sin(iteration / 37.0) + 0.3 * rng.standard_normal(SAMPLES),
+            'B': (iteration // 90 % 2).astype(np.float64)}
+
+
+def chunkings():
+    rng = np.random.RandomState(4)
+    yield [SAMPLES]
+    yield [1] * SAMPLES
+    for _ in range(4):
+        sizes = []
+        while sum(sizes) < SAMPLES:
+            sizes.append(min(int(rng.choice([0, 1, 2, 7, 63, 64, 65, 200, 777])), SAMPLES - sum(sizes)))
+        yield sizes
+
+
+def process(stages, sizes):
+    pipeline = Pipeline(stages)
+    batch = run()
+    start = 0
+    for size in sizes:
+        pipeline.feed(dict((key, column[start:start + size]) for key, column in batch.items()))
+        start += size
+    pipeline.flush()
+    return pipeline.result()
+
+
+CHAINS = {
+    'decimate': lambda: [Decimate(3)],
+    'block reduce': lambda: [BlockReduce(7)],
+    'low pass, decimate': lambda: [IIRFilter.low_pass(20, 1000, ['A', 'B'], settle=True, block=16), Decimate(4)],
+    'rising trigger': lambda: [Trigger('B', 0.5, 'rising', pre=5, post=20)],
+    'filter, either trigger, block reduce': lambda: [IIRFilter([0.2, 0.1], [1, -0.7], ['A']),
+                                                     Trigger('A', 0.2, 'either', pre=3, post=10), BlockReduce(4)],
+    'above trigger, decimate': lambda: [Trigger('A', 1.2, 'above', post=8), Decimate(3)],
+}
+
+
+@pytest.mark.parametrize('chain', sorted(CHAINS))
+def test_output_does_not_depend_on_chunking(chain):
+    whole = process(CHAINS[chain](), [SAMPLES])
+    assert whole
+    for sizes in chunkings():
+        chunked = process(CHAINS[chain](), sizes)
+        assert sorted(chunked) == sorted(whole)
+        for key in whole:
+            # Filter blocks fall at other samples, which only changes the rounding
+            np.testing.assert_allclose(chunked[key], whole[key], rtol=1e-9, atol=1e-12, err_msg=key)
+
+
+def test_iir_filter_matches_difference_equation():
+    b = [0.02, 0.04, 0.02]
+    a = [1.0, -1.56, 0.64]
+    batch = run()
+    x = batch['A']
+    y = np.zeros(SAMPLES)
+    for n in range(SAMPLES):
+        y[n] = sum(b[k] * x[n - k] for k in range(3) if n >= k) - sum(a[k] * y[n - k] for k in range(1, 3) if n >= k)
+    filtered = process([IIRFilter(b, a, ['A'], block=64)], [100, 1, 500, SAMPLES - 601])
+    np.testing.assert_allclose(filtered['A'], y, rtol=1e-9, atol=1e-12)
+    np.testing.assert_array_equal(filtered['B'], batch['B'])
+
+
+def test_block_reduce_flushes_partial_block():
+    reduced = process([BlockReduce(7, channels=['A'])], [SAMPLES])
+    a = run()['A']
+    assert len(reduced['A_mean']) == -(-SAMPLES // 7)
+    assert reduced['A_max'][-1] == a[SAMPLES - SAMPLES % 7:].max()
+    np.testing.assert_array_equal(reduced['iteration'], np.arange(0, SAMPLES, 7))
+
+
+def test_trigger_windows_do_not_overlap():
+    captured = process([Trigger('B', 0.5, 'rising', pre=5, post=20)], [SAMPLES])
+    # B rises every 180 samples from sample 90 on
+    starts = captured['iteration'][captured['offset'] == 0]
+    np.testing.assert_array_equal(starts, np.arange(90, SAMPLES, 180))
+    assert np.all(np.bincount(captured['capture']) == 25)
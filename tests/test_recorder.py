@@ -0,0 +1,105 @@
+import random
+
+import numpy as np
+import pytest
+
+from fpga_config import VeriStandFPGA
+from fpga_recorder import FrameRecording
+from fpga_simulator import SimulatedSession, write_synthetic_config
+
+
+def make_fpga(tmp_path, frame_source):
+    """
+    VeriStandFPGA on a simulated session with every channel type in both directions, the I16s on a 5 V scale so
+    that decoding them with the read scale would show.
+    """
+    config_path = str(tmp_path / 'recorded.fpgaconfig')
+    write_synthetic_config(config_path, 6, 4)
+    with open(config_path) as config_file:
+        content = config_file.read().replace('<Scale>10</Scale>', '<Scale>5</Scale>')
+    with open(config_path, 'w') as config_file:
+        config_file.write(content)
+    fpga = VeriStandFPGA(config_path)
+    fpga.init_fpga(None, 1000, session=SimulatedSession(fpga, frame_source=frame_source))
+    return fpga
+
+
+def i16_value(raw):
+    return raw * 10 / 32767 if raw > 0 else raw * 10 / 32768
+
+
+def test_write_channels_round_trip(tmp_path):
+    rng = random.Random(9)
+    fpga = make_fpga(tmp_path, None)
+    path = str(tmp_path / 'writes.vsrec')
+    written = []
+    try:
+        fpga.start_recording(path)
+        samples = [{'Out2_FXP0': 3.0, 'Out2_FXP1': 7.0, 'Out4_AI0': 2.0}]
+        for _ in range(50):
+            values = dict(('Out1_DIO{}'.format(i), rng.random() < 0.5) for i in range(32))
+            values['Out2_FXP0'] = rng.randrange(1 << 23) / 256
+            values['Out2_FXP1'] = rng.randrange(1 << 23) / 256
+            values['Out3_PWM'] = rng.randrange(101)
+            for i in range(4):
+                values['Out4_AI{}'.format(i)] = i16_value(rng.randrange(-32768, 32768))
+            samples.append(values)
+        for values in samples:
+            fpga.set_channels(values)
+            fpga.vs_write_fifo(timeout=0)
+            written.append(dict((name, fpga.get_channel(name)) for this_packet in fpga.write_packet_list
+                                for name in this_packet._names))
+    finally:
+        fpga.stop_fpga()
+    with FrameRecording(path) as recording:
+        names = sorted(written[0])
+        columns = recording.decode(names)
+    assert list(columns['iteration']) == list(range(len(written)))
+    # Every value but those of the first write is exactly representable in its data type
+    for name in names:
+        expected = [values[name] for values in written[1:]]
+        if name.startswith('Out1_'):
+            assert list(columns[name][1:]) == expected, name
+        else:
+            np.testing.assert_allclose(columns[name][1:], expected, rtol=1e-12, err_msg=name)
+    # Channel 0 and 1 of the FXPI32 packet used to come back swapped, and the I16 on the read scale
+    assert (columns['Out2_FXP0'][0], columns['Out2_FXP1'][0]) == (3.0, 7.0)
+    assert columns['Out4_AI0'][0] == pytest.approx(2.0, abs=10 / 32767)
+
+
+def test_read_channels_round_trip(tmp_path):
+    rng = random.Random(10)
+    frames = [[rng.getrandbits(1)] + [rng.getrandbits(64) for _ in range(5)] for _ in range(50)]
+    fpga = make_fpga(tmp_path, lambda iteration: frames[iteration])
+    path = str(tmp_path / 'reads.vsrec')
+    try:
+        fpga.start_recording(path)
+        with fpga.session._lock:
+            fpga.read_fifo_object._elements.extend(word for frame in frames for word in frame)
+        for _ in frames:
+            fpga.vs_read_fifo(timeout=0)
+    finally:
+        fpga.stop_fpga()
+    with FrameRecording(path) as recording:
+        names = [name for this_packet in recording.read_packet_list for name in this_packet._names]
+        columns = recording.decode(names)
+        partial = recording.decode(['In4_AI1'])
+    for iteration, frame in enumerate(frames):
+        expected = {}
+        for this_packet, word in zip(fpga.read_packet_list, frame):
+            expected.update(this_packet._unpack(word))
+        assert dict((name, columns[name][iteration]) for name in names) == expected
+    assert sorted(partial) == ['In4_AI1', 'iteration', 'time']
+    np.testing.assert_array_equal(partial['In4_AI1'], columns['In4_AI1'])
+
+
+def test_directions_cannot_be_decoded_together(tmp_path):
+    fpga = make_fpga(tmp_path, None)
+    path = str(tmp_path / 'empty.vsrec')
+    fpga.start_recording(path)
+    fpga.stop_fpga()
+    with FrameRecording(path) as recording:
+        with pytest.raises(ValueError):
+            recording.decode(['In4_AI0', 'Out4_AI0'])
+        with pytest.raises(KeyError):
+            recording.decode(['AI0'])
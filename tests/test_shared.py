@@ -0,0 +1,119 @@
+import multiprocessing
+import os
+import subprocess
+import sys
+from array import array
+
+import pytest
+
+from fpga_shared import SharedChannelReader, SharedChannelTable
+
+CHANNELS = 2000
+FRAME_LENGTH = 16
+RING_FRAMES = 64
+READS = 3000
+
+
+def layout():
+    return {'read_packets': FRAME_LENGTH}
+
+
+def read_while_publishing(name, started, done, results):
+    """
+    Read the table over and over while the parent publishes, counting the reads that mix two tables.
+    """
+    torn_tables = torn_frames = 0
+    tables = set()
+    with SharedChannelReader(name) as reader:
+        handles = list(range(reader.channels))
+        started.set()
+        for _ in range(READS):
+            values = reader.read_handles(handles)
+            if values.count(values[0]) != len(values) or values[0] != reader.last_sequence:
+                torn_tables += 1
+            tables.add(reader.last_sequence)
+            frames = reader.latest_frames(RING_FRAMES)
+            indexes = [frames[start] for start in range(0, len(frames), FRAME_LENGTH)]
+            if (frames.tolist() != [index for index in indexes for _ in range(FRAME_LENGTH)]
+                    or indexes != list(range(indexes[0], indexes[0] + len(indexes)))):
+                torn_frames += 1
+    done.set()
+    results.put((torn_tables, torn_frames, len(tables)))
+
+
+def test_reader_never_sees_a_torn_snapshot():
+    # Every channel of table n holds n, from the first table published when the table is created
+    values = array('d', [1.0] * CHANNELS)
+    with SharedChannelTable(values, ['C{}'.format(i) for i in range(CHANNELS)], [], layout(),
+                            ring_frames=RING_FRAMES) as table:
+        table.publish_frames(array('Q', [frame for frame in range(RING_FRAMES) for _ in range(FRAME_LENGTH)]))
+        context = multiprocessing.get_context()
+        started, done, results = context.Event(), context.Event(), context.Queue()
+        child = context.Process(target=read_while_publishing, args=(table.name, started, done, results))
+        child.start()
+        assert started.wait(30)
+        frame = RING_FRAMES
+        while not done.is_set() and child.is_alive():
+            values[:] = array('d', [float(table.tables_published + 1)]) * CHANNELS
+            table.publish()
+            table.publish_frames(array('Q', [frame] * FRAME_LENGTH + [frame + 1] * FRAME_LENGTH))
+            frame += 2
+        torn_tables, torn_frames, tables_seen = results.get(timeout=30)
+        child.join(30)
+    assert child.exitcode == 0
+    assert (torn_tables, torn_frames) == (0, 0)
+    # The reads overlapped many publishes
+    assert tables_seen > 10
+
+
+def test_reader_reads_what_was_published():
+    values = array('d', [1.5, 0.0, 1.0])
+    with SharedChannelTable(values, ['AI0', 'DIO0', 'DIO1'], [1, 2], layout(), ring_frames=4) as table:
+        with SharedChannelReader(table.name) as reader:
+            assert reader.read() == {'AI0': 1.5, 'DIO0': False, 'DIO1': True}
+            assert reader.latest_frames(4).tolist() == []
+            values[0] = -2.25
+            table.publish()
+            assert reader.read('AI0') == {'AI0': -2.25}
+            assert reader.last_sequence == table.tables_published == 2
+            table.publish_frames([7] * FRAME_LENGTH * 6)
+            assert reader.frames_published == 6
+            assert len(reader.latest_frames(4)) == 4 * FRAME_LENGTH
+            with pytest.raises(ValueError):
+                reader.latest_frames(5)
+            with pytest.raises(KeyError):
+                reader.get_handle('AI1')
+
+
+def test_reader_process_exit_leaves_table(tmp_path):
+    # A process of its own has its own resource tracker, which would remove every block still registered on exit
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    script = ('import sys; sys.path.insert(0, {!r}); from fpga_shared import SharedChannelReader\n'
+              'with SharedChannelReader({{!r}}) as reader:\n'
+              '    print(reader.read("AI0")["AI0"])\n').format(root)
+    values = array('d', [1.5])
+    with SharedChannelTable(values, ['AI0'], [], layout()) as table:
+        for _ in range(2):
+            child = subprocess.run([sys.executable, '-c', script.format(table.name)], stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE, timeout=60)
+            assert child.returncode == 0, child.stderr
+            assert child.stdout.strip() == b'1.5'
+            assert b'leaked' not in child.stderr
+        with SharedChannelReader(table.name) as reader:
+            assert reader.read() == {'AI0': 1.5}
+
+
+def test_session_publishes_channel_table(make_rig):
+    rig = make_rig(read_packets=6)
+    fpga = rig.fpga
+    table = fpga.start_sharing(ring_frames=8)
+    try:
+        with SharedChannelReader(table.name) as reader:
+            rig.push(3)
+            for _ in range(3):
+                fpga.vs_read_fifo(timeout=0)
+            assert reader.read(['In5_DIO1', 'In2_FXP0', 'In4_AI0']) == dict(
+                (name, fpga.get_channel(name)) for name in ['In5_DIO1', 'In2_FXP0', 'In4_AI0'])
+            assert reader.latest_frames(3).tolist() == [word for i in range(3) for word in rig.frame(i)]
+    finally:
+        fpga.stop_sharing()
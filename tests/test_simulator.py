@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from fpga_simulator import LayoutFrameSource
+
+LOOPBACK = {'In4_AI2': 'Out4_AI1',
+            'In5_DIO3': 'Out1_DIO7',
+            'In2_FXP1': 'Out2_FXP0',
+            'In3_PWM': 'Out3_PWM',
+            'In6_FXP0': 'Out2_FXP1'}
+
+
+def loop_back(rig, values, timeout=5000):
+    """
+    Write values and read the first frame the simulated loop made after consuming them.
+    """
+    rig.fpga.set_channels(values)
+    rig.fpga.vs_write_fifo(timeout=0)
+    # Frames still waiting were made before the write
+    with rig.session._lock:
+        del rig.read_fifo._elements[:]
+    rig.fpga.vs_read_fifo(timeout=timeout)
+    return dict((read_name, rig.fpga.get_channel(read_name)) for read_name in LOOPBACK)
+
+
+def test_loopback_round_trips_through_the_layout(make_rig):
+    rig = make_rig(read_packets=6, write_packets=4, frame_source=None, loopback=LOOPBACK, rate_hz=2000)
+    rig.fpga.start_fpga_main_loop()
+    for ai, dio, fxp0, duty, fxp1 in [(3.3, True, 123.5, 37, 7.25),
+                                      (-9.99, False, 0, 10, 32767.99609375),
+                                      (0, True, 1 / 256, 90, 0.5)]:
+        read = loop_back(rig, {'Out4_AI1': ai, 'Out1_DIO7': dio, 'Out2_FXP0': fxp0, 'Out3_PWM': duty,
+                               'Out2_FXP1': fxp1})
+        assert read['In4_AI2'] == pytest.approx(ai, abs=10 / 32767)
+        assert read['In5_DIO3'] is dio
+        assert read['In2_FXP1'] == fxp0
+        assert read['In3_PWM'] == pytest.approx(duty)
+        assert read['In6_FXP0'] == fxp1
+
+
+def test_layout_frames_follow_the_waveforms(make_rig):
+    rig = make_rig(read_packets=6, write_packets=4)
+    source = LayoutFrameSource(rig.fpga, period=200)
+    frames = [source(iteration) for iteration in range(400)]
+    assert frames[:200] == frames[200:]
+    columns = rig.fpga.decode_read_frames(frames)
+    assert not columns['Is Late?'].any()
+    # Boolean channel i toggles every i + 1 iterations
+    np.testing.assert_array_equal(columns['In5_DIO0'], np.arange(400) % 2 == 1)
+    np.testing.assert_array_equal(columns['In5_DIO3'], np.arange(400) // 4 % 2 == 1)
+    for i in range(4):
+        assert np.abs(columns['In4_AI{}'.format(i)]).max() == pytest.approx(8, abs=0.01)
+    for name in ('In2_FXP0', 'In2_FXP1', 'In6_FXP0', 'In6_FXP1'):
+        # Sawtooth from 0 to half of the range of FXPI32 24/16
+        assert columns[name].min() == 0
+        assert columns[name].max() == pytest.approx(2 ** 14, rel=0.01)
+    assert columns['In3_PWM'].min() == pytest.approx(10, abs=0.1)
+    assert columns['In3_PWM'].max() == pytest.approx(90, abs=0.1)
+
+
+def test_loopback_rejects_unknown_channels(make_rig):
+    rig = make_rig(read_packets=6, write_packets=4)
+    with pytest.raises(KeyError):
+        LayoutFrameSource(rig.fpga, loopback={'Out4_AI1': 'Out4_AI1'})
+    with pytest.raises(KeyError):
+        LayoutFrameSource(rig.fpga, loopback={'In4_AI2': 'In4_AI1'})
@@ -0,0 +1,112 @@
+import time
+
+import numpy as np
+import pytest
+
+from conftest import wait_until
+from fpga_config import PacketError, packet_from_definition
+from test_codec import DEFINITIONS, IDS
+
+
+def valid_column(data_type, definition, i, rng, iterations):
+    if data_type == 'Boolean':
+        column = rng.choice([0.0, 1.0, 2.0, -1.0, 0.5, -0.5], size=iterations)
+    elif data_type == 'I16':
+        column = rng.uniform(-12.0, 12.0, size=iterations)
+        column[:6] = [0.0, 10.0, -10.0, 15.0, -15.0, float('nan')]
+    elif data_type == 'FXPI32':
+        full_scale = 2.0 ** (definition['FXPIWL{}'.format(i)] - 1)
+        column = rng.uniform(-1.5 * full_scale, 1.5 * full_scale, size=iterations)
+        column[:5] = [0.0, full_scale, -0.5, -1.0, 2 * full_scale]
+    else:
+        column = rng.uniform(0.0, 100.99, size=iterations)
+        column[:4] = [0.0, 100.0, 100.9, -0.9]
+    return column
+
+
+@pytest.mark.parametrize('definition', [definition for _, definition in DEFINITIONS], ids=IDS)
+def test_vectorized_pack_matches_scalar(definition):
+    rng = np.random.default_rng(3)
+    iterations = 3000
+    this_packet = packet_from_definition('write', 1, definition)
+    count = definition['channel_count']
+    columns = [valid_column(definition['data_type{}'.format(i)], definition, i, rng, iterations)
+               for i in range(count)]
+    rows = np.stack(columns, axis=1)
+    expected = []
+    for row in rows:
+        try:
+            expected.append(this_packet._pack_from(row, this_packet._positions))
+        except PacketError:
+            # Every channel of a packet of negative 32 bit FXPI32s packs to no bits, see _pack_from
+            expected.append(None)
+    if None in expected:
+        with pytest.raises(PacketError):
+            this_packet._pack_array(columns, iterations)
+        keep = np.array([value is not None for value in expected])
+        columns = [column[keep] for column in columns]
+        expected = [value for value in expected if value is not None]
+        iterations = len(expected)
+    packed = this_packet._pack_array(columns, iterations)
+    assert packed.dtype == np.uint64
+    assert packed.tolist() == expected
+
+    # A single value stands for every frame
+    first = [column[0] for column in columns]
+    assert this_packet._pack_array(first, 5).tolist() == [expected[0]] * 5
+
+
+@pytest.mark.parametrize('dutycycle', [101.0, 150.0, -1.0, -50.0])
+def test_vectorized_pack_rejects_duty_cycle_out_of_range(dutycycle):
+    this_packet = packet_from_definition('write', 1, DEFINITIONS[IDS.index('PWM 4000')][1])
+    column = np.full(10, 50.0)
+    column[7] = dutycycle
+    with pytest.raises(PacketError):
+        this_packet._pack_array([column], 10)
+
+
+def test_encode_write_frames_matches_vs_write_fifo(make_rig):
+    rig = make_rig(write_packets=8)
+    fpga = rig.fpga
+    rng = np.random.default_rng(4)
+    iterations = 200
+    stimulus = {'Out1_DIO0': rng.integers(0, 2, iterations),
+                'Out2_FXP0': rng.uniform(-100, 100, iterations),
+                'Out3_PWM': rng.uniform(0, 100, iterations),
+                'Out4_AI2': rng.uniform(-10, 10, iterations),
+                'Out8_AI0': rng.uniform(-10, 10, iterations)}
+    # Channels left out of the stimulus keep their current value
+    fpga.set_channel('Out5_DIO3', True)
+    fpga.set_channel('Out7_PWM', 30)
+    frames = fpga.encode_write_frames(stimulus)
+    assert frames.shape == (iterations, fpga.write_packets)
+    for iteration in range(iterations):
+        fpga.set_channels(dict((name, column[iteration]) for name, column in stimulus.items()))
+        fpga.vs_write_fifo(timeout=0)
+        written = rig.write_fifo._elements[-fpga.write_packets:]
+        assert frames[iteration].tolist() == written
+
+
+def test_repeated_stimulus_keeps_write_fifo_topped_up(make_rig):
+    rig = make_rig(write_packets=4, init_options={'write_fifo_depth': 64}, rate_hz=2000, fifo_depth=10 ** 6)
+    fpga = rig.fpga
+    stimulus = {'Out3_PWM': np.arange(10) * 10.0}
+    frames = fpga.encode_write_frames(stimulus)
+    writer = fpga.start_stimulus(frames, chunk_frames=16, timeout=10, repeat=True)
+    wait_until(lambda: len(rig.write_fifo._elements) > 48 * fpga.write_packets)
+    fpga.start_fpga_main_loop()
+    time.sleep(0.3)
+    assert fpga.stimulus_stats()['loops'] > 1
+    fpga.stop_stimulus()
+    stats = writer.stats()
+    # The simulated loop only runs during FIFO calls, so nothing moves once the writer has stopped
+    with rig.session._lock:
+        iterations = rig.session.iterations
+        waiting = len(rig.write_fifo._elements) // fpga.write_packets
+        last_frame = rig.session.last_write_frame
+    assert writer.error is None
+    assert not stats['done']
+    # Every loop iteration found a frame waiting in DMA_WRITE
+    assert stats['frames_written'] - waiting == iterations
+    assert iterations > 200
+    assert last_frame in frames.tolist()
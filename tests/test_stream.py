@@ -0,0 +1,121 @@
+from array import array
+
+import pytest
+
+from conftest import wait_until
+from fpga_config import ConfigError
+from fpga_stream import FrameRing
+
+
+def frames(first, count, frame_length=2):
+    return array('Q', [iteration for iteration in range(first, first + count) for _ in range(frame_length)])
+
+
+def test_ring_latest_snapshot():
+    ring = FrameRing(8, 2, max_chunk=2)
+    assert ring.latest() is None
+    ring.publish(frames(0, 2))
+    assert list(ring.latest()) == [1, 1]
+    # Publishing across the end of the buffer wraps around
+    for first in range(2, 20, 2):
+        ring.publish(frames(first, 2))
+        assert list(ring.latest()) == [first + 1, first + 1]
+
+
+def test_cursor_iterates_every_frame_in_order():
+    ring = FrameRing(8, 2, max_chunk=2)
+    ring.publish(frames(0, 2))
+    cursor = ring.cursor()
+    assert list(cursor) == []
+    seen = []
+    for first in range(2, 30, 2):
+        ring.publish(frames(first, 2))
+        assert cursor.backlog == 2
+        seen.extend(list(frame) for frame in cursor)
+        assert cursor.backlog == 0
+    assert seen == [[iteration, iteration] for iteration in range(2, 30)]
+    assert cursor.overruns == 0
+
+
+def test_cursor_counts_overruns_when_it_falls_behind():
+    ring = FrameRing(8, 2, max_chunk=2)
+    cursor = ring.cursor()
+    for first in range(0, 20, 2):
+        ring.publish(frames(first, 2))
+    assert cursor.backlog == 20
+    data = cursor.read()
+    # Only the frames a publish under way could not be overwriting are returned, the rest are counted as lost
+    kept = ring.capacity - ring.max_chunk
+    assert list(data) == list(frames(20 - kept, kept))
+    assert cursor.overruns == 20 - kept
+    assert cursor.backlog == 0
+    ring.publish(frames(20, 2))
+    assert list(cursor.read()) == list(frames(20, 2))
+    assert cursor.overruns == 20 - kept
+
+
+def test_cursor_read_limits_frames():
+    ring = FrameRing(16, 2, max_chunk=4)
+    cursor = ring.cursor()
+    ring.publish(frames(0, 4))
+    assert list(cursor.read(max_frames=3)) == list(frames(0, 3))
+    assert cursor.backlog == 1
+    assert list(cursor.read()) == list(frames(3, 1))
+
+
+def test_ring_rejects_capacity_not_above_chunk():
+    with pytest.raises(ValueError):
+        FrameRing(4, 2, max_chunk=4)
+
+
+def test_reader_streams_simulated_fifo(make_rig):
+    rig = make_rig(read_packets=6)
+    rig.push(100)
+    ring = rig.fpga.start_streaming(capacity=256, chunk_frames=8, timeout=10)
+    cursor = ring.cursor()
+    wait_until(lambda: ring.write_count == 100)
+    # The first read took 8 of the 100 frames waiting
+    stats = rig.fpga.streaming_stats()
+    assert stats['max_fifo_backlog'] == 92
+    assert stats['fifo_backlog'] == 0
+    assert stats['frames_read'] == 100
+    assert stats['reads'] >= 100 // 8
+
+    # Skip whatever the reader published before the cursor was made
+    list(cursor)
+    rig.push(50)
+    wait_until(lambda: ring.write_count == 150)
+    seen = [frame[1] & 0xFFFFFFFF for frame in cursor]
+    assert seen == list(range(100, 150))
+    assert cursor.overruns == 0
+
+    assert rig.fpga.read_latest()
+    # Frame 149 is the latest, 0b10010101 in the low bits
+    assert rig.fpga.get_channel('In5_DIO0') is True
+    assert rig.fpga.get_channel('In5_DIO1') is False
+    assert rig.fpga.get_channel('In5_DIO2') is True
+    assert rig.fpga.get_channel('In2_FXP1') == 149 / 256
+
+
+def test_reader_overruns_slow_cursor(make_rig):
+    rig = make_rig(read_packets=4)
+    ring = rig.fpga.start_streaming(capacity=32, chunk_frames=8, timeout=10)
+    cursor = ring.cursor()
+    rig.push(100)
+    wait_until(lambda: ring.write_count == 100)
+    seen = [frame[1] & 0xFFFFFFFF for frame in cursor]
+    assert seen == list(range(100 - len(seen), 100))
+    assert cursor.overruns == 100 - len(seen)
+    assert len(seen) >= ring.capacity - ring.max_chunk
+
+
+def test_direct_reads_refused_while_streaming(make_rig):
+    rig = make_rig(read_packets=4)
+    rig.fpga.start_streaming(capacity=64, chunk_frames=8, timeout=10)
+    with pytest.raises(ConfigError):
+        rig.fpga.vs_read_fifo(timeout=0)
+    with pytest.raises(ConfigError):
+        rig.fpga.start_streaming()
+    rig.fpga.stop_streaming()
+    rig.push(1)
+    rig.fpga.vs_read_fifo(timeout=0)
@@ -0,0 +1,70 @@
+import random
+
+import numpy as np
+
+
+def read_table(fpga, expected):
+    table = fpga.channel_value_table
+    return dict((name, table[name]) for name in expected)
+
+
+def full_decode(fpga, frame):
+    values = {}
+    for this_packet, word in zip(fpga.read_packet_list, frame):
+        values.update(this_packet._unpack(word))
+    return values
+
+
+def test_subscribed_reads_match_full_decode(make_rig):
+    rig = make_rig(read_packets=9)
+    fpga = rig.fpga
+    rng = random.Random(5)
+    frames = [[rng.getrandbits(1)] + [rng.getrandbits(64) for _ in range(fpga.read_packets - 1)]
+              for _ in range(160)]
+    rig.frame = lambda iteration: frames[iteration]
+    # Subscriptions change while frames keep coming, each change taking effect from the next read
+    changes = {0: ('subscribe', ['In2_FXP0', 'In5_DIO3']),
+               40: ('subscribe', ['In8_AI1', 'In3_PWM']),
+               80: ('unsubscribe', ['In2_FXP0']),
+               110: ('unsubscribe', None),
+               130: ('subscribe', ['In9_DIO31'])}
+    for iteration, frame in enumerate(frames):
+        if iteration in changes:
+            change, channels = changes[iteration]
+            if change == 'subscribe':
+                fpga.subscribe(channels)
+            else:
+                fpga.unsubscribe(channels)
+        rig.push(1)
+        if iteration % 2:
+            fpga.vs_read_fifo(timeout=0)
+        else:
+            fpga.vs_read_fifo_buffered(timeout=0)
+        expected = full_decode(fpga, frame)
+        for name in fpga.subscriptions:
+            assert fpga.get_channel_by_handle(fpga.get_handle(name)) == expected[name], (iteration, name)
+        # Channels left alone for several reads are decoded from the latest frame once asked for
+        if iteration % 7 == 6:
+            assert read_table(fpga, expected) == expected, iteration
+    assert fpga.subscriptions == frozenset(['In9_DIO31'])
+
+
+def test_batch_read_while_subscribed(make_rig):
+    rig = make_rig(read_packets=9)
+    fpga = rig.fpga
+    rng = random.Random(6)
+    frames = [[0] + [rng.getrandbits(64) for _ in range(fpga.read_packets - 1)] for _ in range(12)]
+    rig.frame = lambda iteration: frames[iteration]
+    fpga.subscribe(['In4_AI0'])
+    rig.push(2)
+    fpga.vs_read_fifo(timeout=0)
+    fpga.vs_read_fifo(timeout=0)
+    rig.push(10)
+    columns = fpga.read_fifo_batch(10, timeout=0)
+    for iteration, frame in enumerate(frames[2:]):
+        expected = full_decode(fpga, frame)
+        assert dict((name, column[iteration]) for name, column in columns.items()) == expected
+    # The table holds the last frame of the batch, not the frame pending from before it
+    expected = full_decode(fpga, frames[-1])
+    assert read_table(fpga, expected) == expected
+    assert np.asarray(columns['In4_AI0']).shape == (10,)
@@ -0,0 +1,101 @@
+import pytest
+
+from fpga_config import ConfigError, PacketError
+
+
+def test_invalid_duty_cycle_is_not_written(make_rig):
+    rig = make_rig(write_packets=4)
+    fpga = rig.fpga
+    fpga.set_channel('Out3_PWM', 50)
+    fpga.vs_write_fifo(timeout=0)
+    assert rig.write_fifo._elements[2] == (2000 << 32) | 2000
+    del rig.write_fifo._elements[:]
+
+    fpga.set_channel('Out3_PWM', 106.76)
+    for _ in range(2):
+        with pytest.raises(PacketError):
+            fpga.vs_write_fifo(timeout=0)
+        with pytest.raises(PacketError):
+            fpga.vs_write_fifo_buffered(timeout=0)
+    assert rig.write_fifo._elements == []
+
+    fpga.set_channel('Out3_PWM', 25)
+    fpga.vs_write_fifo(timeout=0)
+    assert rig.write_fifo._elements[2] == (1000 << 32) | 3000
+
+
+def test_set_channels_unknown_name(make_rig):
+    fpga = make_rig().fpga
+    with pytest.raises(ConfigError):
+        fpga.set_channels({'Out1_DIO0': True, 'No such channel': 1})
+    with pytest.raises(ConfigError):
+        fpga.get_handle('No such channel')
+
+
+def test_set_channels_unknown_name_sets_nothing(make_rig):
+    rig = make_rig(write_packets=4)
+    fpga = rig.fpga
+    fpga.vs_write_fifo(timeout=0)
+    written = list(rig.write_fifo._elements)
+    with pytest.raises(ConfigError):
+        fpga.set_channels({'Out1_DIO0': True, 'Out2_FXP0': 5.0, 'No such channel': 1})
+    assert fpga.get_channel('Out1_DIO0') is False
+    assert fpga.get_channel('Out2_FXP0') == 0
+    fpga.vs_write_fifo(timeout=0)
+    assert rig.write_fifo._elements == written * 2
+
+
+def count_packs(fpga):
+    """
+    Count the packs of each write packet, by write packet index.
+    """
+    packed = []
+    for pack_index, this_packet in enumerate(fpga.write_packet_list):
+        def pack_from(values, handles, pack_index=pack_index, pack_from=this_packet._pack_from):
+            packed.append(pack_index)
+            return pack_from(values, handles)
+        this_packet._pack_from = pack_from
+    return packed
+
+
+def test_only_changed_packets_are_packed(make_rig):
+    rig = make_rig(write_packets=4)
+    fpga = rig.fpga
+    packed = count_packs(fpga)
+
+    def write():
+        del packed[:]
+        fpga.vs_write_fifo(timeout=0)
+        return sorted(packed)
+
+    assert write() == [0, 1, 2, 3]
+    assert write() == []
+    fpga.set_channel('Out2_FXP0', 1.5)
+    assert write() == [1]
+    fpga.set_channels({'Out2_FXP1': 2.5, 'Out4_AI3': -1.0})
+    assert write() == [1, 3]
+    fpga.set_channel_by_handle(fpga.get_handle('Out1_DIO5'), True)
+    assert write() == [0]
+    # A sequence only marks the packets of the values that differ
+    values = list(fpga.channel_values)
+    fpga.set_channels(values)
+    assert write() == []
+    values[fpga.get_handle('Out3_PWM')] = 40
+    fpga.set_channels(values)
+    assert write() == [2]
+    fpga.mark_channels_changed([fpga.get_handle('Out4_AI0')])
+    assert write() == [3]
+    fpga.mark_channels_changed()
+    assert write() == [0, 1, 2, 3]
+
+
+def test_packet_is_marked_again_after_each_change(make_rig):
+    rig = make_rig(write_packets=4)
+    fpga = rig.fpga
+    for value in (1.0, 2.0, 2.0, 3.0):
+        fpga.set_channel('Out2_FXP0', value)
+        del rig.write_fifo._elements[:]
+        fpga.vs_write_fifo(timeout=0)
+        assert rig.write_fifo._elements[1] == int(value * 256)
+        fpga.vs_write_fifo_buffered(timeout=0)
+        assert rig.write_fifo._elements[5] == int(value * 256)